@@ -0,0 +1,52 @@
+"""Fixtures for the pivot benchmarks."""
+
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from synthetic import DEFAULT_PREFIX, make_synthetic
+
+DEFAULT_SIZES = "1000,10000"
+
+
+def pytest_addoption(parser: pytest.Parser) -> None:
+    """Add the option to choose the numbers of participants to benchmark."""
+    parser.addoption(
+        "--bench-sizes",
+        default=DEFAULT_SIZES,
+        help="Comma separated numbers of participants to benchmark, "
+        "e.g. 1000,10000,100000,1000000.",
+    )
+
+
+def pytest_generate_tests(metafunc: pytest.Metafunc) -> None:
+    """Run every benchmark for each of the chosen numbers of participants."""
+    if "n_participants" in metafunc.fixturenames:
+        sizes = metafunc.config.getoption("--bench-sizes").split(",")
+        metafunc.parametrize(
+            "n_participants", [int(size) for size in sizes], scope="session"
+        )
+
+
+@pytest.fixture(
+    scope="session", params=[DEFAULT_PREFIX, ""], ids=["prefixed", "unprefixed"]
+)
+def column_prefix(request: pytest.FixtureRequest) -> str:
+    """Fixture for both diagnosis column prefixes."""
+    return request.param
+
+
+@pytest.fixture(scope="session")
+def synthetic_data(n_participants: int, column_prefix: str) -> pd.DataFrame:
+    """Fixture for synthetic data of the given size and column prefix."""
+    return make_synthetic(n_participants, column_prefix=column_prefix)
+
+
+@pytest.fixture(scope="session")
+def synthetic_csv(
+    synthetic_data: pd.DataFrame, tmp_path_factory: pytest.TempPathFactory
+) -> Path:
+    """Fixture for the synthetic data written to a CSV file."""
+    path = tmp_path_factory.mktemp("synthetic") / "data.csv"
+    synthetic_data.to_csv(path, index=False)
+    return path
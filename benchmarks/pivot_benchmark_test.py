@@ -0,0 +1,93 @@
+"""Benchmarks for the stages of the pivot pipeline.
+
+Run with `pytest benchmarks`, and `--bench-sizes` to choose the numbers of
+participants. The peak traced memory of each stage is stored in the extra info of
+its benchmark.
+"""
+
+import tracemalloc
+from pathlib import Path
+from typing import Callable, Literal
+
+import pandas as pd
+import pytest
+from pytest_benchmark.fixture import BenchmarkFixture
+
+from hbnddp.hbn_ddp import HBNData
+from hbnddp.pivot import Pivot
+
+PivotLevel = Literal["diagnoses", "subcategories", "categories"]
+
+
+def _run(benchmark: BenchmarkFixture, stage: Callable[[], object]) -> None:
+    """Benchmark a stage after recording its peak memory in a separate run."""
+    tracemalloc.start()
+    try:
+        stage()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    benchmark.extra_info["peak_memory_mib"] = round(peak / 2**20, 2)
+    benchmark(stage)
+
+
+@pytest.fixture
+def hbn_data(synthetic_data: pd.DataFrame, column_prefix: str) -> HBNData:
+    """Fixture for the synthetic data."""
+    return HBNData(synthetic_data, column_prefix)
+
+
+@pytest.mark.benchmark(group="create")
+def test_create(benchmark: BenchmarkFixture, synthetic_csv: Path) -> None:
+    """Benchmark reading the diagnosis columns of a CSV file."""
+    _run(benchmark, lambda: HBNData.create(str(synthetic_csv)))
+
+
+@pytest.mark.benchmark(group="preprocess")
+def test_preprocess(benchmark: BenchmarkFixture, hbn_data: HBNData) -> None:
+    """Benchmark filling missing subcategories."""
+    _run(benchmark, hbn_data._preprocess)
+
+
+@pytest.mark.benchmark(group="extract_slots")
+def test_extract_slots(benchmark: BenchmarkFixture, hbn_data: HBNData) -> None:
+    """Benchmark extracting the diagnosis slots."""
+    data = hbn_data._preprocessed_data
+    _run(benchmark, lambda: Pivot.extract_slots(data, hbn_data.column_prefix))
+
+
+@pytest.mark.parametrize("by", ["diagnoses", "subcategories", "categories"])
+@pytest.mark.benchmark(group="pivot")
+def test_pivot(benchmark: BenchmarkFixture, hbn_data: HBNData, by: PivotLevel) -> None:
+    """Benchmark pivoting extracted slots by one level, with details."""
+    data = hbn_data._preprocessed_data
+    output = hbn_data._copy_static_columns(data, hbn_data.column_prefix)
+    slots = hbn_data._dx_slots(data, None)
+    options = {} if by == "diagnoses" else {"include_details": True}
+    pivot = getattr(Pivot, by)
+    _run(
+        benchmark,
+        lambda: pivot(
+            data, output, column_prefix=hbn_data.column_prefix, slots=slots, **options
+        ),
+    )
+
+
+@pytest.mark.parametrize("by", ["diagnoses", "subcategories", "categories", "all"])
+@pytest.mark.benchmark(group="process")
+def test_process(
+    benchmark: BenchmarkFixture,
+    synthetic_data: pd.DataFrame,
+    column_prefix: str,
+    tmp_path: Path,
+    by: Literal["diagnoses", "subcategories", "categories", "all"],
+) -> None:
+    """Benchmark processing and writing the data from scratch."""
+    input_path = str(tmp_path / "data.csv")
+    output_path = str(tmp_path / "output.csv")
+
+    def process() -> pd.DataFrame:
+        hbn_data = HBNData(synthetic_data, column_prefix, input_path=input_path)
+        return hbn_data.process(output_path=output_path, by=by, include_details=True)
+
+    _run(benchmark, process)
@@ -0,0 +1,174 @@
+"""Synthetic HBN clinician consensus data for benchmarks."""
+
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import typer
+
+from hbnddp.pivot import CERTAINTY_FLAGS
+
+DEFAULT_PREFIX = "Diagnosis_ClinicianConsensus,"
+
+FIXTURE_PATH = Path(__file__).parents[1] / "tests" / "test_data.csv"
+
+# Share of participants with a diagnosis that have at least n filled slots, from
+# the test fixture
+SLOT_FILL_RATES = [1.0, 0.7, 0.43, 0.16, 0.11, 0.11, 0.04, 0.012, 0.006, 0.0025]
+
+# Share of participants whose first slot holds no diagnosis
+NO_DIAGNOSIS_RATES = {
+    "No Diagnosis Given": 0.06,
+    "No Diagnosis Given: Incomplete Eval": 0.12,
+}
+
+# Chance of each certainty flag being set on a diagnosis
+CERTAINTY_RATES = {
+    "_ByHx": 0.02,
+    "_Confirmed": 0.87,
+    "_Presum": 0.05,
+    "_RC": 0.03,
+    "_RuleOut": 0.03,
+}
+
+# Chance of a second flag being set, which resolves to an unknown certainty
+MULTIPLE_FLAGS_RATE = 0.01
+
+PAST_RATE = 0.05
+PAST_DOC_RATE = 0.02
+SPEC_RATE = 0.07
+
+
+def _where(mask: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Keep the values where the mask is set, with missing values elsewhere."""
+    if values.dtype.kind == "f":
+        return np.where(mask, values, np.nan)
+    output = np.full(len(mask), None, dtype=object)
+    output[mask] = values[mask]
+    return output
+
+
+def diagnosis_catalogue(path: Path = FIXTURE_PATH) -> pd.DataFrame:
+    """Read every diagnosis of the fixture with its category, subcategory and code.
+
+    Each diagnosis is weighted by how often it occurs in the fixture.
+    """
+    data = pd.read_csv(path, low_memory=False)
+    slots = pd.concat(
+        [
+            data[
+                [
+                    f"{DEFAULT_PREFIX}DX_{n:02d}{suffix}"
+                    for suffix in ["", "_Cat", "_Sub", "_Code"]
+                ]
+            ].set_axis(["diagnosis", "cat", "sub", "code"], axis=1)
+            for n in range(1, 11)
+        ]
+    ).dropna(subset=["diagnosis"])
+    slots = slots[~slots["diagnosis"].isin(NO_DIAGNOSIS_RATES)]
+    catalogue = slots.drop_duplicates("diagnosis").set_index("diagnosis")
+    catalogue["weight"] = slots["diagnosis"].value_counts()
+    catalogue["weight"] /= catalogue["weight"].sum()
+    return catalogue.reset_index()
+
+
+def make_synthetic(
+    n_participants: int,
+    column_prefix: str = DEFAULT_PREFIX,
+    seed: int = 0,
+    catalogue: pd.DataFrame | None = None,
+) -> pd.DataFrame:
+    """Generate clinician consensus data for the given number of participants.
+
+    Slots are filled in order with the fill rates of the fixture, and diagnoses
+    are drawn from the fixture catalogue with their category, subcategory and
+    code. Diagnoses have a single certainty flag set or, rarely, two.
+
+    Args:
+        n_participants: The number of rows to generate.
+        column_prefix: The prefix of the diagnosis columns, either
+        "Diagnosis_ClinicianConsensus," or "".
+        seed: The seed of the random generator.
+        catalogue: Optional diagnosis catalogue, defaults to the fixture one.
+
+    Returns:
+        The generated data.
+    """
+    rng = np.random.default_rng(seed)
+    if catalogue is None:
+        catalogue = diagnosis_catalogue()
+    n = n_participants
+    no_dx = rng.choice(
+        np.array([*NO_DIAGNOSIS_RATES, None], dtype=object),
+        size=n,
+        p=[*NO_DIAGNOSIS_RATES.values(), 1 - sum(NO_DIAGNOSIS_RATES.values())],
+    )
+    n_slots = np.searchsorted(-np.array(SLOT_FILL_RATES), -rng.random(n), "right")
+    n_slots = np.where(pd.notna(no_dx), 1, np.maximum(n_slots, 1))
+
+    columns: dict[str, np.ndarray] = {
+        "Identifiers": np.char.add(
+            np.char.add("NDAR", np.char.zfill(np.arange(n).astype(str), 8)),
+            ",assessment",
+        ).astype(object),
+        f"{column_prefix}NoDX": rng.integers(1, 4, n).astype(float),
+        f"{column_prefix}Season": rng.choice(["Fall", "Spring", "Summer", "Winter"], n),
+        f"{column_prefix}Site": rng.integers(1, 5, n),
+        f"{column_prefix}Year": rng.integers(2015, 2023, n),
+    }
+    flag_suffixes = list(CERTAINTY_FLAGS.values())
+    for slot in range(1, 11):
+        col = f"{column_prefix}DX_{slot:02d}"
+        filled = n_slots >= slot
+        no_diagnosis = filled & pd.notna(no_dx) & (slot == 1)
+        has_dx = filled & ~no_diagnosis
+        picks = catalogue.iloc[
+            rng.choice(len(catalogue), n, p=catalogue["weight"].to_numpy())
+        ]
+        for suffix, field in [
+            ("", "diagnosis"),
+            ("_Cat", "cat"),
+            ("_Sub", "sub"),
+            ("_Code", "code"),
+        ]:
+            values = _where(has_dx, picks[field].to_numpy())
+            if field != "sub":
+                values[no_diagnosis] = no_dx[no_diagnosis]
+            columns[f"{col}{suffix}"] = values
+        columns[f"{col}_Spec"] = _where(
+            has_dx & (rng.random(n) < SPEC_RATE), np.full(n, "Specifier", object)
+        )
+        columns[f"{col}_Past_Doc"] = _where(
+            has_dx & (rng.random(n) < PAST_DOC_RATE), np.ones(n)
+        )
+
+        flag = rng.choice(
+            len(flag_suffixes),
+            n,
+            p=[CERTAINTY_RATES[suffix] for suffix in flag_suffixes],
+        )
+        second_flag = np.where(
+            rng.random(n) < MULTIPLE_FLAGS_RATE, (flag + 1) % len(flag_suffixes), flag
+        )
+        for i, suffix in enumerate(flag_suffixes):
+            set_flag = (flag == i) | (second_flag == i)
+            columns[f"{col}{suffix}"] = _where(has_dx, set_flag.astype(float))
+
+        # Time course diagnoses resolve to a specific time course whatever the code
+        time = np.where(rng.random(n) < PAST_RATE, 2.0, 1.0)
+        columns[f"{col}_Time"] = _where(has_dx, time)
+    return pd.DataFrame(columns)
+
+
+def main(
+    n_participants: int,
+    output_path: Path,
+    column_prefix: str = DEFAULT_PREFIX,
+    seed: int = 0,
+) -> None:
+    """Write synthetic data for the given number of participants to a CSV file."""
+    make_synthetic(n_participants, column_prefix, seed).to_csv(output_path, index=False)
+
+
+if __name__ == "__main__":
+    typer.run(main)
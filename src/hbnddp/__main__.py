@@ -1,20 +1,225 @@
 """Main script for CLI run."""
 
+from enum import Enum
+from typing import Annotated, Literal, Optional, cast
+
 import typer
+from click.core import ParameterSource
 
+from hbnddp.batch import expand_inputs, process_files, summary
+from hbnddp.cache import DEFAULT_MAX_BYTES, ResultCache
 from hbnddp.hbn_ddp import HBNData
-from hbnddp.prompting import Interactive
+from hbnddp.pivot import DetailsFormat
+from hbnddp.profiling import Profiler
+from hbnddp.viz import ImageFormat
 
 app = typer.Typer(
     help="CLI for preprocessing HBN diagnostic data.",
 )
 
+# Options that may be combined with the interactive prompts
+INTERACTIVE_OPTIONS = {"profile", "profile_memory", "pivot_profile"}
+
+
+class DetailsFormatOption(str, Enum):
+    """Formats to store diagnosis level details in."""
+
+    repr = "repr"
+    json = "json"
+    long = "long"
+
+
+class VizFormat(str, Enum):
+    """Formats to save bar plots in."""
+
+    png = "png"
+    svg = "svg"
+    html = "html"
+
+
+class PivotBy(str, Enum):
+    """Levels of detail to pivot the data by."""
+
+    diagnoses = "diagnoses"
+    subcategories = "subcategories"
+    categories = "categories"
+    all = "all"
+
 
 @app.command()
-def main() -> None:
-    """Main function for CLI run."""
+def main(
+    ctx: typer.Context,
+    inputs: Annotated[
+        Optional[list[str]],
+        typer.Argument(
+            help="Paths or glob patterns of the HBN data files to process. "
+            "Runs the interactive prompts when no arguments are given.",
+            show_default=False,
+        ),
+    ] = None,
+    output: Annotated[
+        Optional[str],
+        typer.Option(
+            "--output",
+            "-o",
+            help="Output file for a single input, or directory to write the output "
+            "of every input to. Defaults to files next to the inputs.",
+        ),
+    ] = None,
+    by: Annotated[
+        PivotBy, typer.Option(help="Level of detail to pivot the data by.")
+    ] = PivotBy.all,
+    certainty: Annotated[
+        Optional[list[str]],
+        typer.Option(
+            help="Certainty of the diagnoses to include, repeat for several. "
+            "Defaults to all."
+        ),
+    ] = None,
+    include_details: Annotated[
+        bool,
+        typer.Option(
+            help="Include diagnosis level details when pivoting by "
+            "subcategories or categories."
+        ),
+    ] = False,
+    details_format: Annotated[
+        DetailsFormatOption,
+        typer.Option(
+            help="Format of the details, a repr or JSON column, or a long table "
+            "written next to the output."
+        ),
+    ] = DetailsFormatOption.repr,
+    viz: Annotated[
+        bool, typer.Option(help="Save bar plots of the processed data.")
+    ] = False,
+    viz_format: Annotated[
+        VizFormat,
+        typer.Option(
+            help="Format of the bar plots, png or svg images, or html files "
+            "that are not rendered."
+        ),
+    ] = VizFormat.png,
+    output_format: Annotated[
+        Optional[str],
+        typer.Option(help="Output format, csv, parquet or feather."),
+    ] = None,
+    vocabulary: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Vocabulary registry file to pivot every input to the same "
+            "columns. Created if missing and extended with new values."
+        ),
+    ] = None,
+    fixed_schema: Annotated[
+        bool,
+        typer.Option(
+            help="Pivot to the columns of the vocabulary as they are, leaving out "
+            "values it does not hold."
+        ),
+    ] = False,
+    cache_dir: Annotated[
+        Optional[str],
+        typer.Option(
+            help="Directory to cache processed results in, reused when the same "
+            "file is processed with the same options."
+        ),
+    ] = None,
+    cache_max_mb: Annotated[
+        int,
+        typer.Option(help="Total size of the cached results to keep, in MB."),
+    ] = DEFAULT_MAX_BYTES // 1024**2,
+    clear_cache: Annotated[
+        bool,
+        typer.Option(help="Remove all results from the cache directory first."),
+    ] = False,
+    jobs: Annotated[
+        int,
+        typer.Option(
+            "--jobs",
+            "-j",
+            help="Number of files to process at the same time, -1 for one per CPU.",
+        ),
+    ] = 1,
+    profile: Annotated[
+        bool, typer.Option(help="Print the time spent in each processing stage.")
+    ] = False,
+    profile_memory: Annotated[
+        bool,
+        typer.Option(help="Also record the peak memory of each stage when profiling."),
+    ] = False,
+    pivot_profile: Annotated[
+        Optional[str],
+        typer.Option(help="Path to write a cProfile dump of the pivot step to."),
+    ] = None,
+) -> None:
+    """Process HBN data files, or prompt for the options when none are given."""
+    profiler = (
+        Profiler(track_memory=profile_memory, pivot_profile_path=pivot_profile)
+        if profile or profile_memory or pivot_profile is not None
+        else None
+    )
+    if clear_cache:
+        if cache_dir is None:
+            raise typer.BadParameter(
+                "A cache directory is required to clear.", param_hint="--cache-dir"
+            )
+        removed = ResultCache(cache_dir).clear()
+        typer.echo(f"Removed {removed} cached results from {cache_dir}")
+        if not inputs:
+            return
+    if not inputs:
+        batch_options = [
+            name
+            for name in ctx.params
+            if name not in INTERACTIVE_OPTIONS
+            and ctx.get_parameter_source(name) != ParameterSource.DEFAULT
+        ]
+        if batch_options:
+            raise typer.BadParameter(
+                "Input files are required with the processing options.",
+                param_hint="INPUTS",
+            )
+        _interactive(profiler, profile)
+    else:
+        try:
+            input_paths = expand_inputs(inputs)
+            results = process_files(
+                input_paths,
+                output=output,
+                by=cast(
+                    Literal["diagnoses", "subcategories", "categories", "all"],
+                    by.value,
+                ),
+                certainty_filter=certainty,
+                include_details=include_details,
+                details_format=cast(DetailsFormat, details_format.value),
+                viz=viz,
+                viz_format=cast(ImageFormat, viz_format.value),
+                output_format=output_format,
+                workers=jobs,
+                profiler=profiler,
+                vocabulary=vocabulary,
+                fixed_schema=fixed_schema,
+                cache_dir=cache_dir,
+                cache_max_bytes=cache_max_mb * 1024**2,
+            )
+        except (FileNotFoundError, ValueError) as e:
+            raise typer.BadParameter(str(e)) from e
+        typer.echo(summary(results))
+        if profile and profiler is not None:
+            typer.echo(profiler.stats.report())
+        if any(result.error is not None for result in results):
+            raise typer.Exit(code=1)
+
+
+def _interactive(profiler: Profiler | None, profile: bool) -> None:
+    """Prompt for the options and process the chosen file."""
+    # Imported on first use, so that batch runs do not load the prompt stack
+    from hbnddp.prompting import Interactive
+
     args = Interactive.prompt()
-    data = HBNData.create(args["input_path"])
+    data = HBNData.create(args["input_path"], profiler=profiler)
     data.process(
         output_path=args["output_path"],
         by=args["by"],
@@ -22,6 +227,8 @@ def main() -> None:
         include_details=args["include_details"],
         viz=args["viz"],
     )
+    if profile and data.stats is not None:
+        typer.echo(data.stats.report())
 
 
 if __name__ == "__main__":
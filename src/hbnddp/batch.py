@@ -0,0 +1,344 @@
+"""Batch processing of several HBN data files."""
+
+import glob
+import logging
+import os
+import time
+from contextlib import nullcontext
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable, Iterable, Literal
+
+from .cache import DEFAULT_MAX_BYTES, ResultCache
+from .hbn_ddp import VALID_CERTAINTIES, HBNData
+from .pivot import DetailsFormat, Pivot
+from .profiling import Profiler
+from .utils import default_output_path, get_file_format, read, read_columns
+from .viz import FIGURES_DIR, ImageFormat, render_session
+from .vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FileResult:
+    """Dataclass for storing the outcome of processing one file."""
+
+    input_path: str
+    output_path: str
+    rows: int
+    seconds: float
+    error: str | None = None
+
+    @property
+    def rows_per_second(self) -> float:
+        """The number of rows processed per second."""
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+def expand_inputs(patterns: list[str]) -> list[str]:
+    """Expand glob patterns to the files they match, in order and without repeats.
+
+    Raises:
+        FileNotFoundError: If a pattern or path matches no file.
+    """
+    paths: list[str] = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        matches = [match for match in matches if Path(match).is_file()]
+        if not matches:
+            raise FileNotFoundError(f"No files found for {pattern}.")
+        paths.extend(match for match in matches if match not in paths)
+    return paths
+
+
+def input_subdirectories(input_paths: list[str]) -> list[str]:
+    """Get the directory of every input relative to the common one of all inputs.
+
+    Inputs with the same file name in different directories are kept apart by
+    writing their outputs and plots to these subdirectories. Inputs in a single
+    directory have none.
+    """
+    directories = [os.path.dirname(os.path.abspath(path)) for path in input_paths]
+    if not directories:
+        return []
+    root = os.path.commonpath(directories)
+    return [
+        "" if directory == root else os.path.relpath(directory, root)
+        for directory in directories
+    ]
+
+
+def output_path_for(
+    input_path: str,
+    by: str,
+    output: str | None,
+    output_format: str | None,
+    in_directory: bool,
+    subdirectory: str = "",
+) -> str:
+    """Get the output path of an input file.
+
+    Without an output, the file is written next to the input. With in_directory,
+    the output is a directory to write the file to, under its default name in
+    the given subdirectory.
+    """
+    file_format = get_file_format(None, output_format)
+    if output is None:
+        return default_output_path(input_path, by, file_format)
+    if in_directory:
+        default_name = os.path.basename(
+            default_output_path(input_path, by, file_format)
+        )
+        return os.path.join(output, subdirectory, default_name)
+    return output
+
+
+def _process_file(
+    input_path: str,
+    output_path: str,
+    process_options: dict[str, Any],
+    profiler: Profiler | None = None,
+) -> FileResult:
+    """Process one file, recording the error instead of raising it."""
+    start = time.perf_counter()
+    try:
+        hbn_data = HBNData.create(input_path, profiler=profiler)
+        output = hbn_data.process(output_path=output_path, **process_options)
+    except Exception as e:
+        logger.error("Processing %s failed: %s", input_path, e)
+        return FileResult(
+            input_path, output_path, 0, time.perf_counter() - start, str(e)
+        )
+    return FileResult(input_path, output_path, len(output), time.perf_counter() - start)
+
+
+def process_files(
+    input_paths: list[str],
+    output: str | None = None,
+    by: Literal[
+        "diagnoses",
+        "subcategories",
+        "categories",
+        "all",
+    ] = "all",
+    certainty_filter: list[str] | None = None,
+    include_details: bool = False,
+    details_format: DetailsFormat = "repr",
+    viz: bool = False,
+    output_format: str | None = None,
+    workers: int = 1,
+    profiler: Profiler | None = None,
+    vocabulary: str | None = None,
+    fixed_schema: bool = False,
+    cache_dir: str | None = None,
+    cache_max_bytes: int = DEFAULT_MAX_BYTES,
+    viz_format: ImageFormat = "png",
+) -> list[FileResult]:
+    """Process several files, concurrently in a process pool.
+
+    A file that fails to process does not stop the others, its error is stored
+    in its result instead.
+
+    Args:
+        input_paths: The paths of the HBN data files.
+        output: The output file for a single input, or the directory to write
+        the output of every input to. Inputs from several directories are
+        written to their directories relative to the common one of all inputs.
+        Defaults to files next to the inputs.
+        by: The level of detail to pivot the data by.
+        certainty_filter: The list of certainties to include. Default is None,
+        which will include all.
+        include_details: When pivoting by category or subcategory, whether to
+        include diagnosis level details.
+        details_format: How to store the details, "repr", "json" or "long".
+        viz: Whether to save bar plots of every file. With several inputs, the
+        plots of each are saved to a directory named after it in ./figures,
+        under the same subdirectory as its output.
+        output_format: The format to save the processed data in, "csv",
+        "parquet" or "feather". Defaults to the format of the output extension.
+        workers: The number of files to process at the same time, -1 for one
+        per CPU. Default is 1.
+        profiler: Optional profiler to measure the stages of every file with.
+        Files are then processed one at a time, since the measurements of worker
+        processes are not returned.
+        vocabulary: Optional path of a Vocabulary registry file, so that every
+        file is pivoted to the same columns. The registry is created if the file
+        does not exist, and extended with the values of all inputs and saved
+        before processing.
+        fixed_schema: Whether to pivot to the columns of the registry as they
+        are, without extending it.
+        cache_dir: Optional directory of a ResultCache to reuse the results of
+        files processed before with the same options.
+        cache_max_bytes: The total size of the cached results to keep.
+        viz_format: The format to save the bar plots in, "png", "svg" or "html".
+        Files processed one at a time share one kaleido browser to render them.
+
+    Returns:
+        The result of every file, in the order of the inputs.
+
+    Raises:
+        ValueError: If the certainty filter is invalid, a fixed schema is
+        requested without a registry, or two inputs have the same output path.
+    """
+    if certainty_filter is not None:
+        invalid_certs = set(certainty_filter) - set(VALID_CERTAINTIES)
+        if invalid_certs:
+            raise ValueError(
+                f"Invalid certainty values: {invalid_certs}. "
+                f"Valid values are: {VALID_CERTAINTIES}"
+            )
+    if vocabulary is None and fixed_schema:
+        raise ValueError("A fixed schema requires a vocabulary registry.")
+    in_directory = output is not None and (
+        len(input_paths) > 1 or Path(output).is_dir()
+    )
+    subdirectories = input_subdirectories(input_paths)
+    output_paths = [
+        output_path_for(path, by, output, output_format, in_directory, subdirectory)
+        for path, subdirectory in zip(input_paths, subdirectories)
+    ]
+    targets = [os.path.abspath(path) for path in output_paths]
+    duplicates = sorted({path for path in targets if targets.count(path) > 1})
+    if duplicates:
+        raise ValueError(f"Several inputs would be written to {duplicates}.")
+    if in_directory:
+        for output_path in output_paths:
+            os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    figures_dirs = [
+        (
+            os.path.join(FIGURES_DIR, subdirectory, Path(path).stem)
+            if len(input_paths) > 1
+            else FIGURES_DIR
+        )
+        for path, subdirectory in zip(input_paths, subdirectories)
+    ]
+    process_options: dict[str, Any] = {
+        "by": by,
+        "certainty_filter": certainty_filter,
+        "include_details": include_details,
+        "details_format": details_format,
+        "viz": viz,
+        "viz_format": viz_format,
+        "output_format": output_format,
+        "cache": (
+            None if cache_dir is None else ResultCache(cache_dir, cache_max_bytes)
+        ),
+    }
+    if workers == -1:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(input_paths))
+    if workers <= 1 or profiler is not None:
+        registry = None
+        if vocabulary is not None:
+            registry = _load_vocabulary(vocabulary, input_paths, fixed_schema)
+        session = render_session() if viz and viz_format != "html" else nullcontext()
+        with session:
+            return [
+                _process_file(
+                    input_path,
+                    output_path,
+                    process_options
+                    | {
+                        "vocabulary": registry,
+                        "fixed_schema": registry is not None,
+                        "figures_dir": figures_dir,
+                    },
+                    profiler,
+                )
+                for input_path, output_path, figures_dir in zip(
+                    input_paths, output_paths, figures_dirs
+                )
+            ]
+    from concurrent.futures import ProcessPoolExecutor
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        registry = None
+        if vocabulary is not None:
+            registry = _load_vocabulary(
+                vocabulary, input_paths, fixed_schema, executor.map
+            )
+        return list(
+            executor.map(
+                _process_file,
+                input_paths,
+                output_paths,
+                [
+                    process_options
+                    | {
+                        "vocabulary": registry,
+                        "fixed_schema": registry is not None,
+                        "figures_dir": figures_dir,
+                    }
+                    for figures_dir in figures_dirs
+                ],
+            )
+        )
+
+
+def _load_vocabulary(
+    path: str,
+    input_paths: list[str],
+    fixed_schema: bool,
+    map_function: Callable[..., Iterable[Any]] = map,
+) -> Vocabulary:
+    """Load a registry, extending it with the values of the inputs unless fixed.
+
+    The values of every input are read with map_function, such as the map of
+    the process pool that then processes the inputs, and registered in the
+    order of the inputs. Inputs that cannot be read are skipped here, and
+    reported when processed.
+    """
+    registry = Vocabulary.load_or_create(path)
+    if fixed_schema:
+        return registry
+    for input_path, found in zip(
+        input_paths, map_function(_file_vocabulary, input_paths)
+    ):
+        if isinstance(found, str):
+            logger.warning("Skipping %s for the vocabulary: %s", input_path, found)
+            continue
+        registry.merge(found)
+    registry.save(path)
+    return registry
+
+
+def _file_vocabulary(input_path: str) -> Vocabulary | str:
+    """Get the vocabulary of one input, or the error reading it.
+
+    Only the diagnosis, subcategory and category columns are read.
+    """
+    try:
+        columns = read_columns(input_path)
+        column_prefix = HBNData._detect_column_prefix(columns)
+        value_columns = {
+            f"{column_prefix}DX_{n}{suffix}"
+            for n in Pivot.DX_NS
+            for suffix in ["", "_Sub", "_Cat"]
+        }
+        data = read(input_path, columns=[c for c in columns if c in value_columns])
+        vocabulary = Vocabulary()
+        vocabulary.update(
+            HBNData(data, column_prefix)._preprocessed_data, column_prefix
+        )
+    except Exception as e:
+        return str(e)
+    return vocabulary
+
+
+def summary(results: list[FileResult]) -> str:
+    """Format the rows and throughput of every file as a table."""
+    width = max([len("File"), *(len(result.input_path) for result in results)]) + 2
+    lines = [f"{'File':<{width}}{'Rows':>10}{'Seconds':>10}{'Rows/s':>14}  Output"]
+    for result in results:
+        outcome = (
+            result.output_path if result.error is None else f"FAILED: {result.error}"
+        )
+        lines.append(
+            f"{result.input_path:<{width}}{result.rows:>10,}{result.seconds:>10.3f}"
+            f"{result.rows_per_second:>14,.0f}  {outcome}"
+        )
+    rows = sum(result.rows for result in results)
+    seconds = sum(result.seconds for result in results)
+    lines.append(f"{'Total':<{width}}{rows:>10,}{seconds:>10.3f}")
+    return "\n".join(lines)
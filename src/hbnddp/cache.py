@@ -0,0 +1,163 @@
+"""On-disk cache of processed results, keyed on the input and the parameters."""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+from pathlib import Path
+from typing import Any
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Version of the cache entry layout, part of every key
+CACHE_FORMAT = 1
+
+# Default bound of the total size of the cache entries
+DEFAULT_MAX_BYTES = 1024**3
+
+
+def package_version() -> str:
+    """Get the installed version of the package, or "unknown" from a checkout."""
+    from importlib import metadata
+
+    try:
+        return metadata.version("hbn-ddp")
+    except metadata.PackageNotFoundError:
+        return "unknown"
+
+
+def data_digest(data: pd.DataFrame) -> str:
+    """Get a digest of the columns and values of a data frame."""
+    digest = hashlib.sha256(json.dumps(list(map(str, data.columns))).encode())
+    digest.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+class ResultCache:
+    """Directory of processed results, evicting the least recently used.
+
+    Every entry is a pickle of the processed data and its details table, named
+    by a hash of the input content, the column prefix, the processing
+    parameters and the package version, so that any change to them is a miss.
+    Pickles keep the exact dtypes, sparse columns and repeated column names of
+    the processed data. Entries are written atomically, so processes may share
+    a cache directory. Only load caches written by yourself, since unpickling
+    can run arbitrary code.
+    """
+
+    def __init__(self, directory: str, max_bytes: int = DEFAULT_MAX_BYTES) -> None:
+        """Initialize the cache, creating its directory if needed.
+
+        Args:
+            directory: The directory to store the entries in.
+            max_bytes: The total size of the entries to keep. The least recently
+            used entries are removed when a new entry exceeds it.
+        """
+        self.directory = Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    @staticmethod
+    def key(content_digest: str, column_prefix: str, parameters: dict[str, Any]) -> str:
+        """Get the key of a result from the digest of its input and parameters."""
+        identity = {
+            "format": CACHE_FORMAT,
+            "version": package_version(),
+            "content": content_digest,
+            "column_prefix": column_prefix,
+            "parameters": parameters,
+        }
+        return hashlib.sha256(
+            json.dumps(identity, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        """Get the path of the entry of a key."""
+        return self.directory / f"{key}.pkl"
+
+    def get(self, key: str) -> tuple[pd.DataFrame, pd.DataFrame | None] | None:
+        """Get the processed data and details of a key, or None on a miss.
+
+        Entries that cannot be loaded, such as those pickled with other versions
+        of pandas or numpy, are removed and are a miss.
+        """
+        path = self._path(key)
+        try:
+            with open(path, "rb") as file:
+                entry = pickle.load(file)
+            output, details = entry["output"], entry["details"]
+            # Mark the entry as recently used
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning("Removing unreadable cache entry %s: %s", path, e)
+            path.unlink(missing_ok=True)
+            return None
+        logger.info("Loaded cached result %s", key)
+        return output, details
+
+    def put(
+        self, key: str, output: pd.DataFrame, details: pd.DataFrame | None = None
+    ) -> None:
+        """Store the processed data and details of a key, then evict old entries."""
+        path = self._path(key)
+        temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        with open(temporary_path, "wb") as file:
+            pickle.dump(
+                {"output": output, "details": details},
+                file,
+                protocol=pickle.HIGHEST_PROTOCOL,
+            )
+        os.replace(temporary_path, path)
+        self.evict(keep=path)
+
+    def _entry_sizes(self) -> list[tuple[Path, int]]:
+        """Get the path and size of the entries, least recently used first."""
+        entries = []
+        for path in self.directory.glob("*.pkl"):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                # Removed by another process
+                continue
+            entries.append((stat.st_mtime_ns, path, stat.st_size))
+        return [(path, size) for _, path, size in sorted(entries)]
+
+    def entries(self) -> list[Path]:
+        """Get the paths of the entries, least recently used first."""
+        return [path for path, _ in self._entry_sizes()]
+
+    def size(self) -> int:
+        """Get the total size of the entries in bytes."""
+        return sum(size for _, size in self._entry_sizes())
+
+    def evict(self, keep: Path | None = None) -> None:
+        """Remove the least recently used entries until the cache fits its bound.
+
+        The kept entry is not removed, even if it alone exceeds the bound.
+        """
+        entries = self._entry_sizes()
+        total = sum(size for _, size in entries)
+        for path, size in entries:
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            path.unlink(missing_ok=True)
+            total -= size
+            logger.info("Evicted cache entry %s", path.name)
+
+    def clear(self) -> int:
+        """Remove all entries of the cache.
+
+        Returns:
+            The number of removed entries.
+        """
+        entries = self.entries()
+        for path in entries:
+            path.unlink(missing_ok=True)
+        return len(entries)
@@ -0,0 +1,306 @@
+"""Inverted index of the participants with each value, for cohort selection."""
+
+import json
+from dataclasses import dataclass, field
+from typing import Any, Iterable
+
+import numpy as np
+import pandas as pd
+
+from .pivot import TIME_DTYPE, CertaintyLevel
+
+# Version of the saved index layout
+INDEX_FORMAT = 1
+
+# Qualifiers of the slots that values are indexed by, with the values they take
+QUALIFIERS = {
+    "certainty": [level.value for level in CertaintyLevel],
+    "time": list(TIME_DTYPE.categories),
+}
+
+# Number of set bits of every byte
+_POPCOUNT = np.array([bin(byte).count("1") for byte in range(256)], dtype=np.int64)
+
+# Key of a set of participants: a level and a value, optionally followed by a
+# qualifier and its value, or a static column and its value
+IndexKey = tuple[str, ...]
+
+
+def key_value(value: Any) -> str:  # noqa: ANN401
+    """Get the text of a value in the index keys, with integral floats as integers.
+
+    Static columns read from CSV files hold numbers such as 1.0 when they have
+    missing values, which are looked up as 1.
+    """
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value)
+
+
+def _pack(rows: np.ndarray, n_rows: int) -> np.ndarray:
+    """Pack the given row positions into a bitset of n_rows bits."""
+    flags = np.zeros(n_rows, dtype=bool)
+    flags[rows] = True
+    return np.packbits(flags)
+
+
+def _group_bitsets(
+    frame: pd.DataFrame, by: list[str], n_rows: int, prefix: IndexKey = ()
+) -> dict[IndexKey, np.ndarray]:
+    """Get the bitset of the rows of every group of a frame with a row column.
+
+    Groups with a missing key are left out.
+    """
+    grouped = frame.groupby(by if len(by) > 1 else by[0], observed=True, sort=True)
+    rows = frame["row"].to_numpy()
+    return {
+        (*prefix, *(key if isinstance(key, tuple) else (key,))): _pack(
+            rows[positions], n_rows
+        )
+        for key, positions in grouped.indices.items()
+    }
+
+
+@dataclass(eq=False)
+class Cohort:
+    """Set of the participants of an index, as a bitset with one bit each.
+
+    Cohorts of the same index are combined with & (and), | (or), - (and not) and
+    ~ (not), which work on whole bytes of the bitsets.
+    """
+
+    bits: np.ndarray
+    index: "CohortIndex" = field(repr=False)
+
+    def _check(self, other: "Cohort") -> None:
+        """Check that another cohort is of the same index."""
+        if other.index is not self.index:
+            raise ValueError("Only cohorts of the same index can be combined.")
+
+    def __and__(self, other: "Cohort") -> "Cohort":
+        """Get the participants in both cohorts."""
+        self._check(other)
+        return Cohort(self.bits & other.bits, self.index)
+
+    def __or__(self, other: "Cohort") -> "Cohort":
+        """Get the participants in either cohort."""
+        self._check(other)
+        return Cohort(self.bits | other.bits, self.index)
+
+    def __sub__(self, other: "Cohort") -> "Cohort":
+        """Get the participants in this cohort but not the other."""
+        self._check(other)
+        return Cohort(self.bits & ~other.bits, self.index)
+
+    def __invert__(self) -> "Cohort":
+        """Get the participants not in this cohort."""
+        return Cohort(~self.bits & self.index.everyone().bits, self.index)
+
+    def __len__(self) -> int:
+        """Get the number of participants in the cohort."""
+        return int(_POPCOUNT[self.bits].sum())
+
+    def __contains__(self, identifier: str) -> bool:
+        """Check whether a participant is in the cohort."""
+        return bool((self.index.of([identifier]).bits & self.bits).any())
+
+    def mask(self) -> np.ndarray:
+        """Get a boolean mask of the cohort over the rows of the data."""
+        return np.unpackbits(self.bits, count=len(self.index.identifiers)).astype(bool)
+
+    @property
+    def identifiers(self) -> np.ndarray:
+        """The identifiers of the participants in the cohort, in data order."""
+        return self.index.identifiers[self.mask()]
+
+
+@dataclass
+class CohortIndex:
+    """Inverted index from values to the participants that have them.
+
+    Every diagnosis, subcategory and category is mapped to the bitset of the
+    participants with it, and of those with it at each certainty and time.
+    Values of the static columns, such as the site, year and season, are mapped
+    to the participants with them. Bits are in the order of the rows of the
+    data, whose identifiers are kept to look participants up.
+
+    Cohorts are selected with select and where, and combined with set
+    operators, for example:
+
+        adhd = index.select("categories", "ADHD", certainty="Confirmed")
+        autism = index.select("diagnoses", "Autism Spectrum Disorder")
+        cohort = adhd - autism & index.where("Site", 1)
+    """
+
+    identifiers: np.ndarray
+    bitsets: dict[IndexKey, np.ndarray]
+
+    @classmethod
+    def build(
+        cls,
+        identifiers: np.ndarray,
+        row: np.ndarray,
+        levels: dict[str, pd.Categorical],
+        qualifiers: dict[str, np.ndarray],
+        static: pd.DataFrame,
+    ) -> "CohortIndex":
+        """Build the index from the diagnosis slots of the data.
+
+        Args:
+            identifiers: The identifiers of the rows of the data.
+            row: The row position of every slot.
+            levels: The value of every slot at each level, missing for slots
+            without a valid value.
+            qualifiers: The certainty and time of every slot.
+            static: The static columns of the rows, named without prefix.
+
+        Returns:
+            The index of the values of the slots and the static columns.
+        """
+        n_rows = len(identifiers)
+        bitsets: dict[IndexKey, np.ndarray] = {}
+        for level, values in levels.items():
+            frame = pd.DataFrame({"value": values, "row": row, **qualifiers})
+            bitsets |= _group_bitsets(frame, ["value"], n_rows, (level,))
+            for name in qualifiers:
+                bitsets |= {
+                    (level, value, name, qualifier): bits
+                    for (_, value, qualifier), bits in _group_bitsets(
+                        frame, ["value", name], n_rows, (level,)
+                    ).items()
+                }
+        for column in static.columns:
+            frame = pd.DataFrame(
+                {
+                    "value": static[column].map(key_value, na_action="ignore"),
+                    "row": np.arange(n_rows),
+                }
+            )
+            bitsets |= _group_bitsets(frame, ["value"], n_rows, (column,))
+        return cls(identifiers=np.asarray(identifiers), bitsets=bitsets)
+
+    def _cohort(self, key: IndexKey) -> Cohort:
+        """Get the cohort of a key, empty if no participant has it."""
+        bits = self.bitsets.get(key)
+        return Cohort(self.nobody().bits if bits is None else bits, self)
+
+    def nobody(self) -> Cohort:
+        """Get the empty cohort."""
+        return Cohort(np.packbits(np.zeros(len(self.identifiers), dtype=bool)), self)
+
+    def everyone(self) -> Cohort:
+        """Get the cohort of all participants."""
+        return Cohort(np.packbits(np.ones(len(self.identifiers), dtype=bool)), self)
+
+    def values(self, level: str) -> list[str]:
+        """Get the indexed values of a level or static column."""
+        return [key[1] for key in self.bitsets if len(key) == 2 and key[0] == level]
+
+    def select(
+        self,
+        level: str,
+        value: str | list[str] | None = None,
+        certainty: str | list[str] | None = None,
+        time: str | list[str] | None = None,
+    ) -> Cohort:
+        """Select the participants with a diagnosis, subcategory or category.
+
+        Args:
+            level: The level of the values, "diagnoses", "subcategories" or
+            "categories".
+            value: The value or values to select the participants with any of,
+            or None for any value of the level.
+            certainty: Optional certainty or certainties the value must have.
+            time: Optional time or times the value must have.
+
+        Returns:
+            The participants with one of the values, at one of the certainties
+            and times if given.
+
+        Raises:
+            ValueError: If a value, certainty or time is not in the index.
+        """
+        known = self.values(level)
+        if value is None:
+            values = known
+        else:
+            values = [value] if isinstance(value, str) else value
+            unknown = set(values) - set(known)
+            if unknown:
+                raise ValueError(f"Values not found in {level}: {sorted(unknown)}")
+        conditions = {
+            name: [qualifier] if isinstance(qualifier, str) else qualifier
+            for name, qualifier in (("certainty", certainty), ("time", time))
+            if qualifier is not None
+        }
+        for name, qualifiers in conditions.items():
+            invalid = set(qualifiers) - set(QUALIFIERS[name])
+            if invalid:
+                raise ValueError(
+                    f"Invalid {name} values: {invalid}. "
+                    f"Valid values are: {QUALIFIERS[name]}"
+                )
+        cohort = self.nobody()
+        for v in values:
+            selected = self._cohort((level, v))
+            for name, qualifiers in conditions.items():
+                either = self.nobody()
+                for qualifier in qualifiers:
+                    either |= self._cohort((level, v, name, qualifier))
+                selected &= either
+            cohort |= selected
+        return cohort
+
+    def where(self, column: str, value: Any) -> Cohort:  # noqa: ANN401
+        """Select the participants with a value of a static column, such as "Site".
+
+        Raises:
+            ValueError: If the column is not in the index.
+        """
+        if not any(key[0] == column for key in self.bitsets):
+            raise ValueError(f"Column {column} not found in the index.")
+        return self._cohort((column, key_value(value)))
+
+    def of(self, identifiers: Iterable[str]) -> Cohort:
+        """Get the cohort of the participants with the given identifiers."""
+        flags = pd.Index(self.identifiers).isin(list(identifiers))
+        return Cohort(np.packbits(flags), self)
+
+    def keys(self, identifier: str) -> list[IndexKey]:
+        """Get the keys of the index that a participant is in."""
+        cohort = self.of([identifier])
+        return [key for key, bits in self.bitsets.items() if (bits & cohort.bits).any()]
+
+    def save(self, path: str) -> None:
+        """Save the index to a compressed .npz file."""
+        keys = list(self.bitsets)
+        n_bytes = len(self.nobody().bits)
+        np.savez_compressed(
+            path,
+            format=np.array(INDEX_FORMAT),
+            identifiers=self.identifiers.astype(str),
+            keys=np.array(json.dumps(keys)),
+            bitsets=(
+                np.stack([self.bitsets[key] for key in keys])
+                if keys
+                else np.zeros((0, n_bytes), dtype=np.uint8)
+            ),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> "CohortIndex":
+        """Load an index saved with save.
+
+        Raises:
+            ValueError: If the file was saved in another index format.
+        """
+        with np.load(path, allow_pickle=False) as loaded:
+            if int(loaded["format"]) != INDEX_FORMAT:
+                raise ValueError(f"Unsupported cohort index format in {path}.")
+            keys = json.loads(str(loaded["keys"]))
+            return cls(
+                identifiers=loaded["identifiers"].astype(object),
+                bitsets={
+                    tuple(key): bits for key, bits in zip(keys, loaded["bitsets"])
+                },
+            )
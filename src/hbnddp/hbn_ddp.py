@@ -1,17 +1,92 @@
 """Module for handling the HBN data."""
 
+import collections
+import itertools
+import logging
+import os
+import warnings
+from concurrent.futures import Executor
+from contextlib import nullcontext
+from functools import partial
 from pathlib import Path
-from typing import Literal
+from typing import Any, Callable, Hashable, Literal, TypeVar
 
+import numpy as np
 import pandas as pd
 
-from hbnddp.pivot import Pivot
+from hbnddp.pivot import (
+    BACKENDS,
+    CERTAINTY_FLAGS,
+    DETAILS_FORMATS,
+    Backend,
+    CoOccurrence,
+    DetailsFormat,
+    DxSlots,
+    Incidence,
+    Pivot,
+)
 
-from .utils import write
-from .viz import visualize
+from .cache import ResultCache, data_digest
+from .cohort import CohortIndex
+from .incremental import Manifest, manifest_path, row_hashes
+from .profiling import ProcessStats, Profiler, measure
+from .utils import (
+    ChunkWriter,
+    default_output_path,
+    details_output_path,
+    get_file_format,
+    read,
+    read_chunks,
+    read_columns,
+    variant_output_path,
+    write,
+)
+from .viz import FIGURES_DIR, ImageFormat, visualize_counts
+from .vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
 
 VALID_CERTAINTIES = ["Confirmed", "Presumptive", "RC", "RuleOut", "ByHx", "Unknown"]
 
+# Diagnosis_ClinicianConsensus columns that are not affected by pivoting
+STATIC_COLUMNS = ["NoDX", "Season", "Site", "Year"]
+
+# Dtypes to read the columns of each diagnosis slot with, None is inferred
+DX_COLUMN_DTYPES: dict[str, str | None] = {
+    "": "object",
+    "_Cat": "object",
+    "_Sub": "object",
+    "_Code": "object",
+    "_Spec": "object",
+    "_Past_Doc": None,
+    "_Time": "float64",
+    **{suffix: "float64" for suffix in CERTAINTY_FLAGS.values()},
+}
+
+T = TypeVar("T")
+
+PIVOT_LEVELS: list[Literal["diagnoses", "subcategories", "categories"]] = [
+    "diagnoses",
+    "subcategories",
+    "categories",
+]
+
+
+def _pivot_partition(
+    data: pd.DataFrame,
+    column_prefix: str,
+    extra_columns: list[str] | None,
+    pivot_options: dict[str, Any],
+) -> pd.DataFrame:
+    """Pivot a row partition of the data in a worker process.
+
+    Detail column dtypes are left to be inferred from all partitions.
+    """
+    hbn_data = HBNData(data, column_prefix, extra_columns=extra_columns)
+    return hbn_data._pivot(
+        hbn_data._preprocessed_data, **pivot_options, infer_dtypes=False
+    )
+
 
 class HBNData:
     """Class for handling the HBN diagnostic data."""
@@ -21,33 +96,137 @@ class HBNData:
         data: pd.DataFrame,
         column_prefix: str,
         input_path: str | None = None,
+        extra_columns: list[str] | None = None,
+        profiler: Profiler | None = None,
     ) -> None:
-        """Initialize the HBNData class."""
+        """Initialize the HBNData class.
+
+        A profiler measures the processing stages, see the stats property.
+        """
         self.input_path = input_path
         self.data = data
         self.column_prefix = column_prefix
+        self.extra_columns = extra_columns or []
+        self._cache_source: pd.DataFrame | None = None
+        self._cache: dict[Hashable, Any] = {}
+        self.profiler = profiler
+
+    @property
+    def stats(self) -> ProcessStats | None:
+        """The measurements of the processing stages, if profiling."""
+        return None if self.profiler is None else self.profiler.stats
 
     @classmethod
-    def create(cls, input_path: str) -> "HBNData":
-        """Load the data and create an HBNData instance."""
+    def create(
+        cls,
+        input_path: str,
+        extra_columns: list[str] | None = None,
+        input_format: str | None = None,
+        profiler: Profiler | None = None,
+    ) -> "HBNData":
+        """Load the data and create an HBNData instance.
+
+        Only the identifiers and the Diagnosis_ClinicianConsensus columns are read,
+        so columns from other instruments are skipped unless requested.
+
+        Args:
+            input_path: The path to the HBN data CSV, Parquet or Arrow file.
+            extra_columns: Other columns to read and carry through to the output.
+            input_format: The format of the file, "csv", "parquet" or "feather".
+            Defaults to the format of the file extension.
+            profiler: Optional profiler to measure reading and processing with.
+
+        Returns:
+            An HBNData instance with the loaded data.
+        """
         path = Path(input_path)
         if not path.exists():
             raise FileNotFoundError(f"File {path} not found.")
+        input_format = get_file_format(input_path, input_format)
         try:
-            data = pd.read_csv(path, low_memory=False)
+            columns = read_columns(input_path, input_format)
         except Exception as e:
-            raise ValueError(f"Error reading {path} as CSV: {e}")
-        if "Diagnosis_ClinicianConsensus,DX_01" in data.columns:
-            column_prefix = "Diagnosis_ClinicianConsensus,"
-        elif "DX_01" in data.columns:
-            column_prefix = ""
-        else:
-            raise ValueError("No valid diagnosis columns found in data.")
+            raise ValueError(f"Error reading {path} as {input_format}: {e}")
+        column_prefix = cls._detect_column_prefix(columns)
+        read_options = cls._read_options(columns, column_prefix, extra_columns)
+        with measure(profiler, "read") as stage:
+            try:
+                data = read(input_path, file_format=input_format, **read_options)
+            except Exception as e:
+                raise ValueError(f"Error reading {path} as {input_format}: {e}")
+            stage.rows = len(data)
+
+        return cls(
+            input_path=input_path,
+            data=data,
+            column_prefix=column_prefix,
+            extra_columns=extra_columns,
+            profiler=profiler,
+        )
 
-        return cls(input_path=input_path, data=data, column_prefix=column_prefix)
+    @staticmethod
+    def _read_options(
+        columns: pd.Index, column_prefix: str, extra_columns: list[str] | None
+    ) -> dict:
+        """Get the columns and dtypes to read from a file with the given columns.
+
+        Raises:
+            ValueError: If any of the extra columns is not in the file.
+        """
+        missing = set(extra_columns or []) - set(columns)
+        if missing:
+            raise ValueError(f"Extra columns not found in data: {sorted(missing)}")
+        dtypes = {
+            f"{column_prefix}DX_{n}{suffix}": dtype
+            for n in Pivot.DX_NS
+            for suffix, dtype in DX_COLUMN_DTYPES.items()
+        }
+        wanted = (
+            {"Identifiers", *(extra_columns or [])}
+            | {f"{column_prefix}{col}" for col in STATIC_COLUMNS}
+            | set(dtypes)
+        )
+        return {
+            "columns": [col for col in columns if col in wanted],
+            "dtype": {
+                col: dtype
+                for col, dtype in dtypes.items()
+                if col in columns and dtype is not None
+            },
+        }
+
+    @staticmethod
+    def _detect_column_prefix(columns: pd.Index) -> str:
+        """Detect the prefix of the diagnosis columns."""
+        if "Diagnosis_ClinicianConsensus,DX_01" in columns:
+            return "Diagnosis_ClinicianConsensus,"
+        elif "DX_01" in columns:
+            return ""
+        raise ValueError("No valid diagnosis columns found in data.")
+
+    def _cached(self, key: Hashable, compute: Callable[[], T]) -> T:
+        """Get a value derived from the data, computing it once per data frame.
+
+        The cache is cleared when the data attribute is replaced, but not when
+        the data frame is modified in place.
+        """
+        if self._cache_source is not self.data:
+            self._cache_source = self.data
+            self._cache = {}
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
 
     @property
     def _preprocessed_data(self) -> pd.DataFrame:
+        """The data with missing subcategories filled from their categories.
+
+        The preprocessed data is computed once and shares all columns except the
+        filled subcategories with the data, so it must not be modified in place.
+        """
+        return self._cached("preprocessed", self._preprocess)
+
+    def _preprocess(self) -> pd.DataFrame:
         """Preprocess the categories by filling missing subcategories."""
         cat_sub_cols = [
             (
@@ -56,35 +235,126 @@ class HBNData:
             )
             for n in range(1, 11)
         ]
-        processed_data = self.data.copy()
+        # A shallow copy only replaces the filled columns instead of copying all
+        processed_data = self.data.copy(deep=False)
         for cat, sub in cat_sub_cols:
-            processed_data[sub] = processed_data[sub].fillna(processed_data[cat])
+            missing = processed_data[sub].isna()
+            if missing.any():
+                processed_data[sub] = processed_data[sub].mask(
+                    missing, processed_data[cat]
+                )
         return processed_data
 
+    def _static_columns(self) -> pd.DataFrame:
+        """The static columns of the output, copied once per data frame.
+
+        Pivots build new frames from the static columns, so they are shared by
+        all pivots of the same data.
+        """
+        return self._cached(
+            "static_columns",
+            lambda: self._copy_static_columns(
+                self.data, self.column_prefix, self.extra_columns
+            ),
+        )
+
     @staticmethod
-    def _copy_static_columns(data: pd.DataFrame, column_prefix: str) -> pd.DataFrame:
+    def _copy_static_columns(
+        data: pd.DataFrame,
+        column_prefix: str,
+        extra_columns: list[str] | None = None,
+    ) -> pd.DataFrame:
         """Copy the subject data for output."""
-        # Diagnosis_ClinicianConsensus columns that are not affected by pivoting
-        unchanged_dx_cols = [
-            f"{column_prefix}NoDX",
-            f"{column_prefix}Season",
-            f"{column_prefix}Site",
-            f"{column_prefix}Year",
-        ]
+        unchanged_dx_cols = [f"{column_prefix}{col}" for col in STATIC_COLUMNS]
         # Copy ID column, any present unchanged DX columns,
-        # and any columns from other intruments.
-        unchanged_cols = ["Identifiers"] + [
-            col for col in unchanged_dx_cols if col in data.columns
-        ]
+        # and any requested columns from other intruments.
+        unchanged_cols = (
+            ["Identifiers"]
+            + [col for col in unchanged_dx_cols if col in data.columns]
+            + [col for col in extra_columns or [] if col not in unchanged_dx_cols]
+        )
         # Create DataFrame with copied columns to store output
-        output = pd.DataFrame()
-        output[unchanged_cols] = data[unchanged_cols].copy()
+        output = data[unchanged_cols].copy()
         # Remove extra text in ID column if present
         output["Identifiers"] = output["Identifiers"].replace(
             ",assessment", "", regex=True
         )
         return output
 
+    def _cache_key(self, parameters: dict[str, Any]) -> str:
+        """Get the result cache key of processing the data with the parameters.
+
+        The key is derived from the content of the data as it is now, rather than
+        of the input file, so that data changed after loading is not given the
+        result of the file.
+        """
+        return ResultCache.key(data_digest(self.data), self.column_prefix, parameters)
+
+    def _row_hashes(self) -> np.ndarray:
+        """The hash of every row of the data, computed once per data frame."""
+        return self._cached("row_hashes", lambda: row_hashes(self.data))
+
+    def _dx_slots(
+        self, data: pd.DataFrame, certainty_filter: list[str] | None
+    ) -> DxSlots:
+        """Get the diagnosis slots of the preprocessed data passing the filter.
+
+        Slots are extracted once per data frame and certainty filter, so that all
+        pivots and repeated calls share them.
+        """
+        slots = self._cached(
+            ("slots", None), lambda: Pivot.extract_slots(data, self.column_prefix)
+        )
+        if certainty_filter is None:
+            return slots
+        return self._cached(
+            ("slots", tuple(sorted(certainty_filter))),
+            lambda: slots.filter(certainty_filter),
+        )
+
+    def _level_values(
+        self,
+        data: pd.DataFrame,
+        level: Literal["diagnoses", "subcategories", "categories"],
+        vocabulary: dict[str, list[str]],
+    ) -> list[str]:
+        """Get the values to pivot a level by, from the vocabulary or the data.
+
+        Values of the data are found once per data frame and level.
+        """
+        if level in vocabulary:
+            return vocabulary[level]
+        return self._cached(
+            ("values", level),
+            lambda: Pivot._get_values(data, level, column_prefix=self.column_prefix),
+        )
+
+    def _unknown_values(
+        self,
+        data: pd.DataFrame,
+        levels: list[Literal["diagnoses", "subcategories", "categories"]],
+        certainty_filter: list[str] | None,
+        vocabulary: dict[str, list[str]],
+    ) -> dict[str, list[str]]:
+        """Get the values of the slots at each level that are not in a vocabulary.
+
+        The check uses the codes of the slots that the pivot by the vocabulary
+        uses, so that it does not scan the data again.
+        """
+        slots = self._dx_slots(data, certainty_filter)
+        fields = {"diagnoses": "diagnosis", "subcategories": "sub", "categories": "cat"}
+        unknown: dict[str, list[str]] = {}
+        for level in levels:
+            dtype = pd.CategoricalDtype(vocabulary[level])
+            codes = Pivot._value_codes(slots, fields[level], dtype)
+            found = pd.unique(getattr(slots, fields[level])[codes < 0])
+            values = sorted(
+                {value for value in found if pd.notna(value)} - Pivot.INVALID_DX_VALS
+            )
+            if values:
+                unknown[level] = values
+        return unknown
+
     def pivot(
         self,
         by: Literal[
@@ -95,11 +365,46 @@ class HBNData:
         ] = "all",
         certainty_filter: list[str] | None = None,
         include_details: bool = False,
+        vocabulary: dict[str, list[str]] | Vocabulary | None = None,
+        compact_dtypes: bool = True,
+        sparse: bool = False,
+        n_jobs: int = 1,
+        executor: Executor | None = None,
+        details_format: DetailsFormat = "repr",
+        fixed_schema: bool = False,
+        backend: Backend = "pandas",
     ) -> pd.DataFrame:
-        """Pivot and filter the data."""
-        # fill missing subcategories before pivoting
-        data = self._preprocessed_data
-        column_prefix = self.column_prefix
+        """Pivot and filter the data.
+
+        A vocabulary maps "diagnoses", "subcategories" and "categories" to fixed
+        lists of values to create columns for, instead of the values in the data.
+        A Vocabulary registry also fixes the column names of its values. It is
+        extended with the values of the data that it does not hold yet, unless
+        fixed_schema is set, in which case those values are left out with a
+        warning and the columns are exactly those of the registry.
+        With compact dtypes, presence flags are int8 and certainty, time, category
+        and subcategory columns are Categoricals, otherwise they are int64 and
+        object columns. With sparse, presence flags and numeric detail columns are
+        pandas sparse columns.
+
+        With n_jobs other than 1, the rows are split into n_jobs partitions that
+        are pivoted in a process pool, or in the given executor, and joined in
+        their original order. A value of -1 uses one partition per CPU.
+
+        The details format sets how diagnosis-level details of subcategories and
+        categories are stored: "repr" for the repr of a list of dicts, "json" for
+        a JSON array, or "long" for no details columns, leaving the details to
+        the long table of the details method.
+
+        The backend runs the vectorized pivot kernels with "pandas" and NumPy, or
+        with "polars", which joins the details as multi-threaded Polars string
+        expressions and requires the polars extra. The output is the same pandas
+        DataFrame with either backend.
+        """
+        if backend not in BACKENDS:
+            raise ValueError(
+                f"Invalid value for 'backend': {backend}. Valid values are: {BACKENDS}"
+            )
         if certainty_filter is not None:
             invalid_certs = set(certainty_filter) - set(VALID_CERTAINTIES)
             if invalid_certs:
@@ -107,56 +412,442 @@ class HBNData:
                     f"Invalid certainty values: {invalid_certs}. "
                     f"Valid values are: {VALID_CERTAINTIES}"
                 )
-        output = self._copy_static_columns(data=data, column_prefix=column_prefix)
-        match by:
-            case "diagnoses":
-                output = Pivot.diagnoses(
-                    data=data,
-                    output=output,
-                    column_prefix=self.column_prefix,
-                    certainty_filter=certainty_filter,
-                )
-            case "subcategories":
-                output = Pivot.subcategories(
-                    data=data,
-                    output=output,
-                    column_prefix=self.column_prefix,
-                    certainty_filter=certainty_filter,
-                    include_details=include_details,
-                )
-            case "categories":
-                output = Pivot.categories(
-                    data=data,
-                    output=output,
-                    column_prefix=self.column_prefix,
-                    certainty_filter=certainty_filter,
-                    include_details=include_details,
+        if details_format not in DETAILS_FORMATS:
+            raise ValueError(
+                f"Invalid value for 'details_format': {details_format}. "
+                f"Valid values are: {DETAILS_FORMATS}"
+            )
+        if fixed_schema and not isinstance(vocabulary, Vocabulary):
+            raise ValueError("A fixed schema requires a Vocabulary registry.")
+        # fill missing subcategories before pivoting
+        with measure(self.profiler, "preprocess", len(self.data)):
+            data = self._preprocessed_data
+        column_names = None
+        if isinstance(vocabulary, Vocabulary):
+            if fixed_schema:
+                levels = PIVOT_LEVELS if by == "all" else [by]
+                unknown = self._unknown_values(
+                    data,
+                    [level for level in levels if level in PIVOT_LEVELS],
+                    certainty_filter,
+                    vocabulary.values,
                 )
+                if unknown:
+                    logger.warning(
+                        "Values not in the fixed vocabulary are left out: %s", unknown
+                    )
+            else:
+                vocabulary.update(data, self.column_prefix)
+            column_names = vocabulary.columns
+            vocabulary = vocabulary.values
+        pivot_profile = (
+            nullcontext() if self.profiler is None else self.profiler.pivot_profile()
+        )
+        with pivot_profile:
+            if n_jobs != 1 or executor is not None:
+                with measure(self.profiler, "parallel_pivot", len(data)):
+                    return self._parallel_pivot(
+                        data,
+                        n_jobs=n_jobs,
+                        executor=executor,
+                        pivot_options={
+                            "by": by,
+                            "certainty_filter": certainty_filter,
+                            "include_details": include_details,
+                            "vocabulary": vocabulary,
+                            "column_names": column_names,
+                            "compact_dtypes": compact_dtypes,
+                            "sparse": sparse,
+                            "details_format": details_format,
+                            "backend": backend,
+                        },
+                    )
+            return self._pivot(
+                data,
+                by=by,
+                certainty_filter=certainty_filter,
+                include_details=include_details,
+                vocabulary=vocabulary,
+                column_names=column_names,
+                compact_dtypes=compact_dtypes,
+                sparse=sparse,
+                details_format=details_format,
+                backend=backend,
+            )
+
+    def _pivot(
+        self,
+        data: pd.DataFrame,
+        by: Literal["diagnoses", "subcategories", "categories", "all"],
+        certainty_filter: list[str] | None,
+        include_details: bool,
+        vocabulary: dict[str, list[str]] | None,
+        compact_dtypes: bool,
+        sparse: bool,
+        details_format: DetailsFormat = "repr",
+        column_names: dict[str, dict[str, str]] | None = None,
+        infer_dtypes: bool = True,
+        backend: Backend = "pandas",
+    ) -> pd.DataFrame:
+        """Pivot the preprocessed data by the given levels."""
+        match by:
+            case "diagnoses" | "subcategories" | "categories":
+                levels = [by]
             case "all":
-                output = Pivot.diagnoses(
-                    data=data,
-                    output=output,
-                    column_prefix=self.column_prefix,
-                    certainty_filter=certainty_filter,
-                )
-                output = Pivot.subcategories(
-                    data=data,
-                    output=output,
-                    column_prefix=self.column_prefix,
-                    certainty_filter=certainty_filter,
-                    include_details=include_details,
-                )
-                output = Pivot.categories(
-                    data=data,
-                    output=output,
-                    column_prefix=self.column_prefix,
-                    certainty_filter=certainty_filter,
-                    include_details=include_details,
-                )
+                levels = PIVOT_LEVELS
             case _:
                 raise ValueError(f"Invalid value for 'by': {by}")
+        column_prefix = self.column_prefix
+        with measure(self.profiler, "copy_static_columns", len(data)):
+            output = self._static_columns()
+        with measure(self.profiler, "extract_slots", len(data)):
+            slots = self._dx_slots(data, certainty_filter)
+        vocabulary = vocabulary or {}
+        column_names = column_names or {}
+        for level in levels:
+            with measure(self.profiler, level, len(data)):
+                match level:
+                    case "diagnoses":
+                        output = Pivot.diagnoses(
+                            data=data,
+                            output=output,
+                            column_prefix=column_prefix,
+                            certainty_filter=certainty_filter,
+                            slots=slots,
+                            values=self._level_values(data, "diagnoses", vocabulary),
+                            column_names=column_names.get("diagnoses"),
+                            compact_dtypes=compact_dtypes,
+                            sparse=sparse,
+                            infer_dtypes=infer_dtypes,
+                            backend=backend,
+                        )
+                    case "subcategories":
+                        output = Pivot.subcategories(
+                            data=data,
+                            output=output,
+                            column_prefix=column_prefix,
+                            certainty_filter=certainty_filter,
+                            include_details=include_details,
+                            slots=slots,
+                            values=self._level_values(
+                                data, "subcategories", vocabulary
+                            ),
+                            column_names=column_names.get("subcategories"),
+                            compact_dtypes=compact_dtypes,
+                            sparse=sparse,
+                            details_format=details_format,
+                            backend=backend,
+                        )
+                    case "categories":
+                        output = Pivot.categories(
+                            data=data,
+                            output=output,
+                            column_prefix=column_prefix,
+                            certainty_filter=certainty_filter,
+                            include_details=include_details,
+                            slots=slots,
+                            values=self._level_values(data, "categories", vocabulary),
+                            column_names=column_names.get("categories"),
+                            compact_dtypes=compact_dtypes,
+                            sparse=sparse,
+                            details_format=details_format,
+                            backend=backend,
+                        )
         return output
 
+    def _parallel_pivot(
+        self,
+        data: pd.DataFrame,
+        n_jobs: int,
+        executor: Executor | None,
+        pivot_options: dict[str, Any],
+    ) -> pd.DataFrame:
+        """Pivot row partitions of the data in parallel.
+
+        Every partition is pivoted with the vocabulary of the whole data, so all
+        partitions have the same columns.
+        """
+        if n_jobs == -1:
+            n_jobs = os.cpu_count() or 1
+        if n_jobs < 1:
+            raise ValueError(f"Invalid value for 'n_jobs': {n_jobs}")
+        by = pivot_options["by"]
+        if by != "all" and by not in PIVOT_LEVELS:
+            raise ValueError(f"Invalid value for 'by': {by}")
+        levels = PIVOT_LEVELS if by == "all" else [by]
+        fixed = pivot_options["vocabulary"] or {}
+        vocabulary = {
+            level: self._level_values(data, level, fixed) for level in levels
+        } | fixed
+        bounds = np.linspace(0, len(self.data), n_jobs + 1).astype(int)
+        partitions = [
+            self.data.iloc[start:stop]
+            for start, stop in zip(bounds[:-1], bounds[1:])
+            if stop > start
+        ] or [self.data]
+        pivot_partition = partial(
+            _pivot_partition,
+            column_prefix=self.column_prefix,
+            extra_columns=self.extra_columns,
+            pivot_options=pivot_options | {"vocabulary": vocabulary},
+        )
+        if executor is None:
+            from concurrent.futures import ProcessPoolExecutor
+
+            with ProcessPoolExecutor(max_workers=len(partitions)) as pool:
+                parts = list(pool.map(pivot_partition, partitions))
+        else:
+            parts = list(executor.map(pivot_partition, partitions))
+        return self._concat_partitions(parts, sparse=pivot_options["sparse"])
+
+    def _concat_partitions(
+        self, parts: list[pd.DataFrame], sparse: bool
+    ) -> pd.DataFrame:
+        """Join pivoted row partitions with the dtypes of a single pivot.
+
+        Categorical columns with differing categories get the sorted categories of
+        all partitions, and the dtypes of pivoted object columns are inferred from
+        all values.
+        """
+        n_static = len(
+            self._copy_static_columns(
+                self.data.iloc[:0], self.column_prefix, self.extra_columns
+            ).columns
+        )
+        # Columns are matched by position, since pivots by all levels can repeat
+        # column names
+        for i in range(n_static, parts[0].shape[1]):
+            dtypes = [part.dtypes.iloc[i] for part in parts]
+            if all(isinstance(dtype, pd.CategoricalDtype) for dtype in dtypes):
+                if all(
+                    dtype.categories.equals(dtypes[0].categories) for dtype in dtypes
+                ):
+                    continue
+                categories = set().union(*(dtype.categories for dtype in dtypes))
+                dtype = pd.CategoricalDtype(sorted(categories, key=str))
+                for part in parts:
+                    part.isetitem(i, part.iloc[:, i].astype(dtype))
+        with warnings.catch_warnings():
+            # The dtypes of all-missing parts are restored below
+            warnings.simplefilter("ignore", FutureWarning)
+            output = pd.concat(parts)
+        for i in range(output.shape[1]):
+            if not pd.api.types.is_object_dtype(output.dtypes.iloc[i]):
+                continue
+            # Concatenation replaces missing values of all-missing parts, so object
+            # columns are joined from the original values
+            values = pd.Series(
+                np.concatenate([part.iloc[:, i].to_numpy() for part in parts]),
+                index=output.index,
+            )
+            if i >= n_static:
+                values = values.infer_objects()
+            if sparse and values.dtype != object:
+                values = values.astype(pd.SparseDtype(values.dtype))
+            output.isetitem(i, values)
+        return output
+
+    def incidence(
+        self,
+        by: Literal["diagnoses", "subcategories", "categories"] = "diagnoses",
+        certainty_filter: list[str] | None = None,
+        vocabulary: dict[str, list[str]] | Vocabulary | None = None,
+    ) -> Incidence:
+        """Build a sparse participants by values presence matrix.
+
+        Rows are labelled by participant identifiers and columns by the
+        diagnoses, subcategories or categories. Requires scipy.
+        """
+        data = self._preprocessed_data
+        if certainty_filter is not None:
+            invalid_certs = set(certainty_filter) - set(VALID_CERTAINTIES)
+            if invalid_certs:
+                raise ValueError(
+                    f"Invalid certainty values: {invalid_certs}. "
+                    f"Valid values are: {VALID_CERTAINTIES}"
+                )
+        identifiers = self._static_columns()["Identifiers"]
+        return Pivot.incidence(
+            data=data,
+            column_prefix=self.column_prefix,
+            by=by,
+            certainty_filter=certainty_filter,
+            slots=self._dx_slots(data, certainty_filter),
+            values=(vocabulary or {}).get(by),
+            rows=identifiers.to_numpy(),
+        )
+
+    def cooccurrence(
+        self,
+        by: Literal["diagnoses", "subcategories", "categories"] = "diagnoses",
+        certainty_filter: list[str] | None = None,
+        vocabulary: dict[str, list[str]] | Vocabulary | None = None,
+    ) -> CoOccurrence:
+        """Count the participants with every pair of values of a level.
+
+        The pairs are counted from the sparse presence matrix of incidence, so
+        only the values passing the certainty filter co-occur. The result gives
+        the counts, Jaccard indices and conditional rates of the pairs, and can
+        be saved with save or plotted with viz.heatmap. Requires scipy.
+        """
+        return self.incidence(by, certainty_filter, vocabulary).cooccurrence()
+
+    def cohort_index(self) -> CohortIndex:
+        """Build an inverted index of the participants with each value.
+
+        The index maps every diagnosis, subcategory and category, at each
+        certainty and time, and every value of the static columns to the bitset
+        of the participants with it, so that cohorts are selected without
+        scanning the data. Save it with save to reload it without the data.
+        """
+        data = self._preprocessed_data
+        slots = self._dx_slots(data, None)
+        fields = {"diagnoses": "diagnosis", "subcategories": "sub", "categories": "cat"}
+        levels: dict[str, pd.Categorical] = {}
+        for level in PIVOT_LEVELS:
+            dtype = pd.CategoricalDtype(self._level_values(data, level, {}))
+            codes = Pivot._value_codes(slots, fields[level], dtype)
+            levels[level] = pd.Categorical.from_codes(codes, dtype=dtype)
+        static = self._static_columns()
+        static_columns = [f"{self.column_prefix}{col}" for col in STATIC_COLUMNS]
+        return CohortIndex.build(
+            identifiers=static["Identifiers"].to_numpy(),
+            row=slots.row,
+            levels=levels,
+            qualifiers={"certainty": slots.certainty, "time": slots.time},
+            static=static[
+                [col for col in static_columns if col in static.columns]
+            ].rename(columns=lambda col: col.removeprefix(self.column_prefix)),
+        )
+
+    def counts(
+        self,
+        by: Literal["diagnoses", "subcategories", "categories"] = "diagnoses",
+        certainty_filter: list[str] | None = None,
+        group_by: list[str] | None = None,
+        vocabulary: dict[str, list[str]] | Vocabulary | None = None,
+    ) -> pd.DataFrame:
+        """Count the participants with each diagnosis, subcategory or category.
+
+        The counts are the sums of the presence columns of the pivot by the same
+        level, computed from the diagnosis slots without building the wide
+        table. With group_by, participants are counted by the groups of the
+        given columns, such as "Site", "Year" or "Season", which are taken with
+        the column prefix of the data if needed. Participants with a missing
+        group value are not counted.
+
+        Returns:
+            A table with one row for each value, and a "count" column, or one
+            column for each group.
+
+        Raises:
+            ValueError: If the certainty filter or a group by column is invalid.
+        """
+        if certainty_filter is not None:
+            invalid_certs = set(certainty_filter) - set(VALID_CERTAINTIES)
+            if invalid_certs:
+                raise ValueError(
+                    f"Invalid certainty values: {invalid_certs}. "
+                    f"Valid values are: {VALID_CERTAINTIES}"
+                )
+        data = self._preprocessed_data
+        if isinstance(vocabulary, Vocabulary):
+            vocabulary = vocabulary.values
+        values = self._level_values(data, by, vocabulary or {})
+        groups = None
+        columns = pd.Index(["count"])
+        if group_by:
+            grouped = self.data.groupby(
+                [self._group_column(name) for name in group_by], sort=True
+            )
+            # Rows with a missing group value have no group, and are not counted
+            groups = grouped.ngroup().fillna(-1).astype(np.int64).to_numpy()
+            columns = grouped.size().index.set_names(group_by)
+        counts = Pivot.counts(
+            data=data,
+            column_prefix=self.column_prefix,
+            by=by,
+            slots=self._dx_slots(data, certainty_filter),
+            values=values,
+            groups=groups,
+            n_groups=len(columns),
+        )
+        return pd.DataFrame(counts, index=pd.Index(values, name=by), columns=columns)
+
+    def _plot_counts(
+        self,
+        by: Literal["diagnoses", "subcategories", "categories", "all"],
+        certainty_filter: list[str] | None,
+        vocabulary: dict[str, list[str]] | Vocabulary | None,
+    ) -> dict[str, pd.Series]:
+        """Get the counts of every level to plot, indexed by their column names."""
+        column_names = vocabulary.columns if isinstance(vocabulary, Vocabulary) else {}
+        counts: dict[str, pd.Series] = {}
+        for level in PIVOT_LEVELS if by == "all" else [by]:
+            level_counts = self.counts(level, certainty_filter, vocabulary=vocabulary)
+            names = column_names.get(level)
+            counts[level] = level_counts["count"].set_axis(
+                [Pivot._column_name(value, names) for value in level_counts.index]
+            )
+        return counts
+
+    def _group_column(self, name: str) -> str:
+        """Get the column of the data to group by, adding the prefix if needed."""
+        for column in (name, f"{self.column_prefix}{name}"):
+            if column in self.data.columns:
+                return column
+        raise ValueError(f"Column {name} to group by not found in the data.")
+
+    def details(
+        self,
+        by: Literal["subcategories", "categories", "all"] = "all",
+        certainty_filter: list[str] | None = None,
+        vocabulary: dict[str, list[str]] | Vocabulary | None = None,
+        compact_dtypes: bool = True,
+    ) -> pd.DataFrame:
+        """Build a long table of the diagnosis-level details of the pivot levels.
+
+        The table has one row for each participant, level and slot holding one of
+        the subcategories or categories, with the columns Identifiers, level,
+        value, diagnosis, subcategory, ICD_code, certainty, time and
+        past_documentation. It holds the details of pivoting with
+        include_details, and joins the pivoted output on Identifiers. With "all",
+        the subcategory details are followed by the category details.
+        """
+        match by:
+            case "subcategories" | "categories":
+                levels: list[Literal["subcategories", "categories"]] = [by]
+            case "all":
+                levels = ["subcategories", "categories"]
+            case _:
+                raise ValueError(
+                    f"Invalid value for 'by': {by}. Diagnosis level details are "
+                    "stored in the diagnosis columns."
+                )
+        if certainty_filter is not None:
+            invalid_certs = set(certainty_filter) - set(VALID_CERTAINTIES)
+            if invalid_certs:
+                raise ValueError(
+                    f"Invalid certainty values: {invalid_certs}. "
+                    f"Valid values are: {VALID_CERTAINTIES}"
+                )
+        data = self._preprocessed_data
+        identifiers = self._static_columns()["Identifiers"]
+        tables = [
+            Pivot.details(
+                data=data,
+                column_prefix=self.column_prefix,
+                by=level,
+                certainty_filter=certainty_filter,
+                slots=self._dx_slots(data, certainty_filter),
+                values=(vocabulary or {}).get(level),
+                rows=identifiers.to_numpy(),
+                compact_dtypes=compact_dtypes,
+            )
+            for level in levels
+        ]
+        return pd.concat(tables, ignore_index=True)
+
     def process(
         self,
         output_path: str | None = None,
@@ -169,6 +860,19 @@ class HBNData:
         certainty_filter: list[str] | None = None,
         include_details: bool = False,
         viz: bool = False,
+        output_format: str | None = None,
+        compact_dtypes: bool = True,
+        sparse: bool = False,
+        n_jobs: int = 1,
+        details_format: DetailsFormat = "repr",
+        vocabulary: dict[str, list[str]] | Vocabulary | None = None,
+        fixed_schema: bool = False,
+        previous_output: str | None = None,
+        save_manifest: bool = False,
+        cache: ResultCache | str | None = None,
+        viz_format: ImageFormat = "png",
+        backend: Backend = "pandas",
+        figures_dir: str = FIGURES_DIR,
     ) -> pd.DataFrame:
         """Process the HBN clinician consensus diagnosis data by pivoting.
 
@@ -184,14 +888,577 @@ class HBNData:
             include diagnosis level details in a separate column as a dictionary.
             viz: Whether to visualize the data. Displays and saves a bar plot showing
             the incidence of diagnoses or categories. Default is False.
+            output_format: The format to save the processed data in, "csv",
+            "parquet" or "feather". Defaults to the format of the output path
+            extension, or CSV.
+            compact_dtypes: Whether to store presence flags as int8 and certainty,
+            time, category and subcategory columns as Categoricals. Set to False
+            for int64 and object columns. Default is True.
+            sparse: Whether to store presence flags and numeric detail columns as
+            pandas sparse columns. Default is False.
+            n_jobs: The number of row partitions to pivot in parallel processes,
+            -1 for one per CPU. Default is 1.
+            details_format: How to store the details of include_details, "repr"
+            for the repr of a list of dicts, "json" for a JSON array, or "long"
+            for a separate table, see the details method. The long table is
+            stored in details_data and saved next to the output with a
+            "_details" suffix. Default is "repr".
+            vocabulary: Optional fixed lists of values to create columns for, or
+            a Vocabulary registry, see the pivot method.
+            fixed_schema: Whether to keep the columns of the Vocabulary registry
+            instead of extending it with the values of the data.
+            previous_output: Optional path of an output processed from an earlier
+            release with save_manifest. Only the participants that are new or
+            whose rows changed since are pivoted, and merged into the previous
+            output. Columns of newly seen values are added, with zero presence
+            flags and missing details for the previous participants, and
+            participants no longer in the data are dropped. The output is saved
+            with an updated manifest.
+            save_manifest: Whether to save a manifest of the parameters, the
+            vocabulary and a hash of every participant's row next to the output,
+            with a "_manifest.json" suffix, so that it can be updated as a
+            previous output.
+            cache: Optional ResultCache, or the path of its directory, to reuse
+            results of processing the same input content with the same
+            parameters and package version. A hit skips pivoting, while the
+            output is still written and visualized. Not used when updating a
+            previous output.
+            viz_format: The format to save the bar plots of viz in, "png" or
+            "svg" images, or "html" files that are not rendered. Plots whose
+            counts are unchanged since they were saved are not saved again.
+            Default is "png".
+            backend: The backend of the pivot kernels, "pandas" or "polars",
+            see the pivot method. The output does not depend on it.
+            figures_dir: The directory to save the bar plots of viz to. Default
+            is "./figures".
 
         Returns:
             The processed data.
+
+        Raises:
+            ValueError: If a manifest is requested with fixed lists of values
+            instead of a Vocabulary registry, or the previous output was
+            processed with different parameters.
         """
-        output = self.pivot(by, certainty_filter, include_details)
+        parameters = {
+            "by": by,
+            "certainty_filter": (
+                None if certainty_filter is None else sorted(certainty_filter)
+            ),
+            "include_details": include_details,
+            "details_format": details_format,
+            "column_prefix": self.column_prefix,
+            "extra_columns": self.extra_columns,
+        }
+        pivot_options: dict[str, Any] = {
+            "by": by,
+            "certainty_filter": certainty_filter,
+            "include_details": include_details,
+            "compact_dtypes": compact_dtypes,
+            "sparse": sparse,
+            "n_jobs": n_jobs,
+            "details_format": details_format,
+            "fixed_schema": fixed_schema,
+            "backend": backend,
+        }
+        registry = None
+        if previous_output is not None or save_manifest:
+            if vocabulary is not None and not isinstance(vocabulary, Vocabulary):
+                raise ValueError("A manifest requires a Vocabulary registry.")
+            registry = vocabulary or Vocabulary()
+        result_cache = ResultCache(cache) if isinstance(cache, str) else cache
+        cache_key = None
+        cached = None
+        if result_cache is not None and previous_output is None:
+            with measure(self.profiler, "cache_lookup", len(self.data)):
+                cache_key = self._cache_key(
+                    parameters
+                    | {
+                        "compact_dtypes": compact_dtypes,
+                        "sparse": sparse,
+                        "fixed_schema": fixed_schema,
+                        "vocabulary": (
+                            vocabulary.to_dict()
+                            if isinstance(vocabulary, Vocabulary)
+                            else vocabulary
+                        ),
+                    }
+                )
+                cached = result_cache.get(cache_key)
+        details = None
+        if cached is not None:
+            output, details = cached
+            extended = registry or vocabulary
+            if isinstance(extended, Vocabulary) and not fixed_schema:
+                # Register the values of the data like the pivot would
+                extended.update(self._preprocessed_data, self.column_prefix)
+        elif previous_output is not None:
+            manifest = Manifest.load(manifest_path(previous_output))
+            manifest.check(parameters)
+            if isinstance(vocabulary, Vocabulary):
+                manifest.vocabulary.merge(vocabulary)
+            registry = manifest.vocabulary
+            output = self._update_previous(
+                previous_output, manifest, pivot_options | {"vocabulary": registry}
+            )
+        else:
+            output = self.pivot(**pivot_options, vocabulary=registry or vocabulary)
+        if (
+            cached is None
+            and include_details
+            and details_format == "long"
+            and by != "diagnoses"
+        ):
+            details = self.details(
+                by,
+                certainty_filter,
+                registry or vocabulary,
+                compact_dtypes=compact_dtypes,
+            )
+        if result_cache is not None and cache_key is not None and cached is None:
+            with measure(self.profiler, "cache_store", len(output)):
+                result_cache.put(cache_key, output, details)
         if viz:
-            visualize(output, by)
+            with measure(self.profiler, "visualize", len(output)):
+                visualize_counts(
+                    self._plot_counts(by, certainty_filter, registry or vocabulary),
+                    viz_format,
+                    figures_dir,
+                )
         if self.input_path is not None:
-            write(output, input_path=self.input_path, by=by, output_path=output_path)
+            with measure(self.profiler, "write", len(output)):
+                if output_path is None:
+                    output_path = default_output_path(
+                        self.input_path, by, get_file_format(None, output_format)
+                    )
+                write(
+                    output,
+                    input_path=self.input_path,
+                    by=by,
+                    output_path=output_path,
+                    file_format=output_format,
+                )
+                if details is not None:
+                    write(
+                        details,
+                        input_path=self.input_path,
+                        by=by,
+                        output_path=details_output_path(output_path),
+                        file_format=output_format,
+                    )
+                if registry is not None:
+                    Manifest(
+                        parameters,
+                        registry,
+                        pd.Series(
+                            self._row_hashes(),
+                            index=self._static_columns()["Identifiers"].to_numpy(),
+                        ),
+                    ).save(manifest_path(output_path))
         self.processed_data = output
+        self.details_data = details
+        return output
+
+    def process_variants(
+        self,
+        certainty_filters: list[list[str] | None],
+        by: Literal["diagnoses", "subcategories", "categories", "all"]
+        | list[Literal["diagnoses", "subcategories", "categories", "all"]] = "all",
+        include_details: bool = False,
+        output_format: str | None = None,
+        compact_dtypes: bool = True,
+        sparse: bool = False,
+        details_format: DetailsFormat = "repr",
+        vocabulary: dict[str, list[str]] | Vocabulary | None = None,
+        fixed_schema: bool = False,
+        backend: Backend = "pandas",
+        output_dir: str | None = None,
+    ) -> dict[tuple[str, tuple[str, ...] | None], pd.DataFrame]:
+        """Process the data with several certainty filters and pivot levels.
+
+        Every variant is the output of process with one of the certainty filters
+        and levels, but the variants share the work that does not depend on
+        them: the data is preprocessed and its diagnosis slots are extracted
+        once, with the certainty of every slot, and each filter masks the shared
+        slots. The value codes and encoded details of the slots are derived once
+        and taken by every filter, so the cost of many variants is close to the
+        cost of one.
+
+        When the data was loaded from a file, every variant is saved next to it,
+        or in the output directory, with the certainty filter appended to the
+        default output path, see variant_output_path, and with its long details
+        table when the details format is "long".
+
+        Args:
+            certainty_filters: The certainty filters of the variants, None for a
+            variant with all certainties.
+            by: The level, or list of levels, to pivot every filter by.
+            include_details: Whether to include diagnosis level details, see
+            process.
+            output_format: The format to save the variants in, "csv", "parquet"
+            or "feather". Default is CSV.
+            compact_dtypes: Whether to use compact dtypes, see process.
+            sparse: Whether to use sparse columns, see process.
+            details_format: How to store the details, see process.
+            vocabulary: Optional fixed lists of values to create columns for, or
+            a Vocabulary registry, see the pivot method.
+            fixed_schema: Whether to keep the columns of the Vocabulary registry
+            instead of extending it with the values of the data.
+            backend: The backend of the pivot kernels, "pandas" or "polars".
+            output_dir: Optional directory to save the variants in, instead of
+            the directory of the input file. It is created if missing.
+
+        Returns:
+            The processed data of every variant, keyed by its level and its
+            sorted certainty filter, or None for no filter.
+
+        Raises:
+            ValueError: If an output directory is given for data that was not
+            loaded from a file, as the variant names derive from its name.
+        """
+        if output_dir is not None:
+            if self.input_path is None:
+                raise ValueError(
+                    "An output directory requires data loaded from a file."
+                )
+            os.makedirs(output_dir, exist_ok=True)
+        levels = by if isinstance(by, list) else [by]
+        file_format = get_file_format(None, output_format)
+        variants: dict[tuple[str, tuple[str, ...] | None], pd.DataFrame] = {}
+        for level, certainty_filter in itertools.product(levels, certainty_filters):
+            key = (
+                level,
+                None if certainty_filter is None else tuple(sorted(certainty_filter)),
+            )
+            output = self.pivot(
+                by=level,
+                certainty_filter=certainty_filter,
+                include_details=include_details,
+                vocabulary=vocabulary,
+                compact_dtypes=compact_dtypes,
+                sparse=sparse,
+                details_format=details_format,
+                fixed_schema=fixed_schema,
+                backend=backend,
+            )
+            variants[key] = output
+            if self.input_path is None:
+                continue
+            output_path = variant_output_path(
+                self.input_path, level, certainty_filter, file_format, output_dir
+            )
+            with measure(self.profiler, "write", len(output)):
+                write(
+                    output,
+                    input_path=self.input_path,
+                    by=level,
+                    output_path=output_path,
+                    file_format=file_format,
+                )
+                if (
+                    include_details
+                    and details_format == "long"
+                    and level != "diagnoses"
+                ):
+                    write(
+                        self.details(
+                            level,
+                            certainty_filter,
+                            vocabulary,
+                            compact_dtypes=compact_dtypes,
+                        ),
+                        input_path=self.input_path,
+                        by=level,
+                        output_path=details_output_path(output_path),
+                        file_format=file_format,
+                    )
+            logger.info("Variant %s saved to %s", key, output_path)
+        return variants
+
+    def _update_previous(
+        self,
+        previous_output: str,
+        manifest: Manifest,
+        pivot_options: dict[str, Any],
+    ) -> pd.DataFrame:
+        """Pivot the new and changed participants and merge the previous output.
+
+        Columns of the previous output are matched to the updated columns by
+        their level and name, since pivots by all levels can repeat column names.
+
+        Raises:
+            ValueError: If the identifiers are not unique, or the previous output
+            is missing participants of its manifest.
+        """
+        identifiers = self._static_columns()["Identifiers"]
+        if not identifiers.is_unique:
+            raise ValueError("Incremental processing requires unique identifiers.")
+        with measure(self.profiler, "hash", len(self.data)):
+            changed = manifest.changed(identifiers, self._row_hashes())
+        logger.info(
+            "Pivoting %d new or changed of %d participants", changed.sum(), len(changed)
+        )
+        vocabulary = pivot_options["vocabulary"]
+        previous_columns = self._column_keys(vocabulary, pivot_options)
+        delta = HBNData(
+            self.data[changed],
+            self.column_prefix,
+            extra_columns=self.extra_columns,
+            profiler=self.profiler,
+        )
+        new_rows = delta.pivot(**pivot_options)
+        columns = self._column_keys(vocabulary, pivot_options)
+        with measure(self.profiler, "read_previous") as stage:
+            previous = read(previous_output)
+            stage.rows = len(previous)
+        previous = previous[previous["Identifiers"].isin(identifiers[~changed])]
+
+        details_format = pivot_options["details_format"]
+        n_static = new_rows.shape[1] - len(columns)
+        positions = {key: n_static + i for i, key in enumerate(previous_columns)}
+        aligned = [previous.iloc[:, i] for i in range(n_static)]
+        dtypes = new_rows.dtypes
+        for i, key in enumerate(columns, start=n_static):
+            dtype = dtypes.iloc[i]
+            if key[1].endswith("Present"):
+                values = (
+                    previous.iloc[:, positions[key]].astype(dtype)
+                    if key in positions
+                    else pd.Series(0, index=previous.index, dtype=dtype)
+                )
+            elif key not in positions or previous.iloc[:, positions[key]].isna().all():
+                # Missing details take the dtype of the new rows
+                values = new_rows.iloc[:0, i].reindex(previous.index)
+            else:
+                values = previous.iloc[:, positions[key]]
+                if isinstance(dtype, pd.CategoricalDtype) and values.dtype != dtype:
+                    found = values.dropna().unique()
+                    if not set(found) <= set(dtype.categories):
+                        dtype = pd.CategoricalDtype(found)
+                    values = values.astype(dtype)
+            if key[1].endswith("_Details"):
+                # Details are read back as missing values instead of empty
+                values = values.astype(object).where(
+                    values.notna(), "" if details_format == "repr" else None
+                )
+            aligned.append(values)
+        previous = pd.concat(aligned, axis=1, ignore_index=True).set_axis(
+            new_rows.columns, axis=1
+        )
+        output = self._concat_partitions(
+            [previous, new_rows], sparse=pivot_options["sparse"]
+        )
+        order = pd.Index(output["Identifiers"]).get_indexer(identifiers.to_numpy())
+        if (order < 0).any():
+            raise ValueError(
+                f"The previous output {previous_output} is missing participants "
+                "of its manifest."
+            )
+        dtypes = output.dtypes
+        output = output.iloc[order]
+        output.index = self.data.index
+        # Taking the rows of a frame widens sparse int8 columns
+        for i, dtype in enumerate(dtypes):
+            if output.dtypes.iloc[i] != dtype:
+                output.isetitem(i, output.iloc[:, i].astype(dtype))
         return output
+
+    def _column_keys(
+        self, vocabulary: Vocabulary, pivot_options: dict[str, Any]
+    ) -> list[tuple[str, str, int]]:
+        """Get the level, name and repeat number of every pivoted column."""
+        by = pivot_options["by"]
+        empty = HBNData(
+            self.data.iloc[:0], self.column_prefix, extra_columns=self.extra_columns
+        )
+        n_static = len(empty._static_columns().columns)
+        keys = []
+        for level in PIVOT_LEVELS if by == "all" else [by]:
+            output = empty._pivot(
+                empty._preprocessed_data,
+                by=level,
+                certainty_filter=pivot_options["certainty_filter"],
+                include_details=pivot_options["include_details"],
+                vocabulary=vocabulary.values,
+                column_names=vocabulary.columns,
+                compact_dtypes=pivot_options["compact_dtypes"],
+                sparse=False,
+                details_format=pivot_options["details_format"],
+            )
+            repeats: collections.Counter[str] = collections.Counter()
+            for name in output.columns[n_static:]:
+                keys.append((level, name, repeats[name]))
+                repeats[name] += 1
+        return keys
+
+    @classmethod
+    def stream(
+        cls,
+        input_path: str,
+        output_path: str | None = None,
+        by: Literal[
+            "diagnoses",
+            "subcategories",
+            "categories",
+            "all",
+        ] = "all",
+        certainty_filter: list[str] | None = None,
+        include_details: bool = False,
+        chunksize: int = 10_000,
+        extra_columns: list[str] | None = None,
+        input_format: str | None = None,
+        compact_dtypes: bool = True,
+        profiler: Profiler | None = None,
+        details_format: DetailsFormat = "repr",
+        vocabulary: Vocabulary | None = None,
+        fixed_schema: bool = False,
+        output_format: str | None = None,
+    ) -> str:
+        """Process a large file in row chunks to bound memory use.
+
+        A first pass reads the diagnosis columns to fix the output columns, and a
+        second pass pivots each chunk and flushes it to the output file, as CSV
+        rows, a Parquet row group or an Arrow record batch, so that the whole
+        output is never in memory. The file holds the same data as the one
+        written by `process`.
+
+        Args:
+            input_path: The path to the HBN data CSV, Parquet or Arrow file.
+            output_path: The path to save the processed data to. Defaults to a
+            file next to the input.
+            by: The level of detail to pivot the data. Options are "diagnoses",
+            "subcategories", "categories", and "all". Default is "all".
+            certainty_filter: The list of certainties to include. Default is None,
+            which will include all.
+            include_details: When pivoting by category or subcategory, whether to
+            include diagnosis level details in a separate column.
+            chunksize: The number of rows to read and pivot at a time.
+            extra_columns: Other columns to read and carry through to the output.
+            input_format: The format of the input file, "csv", "parquet" or
+            "feather". Defaults to the format of the file extension.
+            compact_dtypes: Whether to pivot with compact int8 and Categorical
+            dtypes. Default is True.
+            profiler: Optional profiler to measure the stages of every chunk with.
+            details_format: How to store the details of include_details, "repr",
+            "json" or "long". The long table is appended to a file next to the
+            output with a "_details" suffix.
+            vocabulary: Optional Vocabulary registry to create columns for. The
+            first pass extends it with the values of the file.
+            fixed_schema: Whether to keep the columns of the registry as they are
+            and skip the first pass. Numeric columns are then read per chunk, so
+            columns that are integers in some chunks and missing values in
+            others may be written differently than by process.
+            output_format: The format to save the processed data in, "csv",
+            "parquet" or "feather". Defaults to the format of the output path
+            extension, or CSV.
+
+        Returns:
+            The path of the processed data.
+        """
+        path = Path(input_path)
+        if not path.exists():
+            raise FileNotFoundError(f"File {path} not found.")
+        file_format = get_file_format(output_path, output_format)
+        if output_path is None:
+            output_path = default_output_path(input_path, by, file_format)
+        input_format = get_file_format(input_path, input_format)
+        columns = read_columns(input_path, input_format)
+        column_prefix = cls._detect_column_prefix(columns)
+        read_options = cls._read_options(columns, column_prefix, extra_columns)
+
+        if fixed_schema and vocabulary is None:
+            raise ValueError("A fixed schema requires a Vocabulary registry.")
+        dtypes: dict[str, str] = {}
+        if fixed_schema and vocabulary is not None:
+            registry = vocabulary
+        else:
+            with measure(profiler, "scan"):
+                registry, dtypes = cls._scan_chunks(
+                    input_path,
+                    column_prefix,
+                    chunksize,
+                    input_format,
+                    read_options,
+                    vocabulary,
+                )
+        chunks = read_chunks(
+            input_path,
+            chunksize,
+            columns=read_options["columns"],
+            dtype={**read_options["dtype"], **dtypes},
+            file_format=input_format,
+        )
+        writer = ChunkWriter(output_path, file_format)
+        details_writer = ChunkWriter(details_output_path(output_path), file_format)
+        with writer, details_writer:
+            while True:
+                with measure(profiler, "read") as stage:
+                    chunk = next(chunks, None)
+                    stage.rows = 0 if chunk is None else len(chunk)
+                if chunk is None:
+                    break
+                hbn_data = cls(
+                    data=chunk,
+                    column_prefix=column_prefix,
+                    extra_columns=extra_columns,
+                    profiler=profiler,
+                )
+                output = hbn_data.pivot(
+                    by,
+                    certainty_filter,
+                    include_details,
+                    vocabulary=registry,
+                    compact_dtypes=compact_dtypes,
+                    details_format=details_format,
+                    fixed_schema=True,
+                )
+                with measure(profiler, "write", len(output)):
+                    writer.write(output)
+                    if (
+                        include_details
+                        and details_format == "long"
+                        and by != "diagnoses"
+                    ):
+                        details_writer.write(
+                            hbn_data.details(
+                                by, certainty_filter, registry, compact_dtypes
+                            )
+                        )
+        return output_path
+
+    @classmethod
+    def _scan_chunks(
+        cls,
+        input_path: str,
+        column_prefix: str,
+        chunksize: int,
+        input_format: str,
+        read_options: dict,
+        vocabulary: Vocabulary | None = None,
+    ) -> tuple[Vocabulary, dict[str, str]]:
+        """Scan a file in chunks for the pivot vocabulary and column dtypes.
+
+        Returns a registry of the values of every pivot level, or the given
+        registry extended with them, and the columns that must be read as floats
+        so that integer chunks are written like the whole file.
+        """
+        scanned = Vocabulary()
+        kinds: dict[str, set[str]] = {}
+        chunks = read_chunks(
+            input_path, chunksize, file_format=input_format, **read_options
+        )
+        for chunk in chunks:
+            data = cls(data=chunk, column_prefix=column_prefix)._preprocessed_data
+            scanned.update(data, column_prefix)
+            for col, dtype in chunk.dtypes.items():
+                kinds.setdefault(str(col), set()).add(dtype.kind)
+        if vocabulary is not None:
+            vocabulary.merge(scanned)
+            scanned = vocabulary
+        # Integer columns with missing values in any chunk are read as floats
+        dtypes = {
+            col: "float64"
+            for col, col_kinds in kinds.items()
+            if "f" in col_kinds and col_kinds <= {"i", "u", "f"}
+        }
+        return scanned, dtypes
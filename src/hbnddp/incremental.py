@@ -0,0 +1,105 @@
+"""Manifests of processed outputs, for updating them with new data releases."""
+
+import json
+import logging
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+import pandas as pd
+
+from .vocabulary import Vocabulary
+
+logger = logging.getLogger(__name__)
+
+# Version of the manifest file layout
+MANIFEST_FORMAT = 1
+
+
+def manifest_path(output_path: str) -> str:
+    """Get the path of the manifest written next to an output file."""
+    path = Path(output_path)
+    return str(path.with_name(f"{path.stem}_manifest.json"))
+
+
+def row_hashes(data: pd.DataFrame) -> np.ndarray:
+    """Hash the values of every row of the data, ignoring the index."""
+    return pd.util.hash_pandas_object(data, index=False).to_numpy()
+
+
+@dataclass
+class Manifest:
+    """Record of how an output was processed, to update it with a new release.
+
+    Holds the parameters the output was processed with, the Vocabulary registry
+    of its columns, and a hash of the input row of every participant, indexed by
+    their identifiers.
+    """
+
+    parameters: dict[str, Any]
+    vocabulary: Vocabulary
+    hashes: pd.Series
+
+    def check(self, parameters: dict[str, Any]) -> None:
+        """Check that an update is processed with the same parameters.
+
+        Raises:
+            ValueError: If any of the parameters differ.
+        """
+        differences = sorted(
+            name
+            for name in set(self.parameters) | set(parameters)
+            if self.parameters.get(name) != parameters.get(name)
+        )
+        if differences:
+            raise ValueError(
+                "The previous output was processed with different parameters: "
+                f"{differences}"
+            )
+
+    def changed(self, identifiers: pd.Series, hashes: np.ndarray) -> np.ndarray:
+        """Get a mask of the rows that are new or changed since the manifest."""
+        positions = self.hashes.index.get_indexer(identifiers.to_numpy())
+        found = positions >= 0
+        unchanged = found & (self.hashes.to_numpy()[positions] == hashes)
+        return ~unchanged
+
+    def save(self, path: str) -> None:
+        """Save the manifest to a JSON file, replacing it atomically."""
+        manifest = {
+            "format": MANIFEST_FORMAT,
+            "parameters": self.parameters,
+            "vocabulary": self.vocabulary.to_dict(),
+            "identifiers": self.hashes.index.tolist(),
+            "hashes": self.hashes.tolist(),
+        }
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(manifest, file)
+        os.replace(temporary_path, path)
+        logger.info("Manifest of %d participants saved to %s", len(self.hashes), path)
+
+    @classmethod
+    def load(cls, path: str) -> "Manifest":
+        """Load a manifest saved with save.
+
+        Raises:
+            FileNotFoundError: If the manifest does not exist.
+            ValueError: If the file is not a manifest of a supported format.
+        """
+        if not Path(path).exists():
+            raise FileNotFoundError(f"Manifest {path} not found.")
+        with open(path) as file:
+            manifest = json.load(file)
+        if manifest.get("format") != MANIFEST_FORMAT:
+            raise ValueError(f"Unsupported manifest format: {manifest.get('format')}")
+        return cls(
+            parameters=manifest["parameters"],
+            vocabulary=Vocabulary.from_dict(manifest["vocabulary"]),
+            hashes=pd.Series(
+                np.array(manifest["hashes"], dtype=np.uint64),
+                index=manifest["identifiers"],
+            ),
+        )
@@ -1,14 +1,19 @@
 """Pivoting for HBN data."""
 
+import json
 import logging
 import re
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from enum import Enum
-from typing import Any, Literal, Optional
+from functools import lru_cache
+from types import ModuleType
+from typing import Any, Callable, Hashable, Literal, Optional
 
 import numpy as np
 import pandas as pd
 
+from .utils import write
+
 logger = logging.getLogger(__name__)
 
 TIME_COURSE_DXES = [
@@ -35,6 +40,63 @@ class TimeCode(Enum):
     PAST = 2
 
 
+# Certainty flag column suffixes, in bitmask order
+CERTAINTY_FLAGS = {
+    CertaintyLevel.BY_HX: "_ByHx",
+    CertaintyLevel.CONFIRMED: "_Confirmed",
+    CertaintyLevel.PRESUMPTIVE: "_Presum",
+    CertaintyLevel.RC: "_RC",
+    CertaintyLevel.RULE_OUT: "_RuleOut",
+}
+
+# Certainty for every combination of set flags, multiple or none are unknown
+_CERTAINTY_BY_MASK = np.array(
+    [CertaintyLevel.UNKNOWN.value] * 2 ** len(CERTAINTY_FLAGS), dtype=object
+)
+for _bit, _level in enumerate(CERTAINTY_FLAGS):
+    _CERTAINTY_BY_MASK[1 << _bit] = _level.value
+
+# Time for every combination of present (1), past (2) and time course (4) bits
+_TIME_BY_MASK = np.array(
+    ["Unknown", "Present", "Past", "Past"] + ["Specific Time Course"] * 4,
+    dtype=object,
+)
+
+# Compact dtypes of the certainty and time output columns
+CERTAINTY_DTYPE = pd.CategoricalDtype([level.value for level in CertaintyLevel])
+TIME_DTYPE = pd.CategoricalDtype(["Present", "Past", "Specific Time Course", "Unknown"])
+
+# Formats of the diagnosis-level details of subcategories and categories: the repr
+# of a list of dicts, a JSON array, or a separate long table
+DetailsFormat = Literal["repr", "json", "long"]
+DETAILS_FORMATS = ["repr", "json", "long"]
+
+# Backends of the vectorized pivot kernels. Both build the same pandas output, the
+# polars backend runs the string-heavy details and the slot grouping as
+# multi-threaded Polars expressions over Arrow strings.
+Backend = Literal["pandas", "polars"]
+BACKENDS = ["pandas", "polars"]
+
+# Measures of the co-occurrence of pairs of values: participants with both, the
+# Jaccard index, and the rate of one value among the participants with the other
+CoOccurrenceMeasure = Literal["count", "jaccard", "conditional"]
+COOCCURRENCE_MEASURES = ["count", "jaccard", "conditional"]
+
+# Keys of the diagnosis-level details and the slot fields they are taken from
+SUBCATEGORY_DETAILS = {
+    "diagnosis": "diagnosis",
+    "ICD_code": "code",
+    "certainty": "certainty",
+    "time": "time",
+    "past_documentation": "past_doc",
+}
+CATEGORY_DETAILS = {
+    "diagnosis": "diagnosis",
+    "subcategory": "sub",
+    **{key: field for key, field in SUBCATEGORY_DETAILS.items() if key != "diagnosis"},
+}
+
+
 @dataclass
 class DxInfo:
     """Dataclass for storing diagnosis-specific information."""
@@ -48,6 +110,240 @@ class DxInfo:
     time: str
 
 
+@dataclass
+class DxSlots:
+    """Columnar store of diagnosis-specific information for every filled slot.
+
+    Each array holds one entry per (row, slot) pair, ordered by row position and
+    then by diagnosis number, so the details of a slot are found at the same
+    position in every array.
+
+    Arrays derived from the slots, such as value codes and encoded details, are
+    computed once per store. A store taken from another one, for example by a
+    certainty filter, takes its derived arrays from the store it was taken from,
+    so that several filters of the same slots share them.
+    """
+
+    n_rows: int
+    row: np.ndarray
+    slot: np.ndarray
+    diagnosis: np.ndarray
+    sub: np.ndarray
+    cat: np.ndarray
+    code: np.ndarray
+    spec: np.ndarray
+    past_doc: np.ndarray
+    certainty: np.ndarray
+    time: np.ndarray
+    _source: "tuple[DxSlots, np.ndarray] | None" = field(
+        default=None, repr=False, compare=False
+    )
+    _derived: dict[Hashable, np.ndarray] = field(
+        default_factory=dict, repr=False, compare=False
+    )
+
+    def take(self, positions: np.ndarray) -> "DxSlots":
+        """Return a store with only the selected slots, by mask or position."""
+        if positions.dtype == bool:
+            positions = np.flatnonzero(positions)
+        return DxSlots(
+            n_rows=self.n_rows,
+            **{
+                name: getattr(self, name)[positions]
+                for name in self.__dataclass_fields__
+                if name != "n_rows" and not name.startswith("_")
+            },
+            _source=(self, positions),
+        )
+
+    def derived(
+        self, key: Hashable, compute: Callable[["DxSlots"], np.ndarray]
+    ) -> np.ndarray:
+        """Get an array with one entry per slot, computed once per store.
+
+        The compute function is called with the store to derive the array from,
+        which is the store this one was taken from, if any.
+        """
+        if key not in self._derived:
+            if self._source is None:
+                self._derived[key] = compute(self)
+            else:
+                source, positions = self._source
+                self._derived[key] = source.derived(key, compute)[positions]
+        return self._derived[key]
+
+    def filter(self, certainty_filter: list[str] | None) -> "DxSlots":
+        """Return a store with only the slots passing the certainty filter."""
+        if certainty_filter is None:
+            return self
+        return self.take(pd.Series(self.certainty).isin(certainty_filter).to_numpy())
+
+
+def _import_polars() -> ModuleType:
+    """Import polars for the polars backend."""
+    try:
+        import polars
+    except ImportError as e:
+        raise ImportError(
+            "The polars backend requires polars. "
+            "Install it with `pip install hbn-ddp[polars]`."
+        ) from e
+    return polars
+
+
+def _import_sparse() -> ModuleType:
+    """Import scipy.sparse for sparse incidence matrices."""
+    try:
+        from scipy import sparse
+    except ImportError as e:
+        raise ImportError(
+            "Sparse incidence matrices require scipy. "
+            "Install it with `pip install hbn-ddp[sparse]`."
+        ) from e
+    return sparse
+
+
+@dataclass
+class Incidence:
+    """Participants by values presence matrix.
+
+    The matrix is a scipy.sparse CSR matrix of int8 flags, with one row for each
+    participant and one column for each diagnosis, subcategory or category, and
+    the labels of its rows and columns.
+    """
+
+    matrix: Any
+    rows: np.ndarray
+    columns: np.ndarray
+
+    def save_npz(self, path: str) -> None:
+        """Save the matrix and its labels to a .npz file.
+
+        The file uses the layout of scipy.sparse.save_npz, so it can also be
+        loaded with scipy.sparse.load_npz, which ignores the labels.
+        """
+        matrix = self.matrix.tocsr()
+        np.savez_compressed(
+            path,
+            format=np.array(b"csr"),
+            shape=np.array(matrix.shape),
+            data=matrix.data,
+            indices=matrix.indices,
+            indptr=matrix.indptr,
+            rows=np.asarray(self.rows).astype(str),
+            columns=np.asarray(self.columns).astype(str),
+        )
+
+    @classmethod
+    def load_npz(cls, path: str) -> "Incidence":
+        """Load a matrix and its labels saved with save_npz."""
+        sparse = _import_sparse()
+        with np.load(path, allow_pickle=False) as loaded:
+            matrix = sparse.csr_matrix(
+                (loaded["data"], loaded["indices"], loaded["indptr"]),
+                shape=tuple(loaded["shape"]),
+            )
+            return cls(matrix=matrix, rows=loaded["rows"], columns=loaded["columns"])
+
+    def cooccurrence(self) -> "CoOccurrence":
+        """Count the participants with every pair of values.
+
+        All pairs are counted by one sparse product of the matrix with itself,
+        so the cost grows with the number of flags rather than the number of
+        participants times pairs.
+        """
+        # Count in int32, the int8 flags would overflow
+        matrix = self.matrix.tocsr().astype(np.int32)
+        counts = (matrix.T @ matrix).toarray().astype(np.int64)
+        return CoOccurrence(counts=counts, columns=self.columns)
+
+
+@dataclass
+class CoOccurrence:
+    """Pairwise co-occurrence of diagnoses, subcategories or categories.
+
+    Entry (i, j) of the counts is the number of participants with both values i
+    and j, and its diagonal the number of participants with each value.
+    """
+
+    counts: np.ndarray
+    columns: np.ndarray
+
+    def jaccard(self) -> np.ndarray:
+        """Get the Jaccard index of every pair of values.
+
+        The index is the number of participants with both values over the number
+        with either, and is NaN for pairs of values no participant has.
+        """
+        totals = np.diag(self.counts)
+        union = totals[:, None] + totals[None, :] - self.counts
+        return np.divide(
+            self.counts,
+            union,
+            out=np.full(self.counts.shape, np.nan),
+            where=union > 0,
+        )
+
+    def conditional(self) -> np.ndarray:
+        """Get the rate of every value among the participants with another.
+
+        Entry (i, j) is the share of the participants with value i that also
+        have value j, and is NaN for values i no participant has.
+        """
+        totals = np.diag(self.counts)[:, None]
+        return np.divide(
+            self.counts,
+            totals,
+            out=np.full(self.counts.shape, np.nan),
+            where=totals > 0,
+        )
+
+    def to_frame(self, measure: CoOccurrenceMeasure = "count") -> pd.DataFrame:
+        """Get a measure of every pair as a table labelled by the values."""
+        match measure:
+            case "count":
+                values = self.counts
+            case "jaccard":
+                values = self.jaccard()
+            case "conditional":
+                values = self.conditional()
+            case _:
+                raise ValueError(
+                    f"Invalid co-occurrence measure: {measure}. "
+                    f"Valid measures are: {COOCCURRENCE_MEASURES}"
+                )
+        labels = pd.Index(self.columns)
+        return pd.DataFrame(values, index=labels, columns=labels)
+
+    def to_long(self) -> pd.DataFrame:
+        """Get the measures of the ordered pairs of distinct values that co-occur.
+
+        Returns:
+            A table with the "first" and "second" value of every pair, their
+            "count" and "jaccard" index, and the "conditional" rate of the
+            second value among the participants with the first.
+        """
+        first, second = np.nonzero(self.counts)
+        distinct = first != second
+        first, second = first[distinct], second[distinct]
+        return pd.DataFrame(
+            {
+                "first": self.columns[first],
+                "second": self.columns[second],
+                "count": self.counts[first, second],
+                "jaccard": self.jaccard()[first, second],
+                "conditional": self.conditional()[first, second],
+            }
+        )
+
+    def save(self, path: str, file_format: str | None = None) -> None:
+        """Save the measures of the co-occurring pairs to a CSV or Parquet file.
+
+        The format is taken from file_format, or else from the path extension.
+        """
+        write(self.to_long(), path, "cooccurrence", path, file_format=file_format)
+
+
 class Pivot:
     """Class for pivoting the data."""
 
@@ -63,12 +359,20 @@ class Pivot:
     }
 
     @staticmethod
+    @lru_cache(maxsize=None)
     def _clean_dx_value(value: str) -> str:
         """Clean diagnosis value to use as column name."""
         cleaned = re.sub(r"[^\w\s/-]", "", str(value).strip())
         cleaned = cleaned.replace("/", "_").replace("-", "_")
         return cleaned.replace(" ", "_")
 
+    @classmethod
+    def _column_name(cls, value: str, column_names: dict[str, str] | None) -> str:
+        """Get the column name of a value, from the given names if it has one."""
+        if column_names is not None and value in column_names:
+            return column_names[value]
+        return cls._clean_dx_value(value)
+
     @classmethod
     def _get_values(
         cls,
@@ -81,7 +385,9 @@ class Pivot:
             case "diagnoses":
                 columns = [cls._dx_column_name(column_prefix, n) for n in cls.DX_NS]
             case "categories":
-                columns = [cls._dx_column_name(column_prefix, n) for n in cls.DX_NS]
+                columns = [
+                    cls._dx_column_name(column_prefix, n) + "_Cat" for n in cls.DX_NS
+                ]
             case "subcategories":
                 columns = [
                     cls._dx_column_name(column_prefix, n) + "_Sub" for n in cls.DX_NS
@@ -97,41 +403,51 @@ class Pivot:
         return sorted(list(values))
 
     @staticmethod
-    def _set_certainty(data: pd.DataFrame, i: int, col: str) -> str:
-        """Get the certainty for a diagnosis."""
-        certainty_conds = [
-            (CertaintyLevel.BY_HX.value, data.at[i, f"{col}_ByHx"] == 1),
-            (CertaintyLevel.CONFIRMED.value, data.at[i, f"{col}_Confirmed"] == 1),
-            (CertaintyLevel.PRESUMPTIVE.value, data.at[i, f"{col}_Presum"] == 1),
-            (CertaintyLevel.RC.value, data.at[i, f"{col}_RC"] == 1),
-            (CertaintyLevel.RULE_OUT.value, data.at[i, f"{col}_RuleOut"] == 1),
-        ]
-
-        certainty_matches = [name for name, cond in certainty_conds if cond]
-        if len(certainty_matches) == 1:
-            certainty = certainty_matches[0]
-        elif len(certainty_matches) > 1:
-            # multiple certainties
-            certainty = CertaintyLevel.UNKNOWN.value
-        else:
-            # no certainties
-            certainty = CertaintyLevel.UNKNOWN.value
-
-        return certainty
+    def _resolve_certainties(flags: np.ndarray) -> np.ndarray:
+        """Resolve certainty levels from an array of certainty flags.
+
+        Args:
+            flags: Array whose last axis holds the flags in CERTAINTY_FLAGS order,
+            e.g. shaped (rows, slots, 5).
+
+        Returns:
+            Array of certainty levels with the shape of the leading axes.
+        """
+        bits = np.asarray(flags == 1, dtype=np.uint8)
+        mask = (bits << np.arange(len(CERTAINTY_FLAGS), dtype=np.uint8)).sum(
+            axis=-1, dtype=np.uint8
+        )
+        return _CERTAINTY_BY_MASK[mask]
 
     @staticmethod
-    def _set_time(data: pd.DataFrame, i: int, col: str) -> str:
-        """Get the time for a diagnosis."""
+    def _resolve_times(diagnoses: np.ndarray, time_codes: np.ndarray) -> np.ndarray:
+        """Resolve diagnosis times from arrays of diagnoses and time codes."""
         # set time to specific time course for applicable diagnoses
-        if data.at[i, f"{col}"] in TIME_COURSE_DXES:
-            time = "Specific Time Course"
-        elif data.at[i, f"{col}_Time"] == TimeCode.PAST.value:
-            time = "Past"
-        elif data.at[i, f"{col}_Time"] == TimeCode.PRESENT.value:
-            time = "Present"
-        else:
-            time = "Unknown"
-        return time
+        time_course = pd.Series(np.ravel(diagnoses)).isin(TIME_COURSE_DXES)
+        mask = (
+            (time_codes == TimeCode.PRESENT.value).astype(np.uint8)
+            | (time_codes == TimeCode.PAST.value).astype(np.uint8) << 1
+            | time_course.to_numpy().reshape(np.shape(diagnoses)).astype(np.uint8) << 2
+        )
+        return _TIME_BY_MASK[mask]
+
+    @classmethod
+    def _set_certainty(cls, data: pd.DataFrame, i: int, col: str) -> str:
+        """Get the certainty for a diagnosis."""
+        flags = np.array(
+            [data.at[i, f"{col}{suffix}"] for suffix in CERTAINTY_FLAGS.values()]
+        )
+        return str(cls._resolve_certainties(flags))
+
+    @classmethod
+    def _set_time(cls, data: pd.DataFrame, i: int, col: str) -> str:
+        """Get the time for a diagnosis."""
+        return str(
+            cls._resolve_times(
+                np.array(data.at[i, col], dtype=object),
+                np.array(data.at[i, f"{col}_Time"]),
+            )
+        )
 
     @staticmethod
     def _dx_column_name(column_prefix: str, n: str) -> str:
@@ -152,6 +468,279 @@ class Pivot:
 
         return details
 
+    @classmethod
+    def _slot_values(cls, data: pd.DataFrame, columns: list[str]) -> np.ndarray:
+        """Stack slot columns into a row by slot array.
+
+        Missing columns are treated as empty. Values keep the column dtype when all
+        slots share it, so they compare and display like scalar lookups.
+        """
+        return np.column_stack(
+            [
+                data[col].to_numpy()
+                if col in data.columns
+                else np.full(len(data), np.nan)
+                for col in columns
+            ]
+        )
+
+    @classmethod
+    def extract_slots(cls, data: pd.DataFrame, column_prefix: str) -> DxSlots:
+        """Extract the details of every filled diagnosis slot into a DxSlots store.
+
+        Certainty and time are resolved for all slots at once, so the store can be
+        shared between the diagnosis, subcategory and category pivots.
+        """
+        cols = [cls._dx_column_name(column_prefix, n) for n in cls.DX_NS]
+
+        def values(suffix: str) -> np.ndarray:
+            return cls._slot_values(data, [f"{col}{suffix}" for col in cols])
+
+        diagnosis = values("")
+        certainty = cls._resolve_certainties(
+            np.stack([values(suffix) for suffix in CERTAINTY_FLAGS.values()], axis=-1)
+        )
+        time = cls._resolve_times(diagnosis, values("_Time"))
+        sub = values("_Sub")
+        cat = values("_Cat")
+        # Only keep slots that hold a diagnosis, subcategory or category
+        filled = (pd.notna(diagnosis) | pd.notna(sub) | pd.notna(cat)).ravel()
+
+        positions = np.flatnonzero(filled)
+        return DxSlots(
+            n_rows=len(data),
+            row=positions // len(cols),
+            slot=positions % len(cols),
+            diagnosis=diagnosis.ravel()[filled],
+            sub=sub.ravel()[filled],
+            cat=cat.ravel()[filled],
+            code=values("_Code").ravel()[filled],
+            spec=values("_Spec").ravel()[filled],
+            past_doc=values("_Past_Doc").ravel()[filled],
+            certainty=certainty.ravel()[filled],
+            time=time.ravel()[filled],
+        )
+
+    @staticmethod
+    def _group_slots(codes: np.ndarray, n_values: int) -> list[np.ndarray]:
+        """Group slot positions by value code, keeping row and slot order.
+
+        Returns one array of slot positions for each value code, where a code of
+        -1 marks a slot that does not hold any of the values.
+        """
+        matched = np.flatnonzero(codes >= 0)
+        order = matched[np.argsort(codes[matched], kind="stable")]
+        counts = np.bincount(codes[matched], minlength=n_values)
+        return np.split(order, np.cumsum(counts)[:-1])
+
+    @staticmethod
+    def _value_dtype(values: np.ndarray) -> pd.CategoricalDtype:
+        """Get a categorical dtype for the values found in slots."""
+        found = pd.unique(values[pd.notna(values)])
+        return pd.CategoricalDtype(sorted(found, key=str))
+
+    @staticmethod
+    def _categorical_column(
+        n_rows: int, rows: np.ndarray, codes: np.ndarray, dtype: pd.CategoricalDtype
+    ) -> pd.Categorical:
+        """Build a categorical column with the given codes at the given rows."""
+        column_codes = np.full(n_rows, -1, dtype=codes.dtype)
+        column_codes[rows] = codes
+        return pd.Categorical.from_codes(column_codes, dtype=dtype)
+
+    @staticmethod
+    def _presence_column(
+        n_rows: int, rows: np.ndarray, compact_dtypes: bool, sparse: bool
+    ) -> np.ndarray | pd.arrays.SparseArray:
+        """Build a presence flag column that is 1 at the given rows."""
+        present_data = np.zeros(n_rows, dtype=np.int8 if compact_dtypes else np.int64)
+        present_data[rows] = 1
+        if sparse:
+            return pd.arrays.SparseArray(present_data, fill_value=0)
+        return present_data
+
+    @staticmethod
+    def _json_value(value: Any) -> str:  # noqa: ANN401
+        """Encode a detail value as JSON, with missing values as null."""
+        if pd.isna(value):
+            return "null"
+        return json.dumps(value.item() if isinstance(value, np.generic) else value)
+
+    @staticmethod
+    def _encode(values: np.ndarray, encode: Callable[[Any], str]) -> np.ndarray:
+        """Encode every value as a string, calling encode once per distinct value.
+
+        Values of different types that compare equal, such as 1 and 1.0, or None
+        and NaN, are encoded separately.
+        """
+        codes, _ = pd.factorize(values)
+        if values.dtype == object:
+            type_codes, types = pd.factorize(np.frompyfunc(type, 1, 1)(values))
+            # Missing values have negative codes, one for each type
+            codes = np.where(
+                codes >= 0, codes * len(types) + type_codes, -1 - type_codes
+            )
+        _, first, inverse = np.unique(codes, return_index=True, return_inverse=True)
+        encoded = np.array([encode(value) for value in values[first]], dtype=object)
+        return encoded[inverse.ravel()]
+
+    @classmethod
+    def _detail_records(
+        cls, slots: DxSlots, keys: dict[str, str], details_format: DetailsFormat
+    ) -> np.ndarray:
+        """Encode the diagnosis-level details of every slot as a record string.
+
+        Records are the repr of a dict in repr format, or a JSON object. The
+        strings are assembled from the encoded distinct values of each field, so
+        no dict is built per slot.
+        """
+        json_format = details_format == "json"
+        encode: Callable[[Any], str] = cls._json_value if json_format else repr
+        records = np.full(len(slots.row), "{", dtype=object)
+        for i, (key, field_name) in enumerate(keys.items()):
+            values = getattr(slots, field_name)
+            if field_name == "past_doc" and not json_format and values.dtype == object:
+                values = np.where(values == None, "", values)  # noqa: E711
+            separator = ", " if i > 0 else ""
+            records = (
+                records + f"{separator}{encode(key)}: " + cls._encode(values, encode)
+            )
+        return records + "}"
+
+    @classmethod
+    def _details_column(
+        cls,
+        slots: DxSlots,
+        positions: np.ndarray,
+        keys: dict[str, str],
+        details_format: DetailsFormat,
+    ) -> np.ndarray:
+        """Join the diagnosis-level details of the given slots by row.
+
+        In repr format a row holds the repr of its list of detail dicts without
+        brackets, and in JSON format a JSON array of objects. The records of all
+        slots are encoded once per store and shared by every column.
+        """
+        json_format = details_format == "json"
+        details_data = np.full(slots.n_rows, None if json_format else "", dtype=object)
+        if len(positions) == 0:
+            return details_data
+        records = slots.derived(
+            ("details", tuple(keys), details_format),
+            lambda source: cls._detail_records(source, keys, details_format),
+        )[positions]
+        rows = slots.row[positions]
+        starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+        separators = np.full(len(positions), ", ", dtype=object)
+        separators[starts] = "[" if json_format else ""
+        joined = np.add.reduceat(separators + records, starts)
+        details_data[rows[starts]] = joined + "]" if json_format else joined
+        return details_data
+
+    @classmethod
+    def _value_codes(
+        cls, slots: DxSlots, field_name: str, dtype: pd.CategoricalDtype
+    ) -> np.ndarray:
+        """Get the codes of a slot field in the categories of a dtype, -1 if absent.
+
+        The codes are derived once per store and categories.
+        """
+        return slots.derived(
+            ("codes", field_name, tuple(dtype.categories)),
+            lambda source: pd.Categorical(
+                getattr(source, field_name), dtype=dtype
+            ).codes,
+        )
+
+    @classmethod
+    def _polars_detail_records(
+        cls, slots: DxSlots, keys: dict[str, str], details_format: DetailsFormat
+    ) -> Any:  # noqa: ANN401
+        """Encode the details of every slot as a record string in a Polars Series.
+
+        The records are the same as those of _detail_records, concatenated as
+        Arrow strings instead of Python objects.
+        """
+        pl = _import_polars()
+        json_format = details_format == "json"
+        encode: Callable[[Any], str] = cls._json_value if json_format else repr
+        parts: list[Any] = [pl.lit("{")]
+        fields = {}
+        for i, (key, field_name) in enumerate(keys.items()):
+            values = getattr(slots, field_name)
+            if field_name == "past_doc" and not json_format and values.dtype == object:
+                values = np.where(values == None, "", values)  # noqa: E711
+            separator = ", " if i > 0 else ""
+            parts += [pl.lit(f"{separator}{encode(key)}: "), pl.col(field_name)]
+            fields[field_name] = pl.Series(cls._encode(values, encode), dtype=pl.String)
+        parts.append(pl.lit("}"))
+        return pl.DataFrame(fields).select(pl.concat_str(parts)).to_series()
+
+    @classmethod
+    def _polars_details_columns(
+        cls,
+        slots: DxSlots,
+        codes: np.ndarray,
+        n_values: int,
+        keys: dict[str, str],
+        details_format: DetailsFormat,
+    ) -> list[np.ndarray]:
+        """Join the details of the slots of every value by row with Polars.
+
+        All values are joined in one group by of the value codes and rows, which
+        keeps the slot order of every row, and the joined strings are scattered
+        into one column for each value, like _details_column.
+        """
+        pl = _import_polars()
+        json_format = details_format == "json"
+        matched = np.flatnonzero(codes >= 0)
+        records = slots.derived(
+            ("polars_details", tuple(keys), details_format),
+            lambda source: cls._polars_detail_records(source, keys, details_format),
+        )
+        joined = (
+            pl.DataFrame(
+                {
+                    "code": codes[matched],
+                    "row": slots.row[matched],
+                    "record": records[matched],
+                }
+            )
+            .group_by(["code", "row"], maintain_order=True)
+            .agg(pl.col("record").str.join(", "))
+            .sort("code", maintain_order=True)
+        )
+        if json_format:
+            joined = joined.with_columns(
+                pl.concat_str([pl.lit("["), pl.col("record"), pl.lit("]")]).alias(
+                    "record"
+                )
+            )
+        counts = np.bincount(joined["code"].to_numpy(), minlength=n_values)
+        bounds = np.r_[0, np.cumsum(counts)]
+        rows = joined["row"].to_numpy()
+        strings = joined["record"].to_numpy()
+        columns = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            details_data = np.full(
+                slots.n_rows, None if json_format else "", dtype=object
+            )
+            details_data[rows[start:stop]] = strings[start:stop]
+            columns.append(details_data)
+        return columns
+
+    @staticmethod
+    def _first_matches(
+        rows: np.ndarray, codes: np.ndarray, backend: Backend
+    ) -> np.ndarray:
+        """Get a mask of the first slot of every row holding each value code."""
+        if backend == "polars":
+            pl = _import_polars()
+            # Combine the row and code into one integer key
+            keys = rows.astype(np.int64) * (int(codes.max(initial=0)) + 2) + codes + 1
+            return pl.Series(keys).is_first_distinct().to_numpy()
+        return ~pd.DataFrame({"row": rows, "code": codes}).duplicated().to_numpy()
+
     @classmethod
     def _filter_pass(cls, certainty: str, certainty_filter: list[str] | None) -> bool:
         """Apply the filter."""
@@ -164,68 +753,113 @@ class Pivot:
         output: pd.DataFrame,
         column_prefix: str,
         certainty_filter: Optional[list[str]] = None,
+        slots: DxSlots | None = None,
+        values: list[str] | None = None,
+        column_names: dict[str, str] | None = None,
+        compact_dtypes: bool = True,
+        sparse: bool = False,
+        infer_dtypes: bool = True,
+        backend: Backend = "pandas",
     ) -> pd.DataFrame:
         """Pivot the data by diagnoses.
 
+        Every diagnosis column is filled from the first slot of each participant
+        that holds the diagnosis and passes the certainty filter.
+
         Args:
             data: Input DataFrame with HBN diagnostic data
             output: Output DataFrame to append pivoted columns to
             certainty_filter: Optional list of certainty levels to include
             column_prefix: Prefix for diagnosis columns in the data
+            slots: Optional diagnosis slots extracted from the data with the
+            certainty filter already applied.
+            values: Optional fixed list of values to create columns for, instead
+            of the values found in the data.
+            column_names: Optional names of the columns of each value, defaults
+            to the cleaned values.
+            compact_dtypes: Whether to store presence flags as int8 and
+            categorical values as pandas Categoricals, rather than as int64 and
+            object columns.
+            sparse: Whether to store presence flags and numeric detail columns as
+            pandas sparse columns.
+            infer_dtypes: Whether to infer the dtypes of non-categorical detail
+            columns from their values, otherwise they are object columns.
+            backend: The backend of the slot grouping kernels, "pandas" or
+            "polars". Both give the same output.
 
         Returns:
             Output DataFrame with diagnosis columns added
         """
-        repeated_vars = ["_Cat", "_Sub", "_Spec", "_ICD_Code", "_Past_Doc"]
-        dx_values = cls._get_values(data, "diagnoses", column_prefix)
+        detail_vars = {
+            "_Certainty": "certainty",
+            "_Time": "time",
+            "_Cat": "cat",
+            "_Sub": "sub",
+            "_Spec": "spec",
+            "_ICD_Code": "code",
+            "_Past_Doc": "past_doc",
+        }
+        dx_values = (
+            values
+            if values is not None
+            else cls._get_values(data, "diagnoses", column_prefix)
+        )
         logger.info("Processing diagnoses")
+        if slots is None:
+            slots = cls.extract_slots(data, column_prefix).filter(certainty_filter)
+        categorical_dtypes = (
+            {
+                "certainty": CERTAINTY_DTYPE,
+                "time": TIME_DTYPE,
+                "cat": cls._value_dtype(slots.cat),
+                "sub": cls._value_dtype(slots.sub),
+            }
+            if compact_dtypes
+            else {}
+        )
+
+        # Slots are ordered by row then slot number, so keeping the first match
+        # mirrors stopping at the first matching diagnosis number.
+        codes = cls._value_codes(slots, "diagnosis", pd.CategoricalDtype(dx_values))
+        keep = cls._first_matches(slots.row, codes, backend) & (codes >= 0)
+        slots = slots.take(keep)
+        groups = cls._group_slots(codes[keep], len(dx_values))
+        categorical_codes = {
+            field_name: cls._value_codes(slots, field_name, dtype)
+            for field_name, dtype in categorical_dtypes.items()
+        }
 
         # Dictionary to collect all new columns
         all_new_cols: dict[str, Any] = {}
 
-        for dx_val in dx_values:
-            new_col = cls._clean_dx_value(dx_val)
-
-            # Collect all updates for this diagnosis
-            present_data = [0] * len(data)
-            certainty_data: list[str | None] = [None] * len(data)
-            time_data: list[str | None] = [None] * len(data)
-            repeated_data: dict[str, list[str | int | None]] = {
-                var: [None] * len(data) for var in repeated_vars
-            }
-
-            for i in range(len(data)):
-                for n in cls.DX_NS:
-                    col = cls._dx_column_name(column_prefix, n)
-                    details = cls._get_diagnosis_details(data, i, col)
-
-                    # Check if this row has the specific diagnosis
-                    if details.diagnosis == dx_val:
-                        # Apply filter if selected
-                        if cls._filter_pass(details.certainty, certainty_filter):
-                            present_data[i] = 1
-                            certainty_data[i] = details.certainty
-                            time_data[i] = details.time
-
-                            # Store repeated variables data
-                            for var in repeated_vars:
-                                original_var_name = (
-                                    "_Code" if var == "_ICD_Code" else var
-                                )
-                                repeated_data[var][i] = data.at[
-                                    i,
-                                    f"{col}{original_var_name}",
-                                ]
-
-                            # If dx is found, do not need to check other dx numbers
-                            break
+        for dx_val, positions in zip(dx_values, groups):
+            new_col = cls._column_name(dx_val, column_names)
+            rows = slots.row[positions]
 
             # Store columns for this diagnosis
-            all_new_cols[f"{new_col}_DiagnosisPresent"] = present_data
-            all_new_cols[f"{new_col}_Certainty"] = certainty_data
-            all_new_cols[f"{new_col}_Time"] = time_data
-            for var in repeated_vars:
-                all_new_cols[f"{new_col}{var}"] = repeated_data[var]
+            all_new_cols[f"{new_col}_DiagnosisPresent"] = cls._presence_column(
+                len(data), rows, compact_dtypes, sparse
+            )
+            for var, field_name in detail_vars.items():
+                if field_name in categorical_dtypes:
+                    all_new_cols[f"{new_col}{var}"] = cls._categorical_column(
+                        len(data),
+                        rows,
+                        categorical_codes[field_name][positions],
+                        categorical_dtypes[field_name],
+                    )
+                else:
+                    detail_data = np.full(len(data), None, dtype=object)
+                    detail_data[rows] = getattr(slots, field_name)[positions]
+                    # Infer dtypes as if the column had been built from a list
+                    detail_column = pd.Series(detail_data, index=output.index)
+                    if infer_dtypes:
+                        detail_column = detail_column.infer_objects()
+                    if sparse and detail_column.dtype != object:
+                        detail_column = detail_column.astype(
+                            pd.SparseDtype(detail_column.dtype)
+                        )
+                    all_new_cols[f"{new_col}{var}"] = detail_column
 
         # Add all new columns at once to avoid fragmentation
         new_df = pd.DataFrame(all_new_cols, index=output.index)
@@ -241,6 +875,13 @@ class Pivot:
         column_prefix: str,
         certainty_filter: Optional[list[str]] = None,
         include_details: bool = False,
+        slots: DxSlots | None = None,
+        values: list[str] | None = None,
+        column_names: dict[str, str] | None = None,
+        compact_dtypes: bool = True,
+        sparse: bool = False,
+        details_format: DetailsFormat = "repr",
+        backend: Backend = "pandas",
     ) -> pd.DataFrame:
         """Pivot the dataset on diagnostic subcategories.
 
@@ -251,53 +892,62 @@ class Pivot:
             include_details: Whether to include diagnosis-level details.
             These will be stored in a single column per subcategory.
             column_prefix: Prefix for diagnosis columns in the data
+            slots: Optional diagnosis slots extracted from the data with the
+            certainty filter already applied.
+            values: Optional fixed list of values to create columns for, instead
+            of the values found in the data.
+            column_names: Optional names of the columns of each value, defaults
+            to the cleaned values.
+            compact_dtypes: Whether to store presence flags as int8 and
+            categorical values as pandas Categoricals, rather than as int64 and
+            object columns.
+            sparse: Whether to store presence flags and numeric detail columns as
+            pandas sparse columns.
+            details_format: The format of the details columns, "repr" for the
+            repr of a list of dicts or "json" for a JSON array. With "long", no
+            details columns are added, see the details method.
+            backend: The backend of the details and grouping kernels, "pandas"
+            or "polars". Both give the same output.
 
         Returns:
             Output DataFrame with subcategory columns added
         """
-        dx_values = cls._get_values(data, "subcategories", column_prefix=column_prefix)
+        dx_values = (
+            values
+            if values is not None
+            else cls._get_values(data, "subcategories", column_prefix=column_prefix)
+        )
         logger.info("Processing diagnostic subcategories.")
+        if slots is None:
+            slots = cls.extract_slots(data, column_prefix).filter(certainty_filter)
+        codes = cls._value_codes(slots, "sub", pd.CategoricalDtype(dx_values))
+        groups = cls._group_slots(codes, len(dx_values))
+        with_details = include_details and details_format != "long"
+        polars_details = (
+            cls._polars_details_columns(
+                slots, codes, len(dx_values), SUBCATEGORY_DETAILS, details_format
+            )
+            if with_details and backend == "polars"
+            else None
+        )
 
         # Dictionary to collect all new columns
         all_new_cols: dict[str, Any] = {}
 
-        for dx_val in dx_values:
-            new_col = cls._clean_dx_value(dx_val)
-
-            # Collect all updates for this subcategory
-            present_data = [0] * len(data)
-            details_data: list[str] = [""] * len(data) if include_details else []
-
-            for i in range(len(data)):
-                cat_details = []
-                for n in cls.DX_NS:
-                    col = cls._dx_column_name(column_prefix, n)
-                    details = cls._get_diagnosis_details(data, i, col)
-                    if details.sub == dx_val:
-                        # Apply filter if selected
-                        if cls._filter_pass(details.certainty, certainty_filter):
-                            present_data[i] = 1
-
-                            # Create dictionary to store details on a diagnostic level
-                            cat_dict = {
-                                "diagnosis": details.diagnosis,
-                                "ICD_code": details.code,
-                                "certainty": details.certainty,
-                                "time": details.time,
-                                "past_documentation": ""
-                                if details.past_doc is None
-                                else details.past_doc,
-                            }
-                            cat_details.append(cat_dict)
-
-                # Store subcategory details
-                if include_details and cat_details:
-                    details_data[i] = str(cat_details).strip("[]")
+        for i, (dx_val, positions) in enumerate(zip(dx_values, groups)):
+            new_col = cls._column_name(dx_val, column_names)
+            rows = slots.row[positions]
 
             # Store columns for this subcategory
-            all_new_cols[f"{new_col}_SubcategoryPresent"] = present_data
-            if include_details:
-                all_new_cols[f"{new_col}_Details"] = details_data
+            all_new_cols[f"{new_col}_SubcategoryPresent"] = cls._presence_column(
+                len(data), rows, compact_dtypes, sparse
+            )
+            if polars_details is not None:
+                all_new_cols[f"{new_col}_Details"] = polars_details[i]
+            elif with_details:
+                all_new_cols[f"{new_col}_Details"] = cls._details_column(
+                    slots, positions, SUBCATEGORY_DETAILS, details_format
+                )
 
         # Add all new columns at once to avoid fragmentation
         new_df = pd.DataFrame(all_new_cols, index=output.index)
@@ -313,6 +963,13 @@ class Pivot:
         column_prefix: str,
         certainty_filter: list[str] | None = None,
         include_details: bool = False,
+        slots: DxSlots | None = None,
+        values: list[str] | None = None,
+        column_names: dict[str, str] | None = None,
+        compact_dtypes: bool = True,
+        sparse: bool = False,
+        details_format: DetailsFormat = "repr",
+        backend: Backend = "pandas",
     ) -> pd.DataFrame:
         """Pivot the dataset on diagnostic categories.
 
@@ -323,57 +980,257 @@ class Pivot:
             include_details: Whether to include diagnosis-level details.
             These will be stored in a single column per category.
             column_prefix: Prefix for diagnosis columns in the data
+            slots: Optional diagnosis slots extracted from the data with the
+            certainty filter already applied.
+            values: Optional fixed list of values to create columns for, instead
+            of the values found in the data.
+            column_names: Optional names of the columns of each value, defaults
+            to the cleaned values.
+            compact_dtypes: Whether to store presence flags as int8 and
+            categorical values as pandas Categoricals, rather than as int64 and
+            object columns.
+            sparse: Whether to store presence flags and numeric detail columns as
+            pandas sparse columns.
+            details_format: The format of the details columns, "repr" for the
+            repr of a list of dicts or "json" for a JSON array. With "long", no
+            details columns are added, see the details method.
+            backend: The backend of the details and grouping kernels, "pandas"
+            or "polars". Both give the same output.
 
         Returns:
             Output DataFrame with category columns added
         """
-        dx_values = cls._get_values(data, "categories", column_prefix=column_prefix)
+        dx_values = (
+            values
+            if values is not None
+            else cls._get_values(data, "categories", column_prefix=column_prefix)
+        )
         logger.info("Processing diagnostic categories.")
+        if slots is None:
+            slots = cls.extract_slots(data, column_prefix).filter(certainty_filter)
+        codes = cls._value_codes(slots, "cat", pd.CategoricalDtype(dx_values))
+        groups = cls._group_slots(codes, len(dx_values))
+        with_details = include_details and details_format != "long"
+        polars_details = (
+            cls._polars_details_columns(
+                slots, codes, len(dx_values), CATEGORY_DETAILS, details_format
+            )
+            if with_details and backend == "polars"
+            else None
+        )
 
         # Dictionary to collect all new columns
         all_new_cols: dict[str, Any] = {}
 
-        for dx_val in dx_values:
-            new_col = cls._clean_dx_value(dx_val)
-
-            # Collect all updates for this category
-            present_data = [0] * len(data)
-            details_data: list[str] = [""] * len(data) if include_details else []
-
-            for i in range(len(data)):
-                cat_details = []
-                for n in cls.DX_NS:
-                    col = cls._dx_column_name(column_prefix, n)
-                    details = cls._get_diagnosis_details(data, i, col)
-                    if details.cat == dx_val:
-                        # Apply filter if selected
-                        if cls._filter_pass(details.certainty, certainty_filter):
-                            present_data[i] = 1
-
-                            # Create dictionary to store details on a diagnostic level
-                            cat_dict = {
-                                "diagnosis": details.diagnosis,
-                                "subcategory": details.sub,
-                                "ICD_code": details.code,
-                                "certainty": details.certainty,
-                                "time": details.time,
-                                "past_documentation": ""
-                                if details.past_doc is None
-                                else details.past_doc,
-                            }
-                            cat_details.append(cat_dict)
-
-                # Store category details
-                if include_details and cat_details:
-                    details_data[i] = str(cat_details).strip("[]")
+        for i, (dx_val, positions) in enumerate(zip(dx_values, groups)):
+            new_col = cls._column_name(dx_val, column_names)
+            rows = slots.row[positions]
 
             # Store columns for this category
-            all_new_cols[f"{new_col}_CategoryPresent"] = present_data
-            if include_details:
-                all_new_cols[f"{new_col}_Details"] = details_data
+            all_new_cols[f"{new_col}_CategoryPresent"] = cls._presence_column(
+                len(data), rows, compact_dtypes, sparse
+            )
+            if polars_details is not None:
+                all_new_cols[f"{new_col}_Details"] = polars_details[i]
+            elif with_details:
+                all_new_cols[f"{new_col}_Details"] = cls._details_column(
+                    slots, positions, CATEGORY_DETAILS, details_format
+                )
 
         # Add all new columns at once to avoid fragmentation
         new_df = pd.DataFrame(all_new_cols, index=output.index)
         output = pd.concat([output, new_df], axis=1)
 
         return output
+
+    @classmethod
+    def details(
+        cls,
+        data: pd.DataFrame,
+        column_prefix: str,
+        by: Literal["subcategories", "categories"],
+        certainty_filter: list[str] | None = None,
+        slots: DxSlots | None = None,
+        values: list[str] | None = None,
+        rows: np.ndarray | None = None,
+        compact_dtypes: bool = True,
+    ) -> pd.DataFrame:
+        """Build a long table of the diagnosis-level details of a level.
+
+        The table has one row for each slot holding one of the subcategories or
+        categories, in participant and then diagnosis number order, with the
+        details of the slot. It joins the pivoted output on the Identifiers
+        column.
+
+        Args:
+            data: Input DataFrame with HBN diagnostic data
+            column_prefix: Prefix for diagnosis columns in the data
+            by: The level of the details, "subcategories" or "categories".
+            certainty_filter: Optional list of certainty levels to include
+            slots: Optional diagnosis slots extracted from the data with the
+            certainty filter already applied.
+            values: Optional fixed list of values to include the slots of,
+            instead of the values found in the data.
+            rows: Optional participant identifiers of the rows, defaults to the
+            row positions.
+            compact_dtypes: Whether to store the level, certainty and time as
+            pandas Categoricals, rather than as object columns.
+
+        Returns:
+            The details table.
+        """
+        fields = {"subcategories": "sub", "categories": "cat"}
+        if by not in fields:
+            raise ValueError(f"Invalid value for 'by': {by}")
+        dx_values = (
+            values
+            if values is not None
+            else cls._get_values(data, by, column_prefix=column_prefix)
+        )
+        if slots is None:
+            slots = cls.extract_slots(data, column_prefix).filter(certainty_filter)
+        codes = cls._value_codes(slots, fields[by], pd.CategoricalDtype(dx_values))
+        slots = slots.take(codes >= 0)
+        if rows is None:
+            rows = np.arange(slots.n_rows)
+        table = pd.DataFrame(
+            {
+                "Identifiers": np.asarray(rows)[slots.row],
+                "level": np.full(len(slots.row), by, dtype=object),
+                "value": getattr(slots, fields[by]),
+                "diagnosis": slots.diagnosis,
+                "subcategory": slots.sub,
+                "ICD_code": slots.code,
+                "certainty": slots.certainty,
+                "time": slots.time,
+                "past_documentation": slots.past_doc,
+            }
+        )
+        if compact_dtypes:
+            table = table.astype(
+                {
+                    "level": pd.CategoricalDtype(list(fields)),
+                    "certainty": CERTAINTY_DTYPE,
+                    "time": TIME_DTYPE,
+                }
+            )
+        return table
+
+    @classmethod
+    def incidence(
+        cls,
+        data: pd.DataFrame,
+        column_prefix: str,
+        by: Literal["diagnoses", "subcategories", "categories"],
+        certainty_filter: list[str] | None = None,
+        slots: DxSlots | None = None,
+        values: list[str] | None = None,
+        rows: np.ndarray | None = None,
+    ) -> Incidence:
+        """Build a sparse participants by values presence matrix.
+
+        The matrix holds the same flags as the presence columns of the pivot by
+        the same level, without building the dense wide table.
+
+        Args:
+            data: Input DataFrame with HBN diagnostic data
+            column_prefix: Prefix for diagnosis columns in the data
+            by: The level to build the matrix for, "diagnoses", "subcategories"
+            or "categories".
+            certainty_filter: Optional list of certainty levels to include
+            slots: Optional diagnosis slots extracted from the data with the
+            certainty filter already applied.
+            values: Optional fixed list of values to create columns for, instead
+            of the values found in the data.
+            rows: Optional row labels, defaults to the row positions.
+
+        Returns:
+            The presence matrix with its row and column labels.
+        """
+        sparse = _import_sparse()
+        fields = {"diagnoses": "diagnosis", "subcategories": "sub", "categories": "cat"}
+        if by not in fields:
+            raise ValueError(f"Invalid value for 'by': {by}")
+        dx_values = (
+            values
+            if values is not None
+            else cls._get_values(data, by, column_prefix=column_prefix)
+        )
+        if slots is None:
+            slots = cls.extract_slots(data, column_prefix).filter(certainty_filter)
+        codes = cls._value_codes(slots, fields[by], pd.CategoricalDtype(dx_values))
+        matched = codes >= 0
+        matrix = sparse.csr_matrix(
+            (
+                np.ones(np.count_nonzero(matched), dtype=np.int8),
+                (slots.row[matched], codes[matched]),
+            ),
+            shape=(slots.n_rows, len(dx_values)),
+        )
+        # Participants with a value in several slots are flagged once
+        matrix.data[:] = 1
+        return Incidence(
+            matrix=matrix,
+            rows=np.arange(slots.n_rows) if rows is None else np.asarray(rows),
+            columns=np.asarray(dx_values, dtype=object),
+        )
+
+    @classmethod
+    def counts(
+        cls,
+        data: pd.DataFrame,
+        column_prefix: str,
+        by: Literal["diagnoses", "subcategories", "categories"],
+        certainty_filter: list[str] | None = None,
+        slots: DxSlots | None = None,
+        values: list[str] | None = None,
+        groups: np.ndarray | None = None,
+        n_groups: int = 1,
+    ) -> np.ndarray:
+        """Count the participants with each value, optionally by group.
+
+        The counts are the sums of the presence columns of the pivot by the same
+        level, found from the slots by counting the unique participant and value
+        pairs, without building the wide table.
+
+        Args:
+            data: Input DataFrame with HBN diagnostic data
+            column_prefix: Prefix for diagnosis columns in the data
+            by: The level to count, "diagnoses", "subcategories" or "categories".
+            certainty_filter: Optional list of certainty levels to include
+            slots: Optional diagnosis slots extracted from the data with the
+            certainty filter already applied.
+            values: Optional fixed list of values to count, instead of the values
+            found in the data.
+            groups: Optional group code of every row, from 0 to n_groups - 1.
+            Rows with a negative code are not counted.
+            n_groups: The number of groups.
+
+        Returns:
+            The values by groups array of participant counts.
+        """
+        fields = {"diagnoses": "diagnosis", "subcategories": "sub", "categories": "cat"}
+        if by not in fields:
+            raise ValueError(f"Invalid value for 'by': {by}")
+        dx_values = (
+            values
+            if values is not None
+            else cls._get_values(data, by, column_prefix=column_prefix)
+        )
+        if slots is None:
+            slots = cls.extract_slots(data, column_prefix).filter(certainty_filter)
+        codes = cls._value_codes(slots, fields[by], pd.CategoricalDtype(dx_values))
+        matched = codes >= 0
+        # Participants with a value in several slots are counted once
+        pairs = np.unique(
+            slots.row[matched].astype(np.int64) * len(dx_values) + codes[matched]
+        )
+        rows, value_codes = np.divmod(pairs, max(len(dx_values), 1))
+        group_codes = (
+            np.zeros(len(rows), dtype=np.int64) if groups is None else groups[rows]
+        )
+        counted = group_codes >= 0
+        return np.bincount(
+            value_codes[counted] * n_groups + group_codes[counted],
+            minlength=len(dx_values) * n_groups,
+        ).reshape(len(dx_values), n_groups)
@@ -0,0 +1,158 @@
+"""Timing and profiling of the processing stages."""
+
+import cProfile
+import logging
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass, field
+from typing import Callable, ContextManager, Iterator
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class StageStats:
+    """Dataclass for storing the measurements of a processing stage."""
+
+    name: str
+    seconds: float
+    rows: int
+    peak_memory: int | None = None
+
+    @property
+    def rows_per_second(self) -> float:
+        """The number of rows processed per second."""
+        return self.rows / self.seconds if self.seconds > 0 else float("inf")
+
+
+@dataclass
+class ProcessStats:
+    """Dataclass for storing the measurements of every processing stage."""
+
+    stages: list[StageStats] = field(default_factory=list)
+
+    @property
+    def total_seconds(self) -> float:
+        """The time spent in all stages."""
+        return sum(stage.seconds for stage in self.stages)
+
+    def totals(self) -> list[StageStats]:
+        """Sum the stages with the same name, such as those of every chunk.
+
+        Stages are listed in order of first appearance, with the highest peak
+        memory of each name.
+        """
+        totals: dict[str, StageStats] = {}
+        for stage in self.stages:
+            if stage.name not in totals:
+                totals[stage.name] = StageStats(stage.name, 0.0, 0)
+            total = totals[stage.name]
+            total.seconds += stage.seconds
+            total.rows += stage.rows
+            if stage.peak_memory is not None:
+                total.peak_memory = max(total.peak_memory or 0, stage.peak_memory)
+        return list(totals.values())
+
+    def report(self) -> str:
+        """Format the stage totals as a table with their share of the total time."""
+        total = self.total_seconds
+        lines = [
+            f"{'Stage':<22}{'Seconds':>10}{'Share':>8}{'Rows/s':>14}{'Peak MiB':>10}"
+        ]
+        for stage in self.totals():
+            share = stage.seconds / total if total > 0 else 0.0
+            peak = (
+                "" if stage.peak_memory is None else f"{stage.peak_memory / 2**20:.1f}"
+            )
+            lines.append(
+                f"{stage.name:<22}{stage.seconds:>10.3f}{share:>8.1%}"
+                f"{stage.rows_per_second:>14,.0f}{peak:>10}"
+            )
+        lines.append(f"{'Total':<22}{total:>10.3f}")
+        return "\n".join(lines)
+
+
+class Profiler:
+    """Class for measuring processing stages.
+
+    Every finished stage is added to the stats and passed to the hooks.
+    """
+
+    def __init__(
+        self,
+        hooks: list[Callable[[StageStats], None]] | None = None,
+        track_memory: bool = False,
+        pivot_profile_path: str | None = None,
+    ) -> None:
+        """Initialize the Profiler class.
+
+        Args:
+            hooks: Callbacks to call with the stats of each finished stage.
+            track_memory: Whether to record the peak memory allocated during each
+            stage with tracemalloc, which slows processing down.
+            pivot_profile_path: Optional path to write a cProfile dump of the
+            pivot step to.
+        """
+        self.hooks = hooks or []
+        self.track_memory = track_memory
+        self.pivot_profile_path = pivot_profile_path
+        self.stats = ProcessStats()
+        self._pivot_profile: cProfile.Profile | None = None
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0) -> Iterator[StageStats]:
+        """Measure a stage processing the given number of rows.
+
+        The rows of the yielded stats can be set within the stage, when they are
+        only known after reading.
+        """
+        stats = StageStats(name, 0.0, rows)
+        started_tracing = self.track_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        elif self.track_memory:
+            tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0] if self.track_memory else 0
+        start = time.perf_counter()
+        try:
+            yield stats
+        finally:
+            stats.seconds = time.perf_counter() - start
+            if self.track_memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                stats.peak_memory = max(peak - baseline, 0)
+            if started_tracing:
+                tracemalloc.stop()
+        self.stats.stages.append(stats)
+        logger.debug("Stage %s took %.3f seconds", name, stats.seconds)
+        for hook in self.hooks:
+            hook(stats)
+
+    @contextmanager
+    def pivot_profile(self) -> Iterator[None]:
+        """Profile the pivot step with cProfile if a dump path is set.
+
+        Repeated pivots, such as those of every chunk, add to the same profile.
+        """
+        if self.pivot_profile_path is None:
+            yield
+            return
+        if self._pivot_profile is None:
+            self._pivot_profile = cProfile.Profile()
+        self._pivot_profile.enable()
+        try:
+            yield
+        finally:
+            self._pivot_profile.disable()
+            self._pivot_profile.dump_stats(self.pivot_profile_path)
+            logger.info("Pivot profile saved to %s", self.pivot_profile_path)
+
+
+def measure(
+    profiler: Profiler | None, name: str, rows: int = 0
+) -> ContextManager[StageStats]:
+    """Measure a stage with the profiler, or only run it without one."""
+    if profiler is None:
+        return nullcontext(StageStats(name, 0.0, rows))
+    return profiler.stage(name, rows)
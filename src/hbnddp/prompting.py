@@ -6,6 +6,8 @@ from typing import Any
 
 import questionary
 
+from .utils import FILE_FORMATS
+
 logger = logging.getLogger(__name__)
 
 certainties = ["Confirmed", "Presumptive", "RC", "RuleOut", "ByHx", "Unknown"]
@@ -14,6 +16,12 @@ certainties = ["Confirmed", "Presumptive", "RC", "RuleOut", "ByHx", "Unknown"]
 class Interactive:
     """Class for prompting user interactively."""
 
+    @staticmethod
+    def _default_output_path(input_path: str) -> str:
+        """Returns the default output path for an input path."""
+        path = Path(input_path)
+        return str(path.with_name(f"{path.stem}_processed{path.suffix}"))
+
     @staticmethod
     def _get_paths() -> tuple[str, str]:
         """Prompts user for input path."""
@@ -27,15 +35,15 @@ class Interactive:
                 message="Please enter the path to the HBN data file.",
                 default="./data/",
             ).ask()
-        while not input_path.endswith(".csv"):
-            logger.error("File must be a CSV.")
+        while Path(input_path).suffix.lower() not in FILE_FORMATS:
+            logger.error("File must be one of: %s", ", ".join(FILE_FORMATS))
             input_path = questionary.path(
                 message="Please enter the path to the HBN data file.",
                 default="./data/",
             ).ask()
         output_path = questionary.path(
             message="Please enter the output path to save the processed data.",
-            default=input_path.replace(".csv", "_processed.csv"),
+            default=Interactive._default_output_path(input_path),
         ).ask()
         while output_path is None or not Path(output_path).parent.exists():
             if output_path is None:
@@ -44,7 +52,7 @@ class Interactive:
                 logger.error("Directory %s not found.", str(Path(output_path).parent))
             output_path = questionary.path(
                 message="Please enter the output path to save the processed data.",
-                default=input_path.replace(".csv", "_processed.csv"),
+                default=Interactive._default_output_path(input_path),
             ).ask()
         return input_path, output_path
 
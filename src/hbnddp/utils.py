@@ -2,17 +2,37 @@
 
 import io
 import logging
+import shutil
+import tempfile
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterator, Literal
 
 import pandas as pd
-import plotly.graph_objects as go
-import plotly.io as pio
-from PIL import Image
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
 
 logger = logging.getLogger(__name__)
 
+FileFormat = Literal["csv", "parquet", "feather"]
+
+# File formats by file extension, Feather files are Arrow IPC files
+FILE_FORMATS: dict[str, FileFormat] = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+    ".ipc": "feather",
+}
 
-def show(fig: go.Figure) -> None:
+
+def show(fig: "go.Figure") -> None:
     """Display plotly figure in a new window."""
+    # Imported on first use, so that processing does not load the image stack
+    import plotly.io as pio
+    from PIL import Image
+
     buf = io.BytesIO()
     pio.write_image(fig, buf)
     img = Image.open(buf)
@@ -20,19 +40,413 @@ def show(fig: go.Figure) -> None:
     buf.close()
 
 
+def get_file_format(path: str | None, file_format: str | None = None) -> FileFormat:
+    """Get the format of a file from an explicit format or its extension.
+
+    Files without a path or explicit format default to CSV.
+    """
+    if file_format is not None:
+        if file_format not in FILE_FORMATS.values():
+            raise ValueError(
+                f"Invalid file format: {file_format}. "
+                f"Valid formats are: {sorted(set(FILE_FORMATS.values()))}"
+            )
+        return file_format  # type: ignore[return-value]
+    if path is None:
+        return "csv"
+    suffix = Path(path).suffix.lower()
+    if suffix not in FILE_FORMATS:
+        raise ValueError(
+            f"Unsupported file extension: {suffix}. "
+            f"Supported extensions are: {list(FILE_FORMATS)}"
+        )
+    return FILE_FORMATS[suffix]
+
+
+def _import_pyarrow() -> None:
+    """Check that pyarrow is available for Parquet and Arrow files."""
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as e:
+        raise ImportError(
+            "Reading and writing Parquet or Arrow files requires pyarrow. "
+            "Install it with `pip install hbn-ddp[arrow]`."
+        ) from e
+
+
+def read_columns(path: str, file_format: str | None = None) -> pd.Index:
+    """Read the column names of a file without reading its data."""
+    match get_file_format(path, file_format):
+        case "csv":
+            return pd.read_csv(path, nrows=0).columns
+        case "parquet":
+            _import_pyarrow()
+            import pyarrow.parquet as pq
+
+            return pd.Index(pq.ParquetFile(path).schema_arrow.names)
+        case "feather":
+            _import_pyarrow()
+            import pyarrow as pa
+
+            with pa.memory_map(path) as source:
+                return pd.Index(pa.ipc.open_file(source).schema.names)
+
+
+def read(
+    path: str,
+    columns: list[str] | None = None,
+    dtype: dict[str, str] | None = None,
+    file_format: str | None = None,
+) -> pd.DataFrame:
+    """Read the selected columns of a file.
+
+    Column selection is pushed down into the reader. The dtypes only apply to
+    CSV files, since Parquet and Arrow files store their own.
+    """
+    match get_file_format(path, file_format):
+        case "csv":
+            return pd.read_csv(path, usecols=columns, dtype=dtype, low_memory=False)
+        case "parquet":
+            _import_pyarrow()
+            return pd.read_parquet(path, columns=columns)
+        case "feather":
+            _import_pyarrow()
+            return pd.read_feather(path, columns=columns)
+
+
+def read_chunks(
+    path: str,
+    chunksize: int,
+    columns: list[str] | None = None,
+    dtype: dict[str, str] | None = None,
+    file_format: str | None = None,
+) -> Iterator[pd.DataFrame]:
+    """Read the selected columns of a file in chunks of at most chunksize rows."""
+    match get_file_format(path, file_format):
+        case "csv":
+            yield from pd.read_csv(
+                path, usecols=columns, dtype=dtype, chunksize=chunksize
+            )
+        case "parquet":
+            _import_pyarrow()
+            import pyarrow.parquet as pq
+
+            batches = pq.ParquetFile(path).iter_batches(
+                batch_size=chunksize, columns=columns
+            )
+            yield from _index_chunks(batch.to_pandas() for batch in batches)
+        case "feather":
+            _import_pyarrow()
+            import pyarrow as pa
+
+            def batches() -> Iterator[pa.RecordBatch]:
+                with pa.memory_map(path) as source:
+                    reader = pa.ipc.open_file(source)
+                    for i in range(reader.num_record_batches):
+                        batch = reader.get_batch(i)
+                        if columns is not None:
+                            batch = batch.select(columns)
+                        for start in range(0, batch.num_rows, chunksize):
+                            yield batch.slice(start, chunksize)
+
+            yield from _index_chunks(batch.to_pandas() for batch in batches())
+
+
+def _index_chunks(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Number the rows of consecutive chunks like a single frame."""
+    start = 0
+    for chunk in chunks:
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+
+def default_output_path(
+    input_path: str, by: str, file_format: FileFormat = "csv"
+) -> str:
+    """Get the default output path next to the input file."""
+    input_directory = input_path.rsplit("/", 1)[0] if "/" in input_path else "."
+    input_file_name = input_path.rsplit("/", 1)[-1]
+    return (
+        f"{input_directory}/"
+        f"{input_file_name.rsplit('.', 1)[0]}_processed_{by}.{file_format}"
+    )
+
+
+def variant_output_path(
+    input_path: str,
+    by: str,
+    certainty_filter: list[str] | None,
+    file_format: FileFormat = "csv",
+    output_dir: str | None = None,
+) -> str:
+    """Get the default output path of a certainty filter variant.
+
+    The certainty filter is appended to the default output path, which is kept
+    for variants without a filter. With an output directory, the file of that
+    name is in the directory instead of next to the input.
+    """
+    path = Path(default_output_path(input_path, by, file_format))
+    if certainty_filter is not None:
+        suffix = "_".join(certainty_filter)
+        path = path.with_name(f"{path.stem}_{suffix}{path.suffix}")
+    if output_dir is not None:
+        path = Path(output_dir) / path.name
+    return str(path)
+
+
+def details_output_path(output_path: str) -> str:
+    """Get the path of the details table written next to an output file."""
+    path = Path(output_path)
+    return str(path.with_name(f"{path.stem}_details{path.suffix}"))
+
+
+def _densify(output: pd.DataFrame) -> pd.DataFrame:
+    """Store the sparse columns of the output densely, as Arrow has none."""
+    return output.astype(
+        {
+            col: dtype.subtype
+            for col, dtype in output.dtypes.items()
+            if isinstance(dtype, pd.SparseDtype)
+        }
+    )
+
+
+def _level_details(output: pd.DataFrame) -> pd.DataFrame:
+    """Name the details columns after their level, when several levels have them.
+
+    Pivots by all levels add a {name}_Details column after the presence column
+    of the subcategory and of the category of the same name, which Parquet and
+    Arrow files cannot both store. Such details are renamed like their presence
+    columns, as {name}_SubcategoryDetails and {name}_CategoryDetails.
+
+    Raises:
+        ValueError: If the output still has duplicate column names.
+    """
+    columns = [str(column) for column in output.columns]
+    renamed = list(columns)
+    for i in range(1, len(columns)):
+        stem = columns[i].removesuffix("_Details")
+        presence = columns[i - 1]
+        if (
+            stem != columns[i]
+            and presence.startswith(f"{stem}_")
+            and presence.endswith("Present")
+        ):
+            level = presence[len(stem) + 1 : -len("Present")]
+            renamed[i] = f"{stem}_{level}Details"
+    levels = {
+        name.rsplit("_", 1)[1]
+        for name, column in zip(renamed, columns)
+        if name != column
+    }
+    if len(levels) > 1:
+        output = output.set_axis(renamed, axis=1)
+    duplicated = output.columns[output.columns.duplicated()]
+    if len(duplicated):
+        raise ValueError(
+            "Parquet and Arrow files cannot store duplicate column names: "
+            f"{sorted(set(duplicated))}. Write the output as CSV instead."
+        )
+    return output
+
+
 def write(
     output: pd.DataFrame,
     input_path: str,
     by: str,
     output_path: str | None,
+    append: bool = False,
+    file_format: str | None = None,
 ) -> None:
-    """Write the processed data to a CSV file."""
+    """Write the processed data to a CSV, Parquet or Arrow file.
+
+    The format is taken from file_format, or else from the output path extension,
+    and defaults to CSV. Parquet and Arrow files keep the output dtypes, except
+    that sparse columns are stored densely, and that the details of several
+    levels are named after their level. When appending, rows are added to an
+    existing CSV file without writing the header.
+    """
+    output_format = get_file_format(output_path, file_format)
     if output_path is None:
-        input_directory = input_path.rsplit("/", 1)[0] if "/" in input_path else "."
-        input_file_name = input_path.rsplit("/", 1)[1]
-        output_path = (
-            f"{input_directory}/"
-            f"{input_file_name.rsplit('.', 1)[0]}_processed_{by}.csv"
+        output_path = default_output_path(input_path, by, output_format)
+    if append and output_format != "csv":
+        raise ValueError("Appending is only supported for CSV files.")
+    if output_format != "csv":
+        output = _level_details(_densify(output))
+
+    match output_format:
+        case "csv":
+            output.to_csv(
+                output_path, index=False, mode="a" if append else "w", header=not append
+            )
+        case "parquet":
+            _import_pyarrow()
+            output.to_parquet(output_path, index=False)
+        case "feather":
+            _import_pyarrow()
+            output.reset_index(drop=True).to_feather(output_path)
+    if not append:
+        logger.info("Data saved to %s", output_path)
+
+
+class ChunkWriter:
+    """Writer of a table to a CSV, Parquet or Arrow file one row chunk at a time.
+
+    CSV chunks are appended to the file as they are written. Parquet and Arrow
+    chunks are spilled to temporary Arrow files next to the output, since a
+    column that is empty in the first chunks has no type until a later chunk
+    gives it one. When closed, the chunks are copied one at a time to the
+    output, as Parquet row groups or Arrow record batches with the types of all
+    chunks, so that the whole table is never in memory. Like write, they name the
+    details of several levels after their level. Nothing is written until the
+    first chunk.
+    """
+
+    def __init__(self, path: str, file_format: str | None = None) -> None:
+        """Initialize the writer.
+
+        Args:
+            path: The path of the file to write.
+            file_format: The format of the file, "csv", "parquet" or "feather".
+            Defaults to the format of the file extension.
+        """
+        self.path = path
+        self.file_format = get_file_format(path, file_format)
+        self.rows = 0
+        self._parts: list[Path] = []
+        self._schema: Any = None
+        self._missing_types: dict[str, Any] = {}
+        self._categories: dict[str, pd.Index] = {}
+        self._merged: set[str] = set()
+        self._spill_dir: Path | None = None
+        if self.file_format != "csv":
+            _import_pyarrow()
+
+    def __enter__(self) -> "ChunkWriter":
+        """Open the writer."""
+        return self
+
+    def __exit__(self, exc_type: type[BaseException] | None, *exc_info: object) -> None:
+        """Close the writer, or discard the spilled chunks on an error."""
+        if exc_type is None:
+            self.close()
+        else:
+            self._discard()
+
+    def write(self, chunk: pd.DataFrame) -> None:
+        """Write the next chunk of rows."""
+        if self.file_format == "csv":
+            chunk.to_csv(
+                self.path,
+                index=False,
+                mode="a" if self.rows else "w",
+                header=not self.rows,
+            )
+        else:
+            self._spill(_level_details(_densify(chunk)))
+        self.rows += len(chunk)
+
+    def _spill(self, chunk: pd.DataFrame) -> None:
+        """Write a chunk to a temporary Arrow file and widen the schema."""
+        import pyarrow as pa
+
+        for name, dtype in chunk.dtypes.items():
+            if isinstance(dtype, pd.CategoricalDtype):
+                categories = self._categories.setdefault(name, dtype.categories)
+                if not categories.equals(dtype.categories):
+                    self._categories[name] = categories.union(dtype.categories)
+                    self._merged.add(name)
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        # Columns that are all missing in the chunk, such as detail columns read
+        # as all-NaN floats, take the type of the other chunks
+        for i, column in enumerate(table.columns):
+            if (
+                column.null_count == len(column)
+                and not pa.types.is_dictionary(column.type)
+                and not pa.types.is_null(column.type)
+            ):
+                name = table.schema.field(i).name
+                self._missing_types.setdefault(name, column.type)
+                table = table.set_column(i, name, pa.nulls(len(column)))
+        self._schema = (
+            table.schema
+            if self._schema is None
+            else pa.unify_schemas(
+                [self._schema, table.schema], promote_options="permissive"
+            )
         )
-    output.to_csv(output_path, index=False)
-    logger.info("Data saved to %s", output_path)
+        if self._spill_dir is None:
+            path = Path(self.path)
+            self._spill_dir = Path(
+                tempfile.mkdtemp(prefix=f".{path.name}.", dir=path.parent)
+            )
+        part = self._spill_dir / f"{len(self._parts)}.arrow"
+        with pa.ipc.new_file(part, table.schema) as writer:
+            writer.write_table(table)
+        self._parts.append(part)
+
+    def close(self) -> None:
+        """Write the spilled chunks to the output, once all chunks are written."""
+        if self._parts:
+            import pyarrow as pa
+
+            schema, dtypes = self._output_schema()
+            if self.file_format == "parquet":
+                import pyarrow.parquet as pq
+
+                writer = pq.ParquetWriter(self.path, schema)
+            else:
+                writer = pa.ipc.new_file(
+                    self.path,
+                    schema,
+                    options=pa.ipc.IpcWriteOptions(compression="lz4"),
+                )
+            with writer:
+                for part in self._parts:
+                    with pa.memory_map(str(part)) as source:
+                        table = pa.ipc.open_file(source).read_all()
+                        for name, dtype in dtypes.items():
+                            i = table.schema.get_field_index(name)
+                            values = table.column(i).to_pandas().astype(dtype)
+                            table = table.set_column(i, name, pa.array(values))
+                        writer.write_table(table.cast(schema))
+                    part.unlink()
+        self._discard()
+        if self.rows:
+            logger.info("Data saved to %s", self.path)
+
+    def _output_schema(self) -> tuple[Any, dict[str, pd.CategoricalDtype]]:
+        """Get the schema of the output and the merged categories of its columns.
+
+        Columns missing in every chunk keep the type they were read with, and
+        categories that differ between chunks are merged into their sorted union,
+        like the pivot of the whole data sorts the values it finds.
+        """
+        import pyarrow as pa
+
+        schema = self._schema
+        for i, schema_field in enumerate(schema):
+            if (
+                pa.types.is_null(schema_field.type)
+                and schema_field.name in self._missing_types
+            ):
+                schema = schema.set(
+                    i, schema_field.with_type(self._missing_types[schema_field.name])
+                )
+        dtypes = {
+            name: pd.CategoricalDtype(sorted(self._categories[name], key=str))
+            for name in self._merged
+        }
+        for name, dtype in dtypes.items():
+            i = schema.get_field_index(name)
+            dictionary_type = pa.array(pd.Categorical([], dtype=dtype)).type
+            schema = schema.set(i, schema.field(i).with_type(dictionary_type))
+        return schema, dtypes
+
+    def _discard(self) -> None:
+        """Remove the spilled chunks."""
+        if self._spill_dir is not None:
+            shutil.rmtree(self._spill_dir, ignore_errors=True)
+            self._spill_dir = None
+        self._parts = []
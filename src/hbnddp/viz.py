@@ -1,28 +1,116 @@
 """Basic visualization of the HBN data."""
 
+import hashlib
 import logging
 import os
-from typing import Literal
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Iterator, Literal
 
 import pandas as pd
-import plotly.graph_objects as go
+
+from .pivot import CoOccurrence, CoOccurrenceMeasure
+
+if TYPE_CHECKING:
+    import plotly.graph_objects as go
 
 logger = logging.getLogger(__name__)
 
+ImageFormat = Literal["png", "svg", "html"]
+IMAGE_FORMATS: list[ImageFormat] = ["png", "svg", "html"]
+
+ColType = Literal["DiagnosisPresent", "CategoryPresent", "SubcategoryPresent"]
+
+# Columns plotted for each pivot level
+_LEVEL_COL_TYPES: dict[str, list[ColType]] = {
+    "diagnoses": ["DiagnosisPresent"],
+    "subcategories": ["SubcategoryPresent"],
+    "categories": ["CategoryPresent"],
+    "all": ["DiagnosisPresent", "SubcategoryPresent", "CategoryPresent"],
+}
+
+# Directory that figures are saved to by default
+FIGURES_DIR = os.path.join(".", "figures")
+
+# Depth of nested render sessions, the kaleido server runs while above zero
+_session_depth = 0
+
+
+@contextmanager
+def render_session(n: int = 3) -> Iterator[None]:
+    """Keep one kaleido browser open to render all figures of a run.
+
+    Without a session, every batch of figures starts and stops its own browser.
+    Within a session, all figures are rendered by the same browser, up to n at
+    the same time. Sessions may be nested, the browser is closed when the
+    outermost one exits.
+
+    Raises:
+        ChromeNotFoundError: If no Chrome browser is installed to render with.
+    """
+    global _session_depth
+    import kaleido
+
+    if _session_depth == 0:
+        _check_browser()
+        kaleido.start_sync_server(n=n, silence_warnings=True)
+    _session_depth += 1
+    try:
+        yield
+    finally:
+        _session_depth -= 1
+        if _session_depth == 0:
+            kaleido.stop_sync_server(silence_warnings=True)
+
+
+def _check_browser() -> None:
+    """Check that kaleido can find a Chrome browser before starting its server.
+
+    The server starts the browser in a thread of its own, and renders wait
+    forever when that fails, so a missing browser is reported here instead. The
+    browser is looked up like kaleido does, with choreographer, its browser
+    driver, which is a declared dependency for this check.
+    """
+    from choreographer.browsers import Chromium
+    from kaleido.errors import ChromeNotFoundError
+
+    path = Chromium.find_browser(skip_local=False)
+    if not path or not os.path.isfile(path):
+        raise ChromeNotFoundError(
+            "Rendering images requires Chrome to be installed. Install it with "
+            "the kaleido_get_chrome command, or save the plots as HTML."
+        )
+
 
 def _bar(
     output: pd.DataFrame,
-    col_type: Literal["DiagnosisPresent", "CategoryPresent", "SubcategoryPresent"],
+    col_type: ColType,
+    image_format: ImageFormat = "png",
 ) -> None:
     """Plot a bar graph of diagnoses, subcategories, or categories.
 
     Args:
         col_type: The type of data to visualize.
         output: The HBN data.
+        image_format: The format to save the figure in.
 
     """
-    filtered_df = output.filter(like=col_type)
-    sums = filtered_df.sum().sort_values()
+    _save_figs(
+        [_bar_figure(output.filter(like=col_type).sum(), col_type)],
+        [_bar_name(col_type)],
+        image_format,
+    )
+
+
+def _bar_figure(counts: pd.Series, col_type: ColType) -> "go.Figure":
+    """Build the bar graph of diagnoses, subcategories, or categories.
+
+    The counts are indexed by the presence columns of the processed data.
+    Plotly is imported on first use, so that processing without plots does not
+    load it.
+    """
+    import plotly.graph_objects as go
+
+    sums = counts.sort_values()
     labels = list(sums.index)
     sums = list(sums.reset_index(drop=True))
     new_labels = [_clean_label(label, col_type) for label in labels]
@@ -62,8 +150,7 @@ def _bar(
     fig.update_traces(
         textposition="outside",
     )
-
-    _save_fig(fig, col_type)
+    return fig
 
 
 def _clean_label(label: str, col_type: str) -> str:
@@ -75,31 +162,159 @@ def _clean_label(label: str, col_type: str) -> str:
     )
 
 
-def _save_fig(fig: go.Figure, col_type: str) -> None:
-    """Save the figure to a file."""
-    figures_dir = os.path.join(".", "figures")
+def _bar_name(col_type: str) -> str:
+    """Get the file name of the bar plot of a column type, without extension."""
+    return f"{col_type.replace('Present', '').lower()}_bar_plot"
+
+
+def _save_figs(
+    figs: list["go.Figure"],
+    names: list[str],
+    image_format: ImageFormat,
+    figures_dir: str = FIGURES_DIR,
+) -> None:
+    """Save the figures to files named by names, skipping unchanged figures.
+
+    A digest of every saved figure is stored next to it, so a figure with the
+    same counts and labels as its file is not rendered again. HTML files are
+    written without kaleido, and the images are rendered concurrently by one
+    browser, that of the current render session if any.
+    """
+    if image_format not in IMAGE_FORMATS:
+        raise ValueError(
+            f"Invalid image format: {image_format}. Valid formats are: {IMAGE_FORMATS}"
+        )
     os.makedirs(figures_dir, exist_ok=True)
-    col_type = col_type.replace("Present", "").lower()
-    file_path = os.path.join(figures_dir, f"{col_type}_bar_plot.png")
-    fig.write_image(file_path)
-    logger.info("Figure saved to %s", file_path)
+    pending: list[tuple["go.Figure", str, str, str]] = []
+    for fig, name in zip(figs, names):
+        file_path = os.path.join(figures_dir, f"{name}.{image_format}")
+        digest_path = os.path.join(figures_dir, f".{name}.{image_format}.sha256")
+        digest = hashlib.sha256(fig.to_json().encode()).hexdigest()
+        if os.path.exists(file_path) and _read_digest(digest_path) == digest:
+            logger.info("Figure %s is unchanged", file_path)
+            continue
+        pending.append((fig, file_path, digest_path, digest))
+
+    if image_format == "html":
+        for fig, file_path, _, _ in pending:
+            fig.write_html(file_path, include_plotlyjs="cdn")
+    elif pending:
+        import plotly.io as pio
+
+        with render_session(n=len(pending)):
+            pio.write_images(
+                [fig for fig, _, _, _ in pending],
+                [file_path for _, file_path, _, _ in pending],
+                format=image_format,
+            )
+    for _, file_path, digest_path, digest in pending:
+        with open(digest_path, "w") as file:
+            file.write(digest)
+        logger.info("Figure saved to %s", file_path)
+
+
+def _read_digest(path: str) -> str | None:
+    """Read the digest of a saved figure, or None if it has none."""
+    try:
+        with open(path) as file:
+            return file.read()
+    except FileNotFoundError:
+        return None
 
 
 def visualize(
     output: pd.DataFrame,
     by: Literal["diagnoses", "subcategories", "categories", "all"] = "all",
+    image_format: ImageFormat = "png",
+    figures_dir: str = FIGURES_DIR,
 ) -> None:
-    """Visualize the data."""
-    match by:
-        case "diagnoses":
-            _bar(output, "DiagnosisPresent")
-        case "subcategories":
-            _bar(output, "SubcategoryPresent")
-        case "categories":
-            _bar(output, "CategoryPresent")
-        case "all":
-            _bar(output, "DiagnosisPresent")
-            _bar(output, "SubcategoryPresent")
-            _bar(output, "CategoryPresent")
-        case _:
-            raise ValueError(f"Invalid value for 'by': {by}")
+    """Visualize the data.
+
+    Saves a bar plot of every pivoted level to the figures directory as PNG or
+    SVG images, or as HTML files that need no rendering. Plots whose counts and
+    labels are the same as their saved file are not saved again.
+    """
+    if by not in _LEVEL_COL_TYPES:
+        raise ValueError(f"Invalid value for 'by': {by}")
+    col_types = _LEVEL_COL_TYPES[by]
+    _save_figs(
+        [
+            _bar_figure(output.filter(like=col_type).sum(), col_type)
+            for col_type in col_types
+        ],
+        [_bar_name(col_type) for col_type in col_types],
+        image_format,
+        figures_dir,
+    )
+
+
+def visualize_counts(
+    counts: dict[str, pd.Series],
+    image_format: ImageFormat = "png",
+    figures_dir: str = FIGURES_DIR,
+) -> None:
+    """Visualize the participant counts of each level.
+
+    Saves the same plots as visualize, from counts such as those of
+    HBNData.counts instead of the processed data.
+
+    Args:
+        counts: The counts of each level to plot, "diagnoses", "subcategories"
+        or "categories", indexed by the column names of the values.
+        image_format: The format to save the figures in.
+        figures_dir: The directory to save the figures to.
+    """
+    names = []
+    figs: list["go.Figure"] = []
+    for level, level_counts in counts.items():
+        if level not in _LEVEL_COL_TYPES or level == "all":
+            raise ValueError(f"Invalid level to visualize: {level}")
+        col_type = _LEVEL_COL_TYPES[level][0]
+        # Name the bars like the presence columns of the processed data
+        level_counts = level_counts.set_axis(
+            [f"{name}_{col_type}" for name in level_counts.index]
+        )
+        figs.append(_bar_figure(level_counts, col_type))
+        names.append(_bar_name(col_type))
+    _save_figs(figs, names, image_format, figures_dir)
+
+
+def heatmap(
+    cooccurrence: CoOccurrence,
+    measure: CoOccurrenceMeasure = "jaccard",
+    name: str = "cooccurrence",
+    image_format: ImageFormat = "png",
+    figures_dir: str = FIGURES_DIR,
+) -> None:
+    """Save a heatmap of the co-occurrence of every pair of values.
+
+    The heatmap is saved to the figures directory as {name}_{measure}_heatmap,
+    and like the bar plots is not saved again while unchanged.
+
+    Args:
+        cooccurrence: The co-occurrence of the values, see HBNData.cooccurrence.
+        measure: The measure to plot, "count", "jaccard" or "conditional".
+        name: The name of the figure file, such as the level of the values.
+        image_format: The format to save the figure in.
+        figures_dir: The directory to save the figure to.
+    """
+    import plotly.graph_objects as go
+
+    frame = cooccurrence.to_frame(measure)
+    labels = [str(label) for label in frame.index]
+    fig = go.Figure(
+        go.Heatmap(z=frame.to_numpy(), x=labels, y=labels, colorscale="Viridis")
+    )
+    titles = {
+        "count": "Participants with Both Values",
+        "jaccard": "Jaccard Index of Pairs of Values",
+        "conditional": "Rate of Column Values Among Participants with Row Values",
+    }
+    fig.update_layout(
+        width=1500,
+        height=1500,
+        title=f"{titles[measure]} in HBN Data",
+    )
+    fig.update_xaxes(tickangle=45, tickfont=dict(size=9))
+    fig.update_yaxes(tickfont=dict(size=9), autorange="reversed")
+    _save_figs([fig], [f"{name}_{measure}_heatmap"], image_format, figures_dir)
@@ -0,0 +1,226 @@
+"""Persisted registry of the diagnosis, subcategory and category vocabulary."""
+
+import json
+import logging
+import os
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Literal
+
+import pandas as pd
+
+from .pivot import Pivot
+
+logger = logging.getLogger(__name__)
+
+# Version of the registry file layout
+REGISTRY_FORMAT = 1
+
+Level = Literal["diagnoses", "subcategories", "categories"]
+LEVELS: list[Level] = ["diagnoses", "subcategories", "categories"]
+
+# Slot column suffixes of the values of each level
+_LEVEL_SUFFIXES = {"diagnoses": "", "subcategories": "_Sub", "categories": "_Cat"}
+
+# Level of the parent of each level's values
+_PARENT_LEVELS: dict[Level, Level] = {
+    "diagnoses": "subcategories",
+    "subcategories": "categories",
+}
+
+
+@dataclass
+class Vocabulary:
+    """Versioned registry of known pivot values and their output columns.
+
+    For each level, the registry holds the sorted values to create columns for,
+    the column name of each value and the parent of each diagnosis and
+    subcategory in the hierarchy. Column names are fixed when a value is first
+    registered, so later releases keep the same names. The version is increased
+    every time values are added.
+
+    A registry can be passed as the vocabulary of a pivot, so that the output has
+    a column for every registered value whether or not it occurs in the data.
+    """
+
+    values: dict[str, list[str]] = field(
+        default_factory=lambda: {level: [] for level in LEVELS}
+    )
+    columns: dict[str, dict[str, str]] = field(
+        default_factory=lambda: {level: {} for level in LEVELS}
+    )
+    parents: dict[str, dict[str, str]] = field(
+        default_factory=lambda: {level: {} for level in _PARENT_LEVELS}
+    )
+    version: int = 0
+
+    def get(self, level: str) -> list[str] | None:
+        """Get the values of a level, like the vocabulary dict of a pivot."""
+        return self.values.get(level)
+
+    def unknown(self, data: pd.DataFrame, column_prefix: str) -> dict[str, list[str]]:
+        """Get the values of the preprocessed data that are not registered."""
+        unknown: dict[str, list[str]] = {}
+        for level in LEVELS:
+            known = set(self.values[level])
+            new = [
+                value
+                for value in Pivot._get_values(data, level, column_prefix)
+                if value not in known
+            ]
+            if new:
+                unknown[level] = new
+        return unknown
+
+    def update(self, data: pd.DataFrame, column_prefix: str) -> dict[str, list[str]]:
+        """Register the values of the preprocessed data that are not yet known.
+
+        Returns:
+            The added values of each level that had any.
+        """
+        added = self._add(self.unknown(data, column_prefix))
+        self._update_parents(data, column_prefix)
+        return added
+
+    def merge(self, other: "Vocabulary") -> dict[str, list[str]]:
+        """Register the values of another registry that are not yet known.
+
+        The added values keep their column names and parents in the other
+        registry.
+
+        Returns:
+            The added values of each level that had any.
+        """
+        added = self._add(
+            {
+                level: [
+                    value
+                    for value in other.values[level]
+                    if value not in set(self.values[level])
+                ]
+                for level in LEVELS
+            },
+            other.columns,
+        )
+        for level, parents in other.parents.items():
+            for value, parent in parents.items():
+                self.parents[level].setdefault(value, parent)
+        return added
+
+    def _add(
+        self,
+        new_values: dict[str, list[str]],
+        column_names: dict[str, dict[str, str]] | None = None,
+    ) -> dict[str, list[str]]:
+        """Add new values with their column names, increasing the version once."""
+        added = {level: new for level, new in new_values.items() if new}
+        for level, new in added.items():
+            self.values[level] = sorted([*self.values[level], *new])
+            names = (column_names or {}).get(level, {})
+            for value in new:
+                self.columns[level][value] = names.get(
+                    value, Pivot._clean_dx_value(value)
+                )
+        if added:
+            self.version += 1
+            logger.info(
+                "Added %d values to the vocabulary, now version %d",
+                sum(len(new) for new in added.values()),
+                self.version,
+            )
+        return added
+
+    def _update_parents(self, data: pd.DataFrame, column_prefix: str) -> None:
+        """Register the first parent seen of every registered value without one."""
+        slot_columns = [Pivot._dx_column_name(column_prefix, n) for n in Pivot.DX_NS]
+        for level, parent_level in _PARENT_LEVELS.items():
+            parents = self.parents[level]
+            orphans = set(self.values[level]) - set(parents)
+            suffix, parent_suffix = (
+                _LEVEL_SUFFIXES[level],
+                _LEVEL_SUFFIXES[parent_level],
+            )
+            pairs = [
+                data[[f"{col}{suffix}", f"{col}{parent_suffix}"]]
+                .set_axis(["value", "parent"], axis=1)
+                .dropna()
+                for col in slot_columns
+                if f"{col}{suffix}" in data.columns
+                and f"{col}{parent_suffix}" in data.columns
+            ]
+            if not orphans or not pairs:
+                continue
+            found = pd.concat(pairs).drop_duplicates("value")
+            found = found[found["value"].isin(orphans)]
+            parents.update(zip(found["value"], found["parent"]))
+
+    def to_dict(self) -> dict[str, Any]:
+        """Get the registry as a JSON serializable dict."""
+        return {
+            "format": REGISTRY_FORMAT,
+            "version": self.version,
+            "levels": {
+                level: [
+                    {
+                        "value": value,
+                        "column": self.columns[level][value],
+                        **(
+                            {"parent": self.parents[level][value]}
+                            if value in self.parents.get(level, {})
+                            else {}
+                        ),
+                    }
+                    for value in self.values[level]
+                ]
+                for level in LEVELS
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, registry: dict[str, Any]) -> "Vocabulary":
+        """Create a registry from a dict made by to_dict.
+
+        Raises:
+            ValueError: If the dict is not a registry of a supported format.
+        """
+        if registry.get("format") != REGISTRY_FORMAT:
+            raise ValueError(f"Unsupported vocabulary format: {registry.get('format')}")
+        vocabulary = cls(version=registry["version"])
+        for level in LEVELS:
+            entries = registry["levels"].get(level, [])
+            vocabulary.values[level] = sorted(entry["value"] for entry in entries)
+            vocabulary.columns[level] = {
+                entry["value"]: entry["column"] for entry in entries
+            }
+            if level in _PARENT_LEVELS:
+                vocabulary.parents[level] = {
+                    entry["value"]: entry["parent"]
+                    for entry in entries
+                    if "parent" in entry
+                }
+        return vocabulary
+
+    def save(self, path: str) -> None:
+        """Save the registry to a JSON file, replacing it atomically."""
+        temporary_path = f"{path}.tmp"
+        with open(temporary_path, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+        os.replace(temporary_path, path)
+        logger.info("Vocabulary version %d saved to %s", self.version, path)
+
+    @classmethod
+    def load(cls, path: str) -> "Vocabulary":
+        """Load a registry saved with save.
+
+        Raises:
+            ValueError: If the file is not a registry of a supported format.
+        """
+        with open(path) as file:
+            return cls.from_dict(json.load(file))
+
+    @classmethod
+    def load_or_create(cls, path: str) -> "Vocabulary":
+        """Load a registry, or create an empty one if the file does not exist."""
+        if Path(path).exists():
+            return cls.load(path)
+        return cls()
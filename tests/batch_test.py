@@ -0,0 +1,219 @@
+"""Tests for batch processing and the non-interactive CLI."""
+
+import io
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from typer.testing import CliRunner
+
+from hbnddp.__main__ import app
+from hbnddp.batch import FileResult, expand_inputs, process_files, summary
+from hbnddp.hbn_ddp import HBNData
+from hbnddp.prompting import Interactive
+
+
+@pytest.fixture
+def input_dir(tmp_path: Path) -> Path:
+    """Fixture for a directory with two copies of the test data."""
+    directory = tmp_path / "inputs"
+    directory.mkdir()
+    for name in ["site_a.csv", "site_b.csv"]:
+        shutil.copy("tests/test_data.csv", directory / name)
+    return directory
+
+
+def test_expand_inputs(input_dir: Path) -> None:
+    """Test that globs are expanded in order and paths are not repeated."""
+    site_a = str(input_dir / "site_a.csv")
+    paths = expand_inputs([site_a, str(input_dir / "*.csv")])
+    assert paths == [site_a, str(input_dir / "site_b.csv")]
+    with pytest.raises(FileNotFoundError):
+        expand_inputs([str(input_dir / "*.parquet")])
+
+
+def test_process_files(input_dir: Path, tmp_path: Path) -> None:
+    """Test that files processed in a pool match processing them one at a time."""
+    output_dir = tmp_path / "outputs"
+    inputs = expand_inputs([str(input_dir / "*.csv")])
+    results = process_files(inputs, output=str(output_dir), by="categories", workers=2)
+    expected = HBNData.create("tests/test_data.csv").pivot(by="categories")
+    assert [result.error for result in results] == [None, None]
+    for result, name in zip(results, ["site_a", "site_b"]):
+        assert result.output_path == str(
+            output_dir / f"{name}_processed_categories.csv"
+        )
+        assert result.rows == len(expected)
+        pd.testing.assert_frame_equal(
+            pd.read_csv(result.output_path),
+            pd.read_csv(io.StringIO(expected.to_csv(index=False))),
+        )
+
+
+def test_process_files_error(input_dir: Path, tmp_path: Path) -> None:
+    """Test that a failing file does not stop the others."""
+    broken = tmp_path / "broken.csv"
+    broken.write_text("Identifiers,Other\n1,2\n")
+    results = process_files([str(broken), str(input_dir / "site_a.csv")])
+    assert results[0].error is not None
+    assert results[1].error is None
+    assert "FAILED" in summary(results)
+    with pytest.raises(ValueError):
+        process_files([str(broken)], certainty_filter=["Maybe"])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_files_viz(
+    input_dir: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, workers: int
+) -> None:
+    """Test that the plots of every input are saved to a directory of its own."""
+    data = pd.read_csv(input_dir / "site_b.csv")
+    data.iloc[:50].to_csv(input_dir / "site_b.csv", index=False)
+    monkeypatch.chdir(tmp_path)
+    inputs = expand_inputs([str(input_dir / "*.csv")])
+    results = process_files(
+        inputs,
+        output=str(tmp_path / "outputs"),
+        by="categories",
+        viz=True,
+        viz_format="html",
+        workers=workers,
+    )
+    assert [result.error for result in results] == [None, None]
+    digests = [
+        (tmp_path / "figures" / name / ".category_bar_plot.html.sha256").read_text()
+        for name in ["site_a", "site_b"]
+    ]
+    assert digests[0] != digests[1]
+    assert not (tmp_path / "figures" / "category_bar_plot.html").exists()
+
+
+def test_process_files_same_names(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that inputs with the same name in several directories are kept apart."""
+    for name, rows in [("r1", 100), ("r2", 50)]:
+        (tmp_path / name).mkdir()
+        data = pd.read_csv("tests/test_data.csv")
+        data.iloc[:rows].to_csv(tmp_path / name / "data.csv", index=False)
+    monkeypatch.chdir(tmp_path)
+    inputs = expand_inputs([str(tmp_path / "r*" / "data.csv")])
+    results = process_files(
+        inputs,
+        output=str(tmp_path / "outputs"),
+        by="diagnoses",
+        viz=True,
+        viz_format="html",
+        workers=2,
+    )
+    assert [result.rows for result in results] == [100, 50]
+    for name, rows in [("r1", 100), ("r2", 50)]:
+        output_path = tmp_path / "outputs" / name / "data_processed_diagnoses.csv"
+        assert len(pd.read_csv(output_path)) == rows
+        assert (
+            tmp_path / "figures" / name / "data" / "diagnosis_bar_plot.html"
+        ).exists()
+
+    # Inputs that would still be written to the same file are refused
+    pytest.importorskip("pyarrow")
+    data.to_parquet(tmp_path / "r2" / "data.parquet")
+    with pytest.raises(ValueError, match="Several inputs"):
+        process_files(
+            [str(tmp_path / "r2" / "data.csv"), str(tmp_path / "r2" / "data.parquet")]
+        )
+
+
+def test_summary() -> None:
+    """Test the rows per second and totals of the summary."""
+    results = [FileResult("a.csv", "a_out.csv", 100, 2.0)]
+    assert results[0].rows_per_second == 50
+    lines = summary(results).splitlines()
+    assert lines[1].split()[:4] == ["a.csv", "100", "2.000", "50"]
+    assert lines[-1].split() == ["Total", "100", "2.000"]
+
+
+def test_cli_batch(input_dir: Path, tmp_path: Path) -> None:
+    """Test processing a glob of files without prompts."""
+    output_dir = tmp_path / "outputs"
+    result = CliRunner().invoke(
+        app,
+        [
+            str(input_dir / "*.csv"),
+            "--output",
+            str(output_dir),
+            "--by",
+            "diagnoses",
+            "--certainty",
+            "Confirmed",
+            "--certainty",
+            "Presumptive",
+            "--jobs",
+            "2",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert "site_a.csv" in result.output
+    assert "site_b.csv" in result.output
+    assert sorted(path.name for path in output_dir.iterdir()) == [
+        "site_a_processed_diagnoses.csv",
+        "site_b_processed_diagnoses.csv",
+    ]
+
+
+def test_cli_single_output(input_dir: Path, tmp_path: Path) -> None:
+    """Test that the output of a single input is written to the given file."""
+    output = tmp_path / "output.csv"
+    result = CliRunner().invoke(
+        app,
+        [
+            str(input_dir / "site_a.csv"),
+            "-o",
+            str(output),
+            "--by",
+            "categories",
+            "--include-details",
+            "--details-format",
+            "long",
+            "--profile",
+        ],
+    )
+    assert result.exit_code == 0, result.output
+    assert output.exists()
+    assert (tmp_path / "output_details.csv").exists()
+    assert "preprocess" in result.output
+
+
+def test_cli_errors(input_dir: Path) -> None:
+    """Test that invalid batch options are reported."""
+    runner = CliRunner()
+    result = runner.invoke(app, [str(input_dir / "missing.csv")])
+    assert result.exit_code == 2
+    result = runner.invoke(app, [str(input_dir / "site_a.csv"), "--certainty", "Maybe"])
+    assert result.exit_code == 2
+    result = runner.invoke(app, ["--by", "diagnoses"])
+    assert result.exit_code == 2
+
+
+def test_cli_interactive(
+    monkeypatch: pytest.MonkeyPatch, input_dir: Path, tmp_path: Path
+) -> None:
+    """Test that the prompts run when no arguments are given."""
+    output = tmp_path / "output.csv"
+    monkeypatch.setattr(
+        Interactive,
+        "prompt",
+        staticmethod(
+            lambda: {
+                "input_path": str(input_dir / "site_a.csv"),
+                "output_path": str(output),
+                "by": "categories",
+                "certainty_filter": None,
+                "include_details": False,
+                "viz": False,
+            }
+        ),
+    )
+    result = CliRunner().invoke(app, [])
+    assert result.exit_code == 0, result.output
+    assert output.exists()
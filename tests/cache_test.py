@@ -0,0 +1,135 @@
+"""Tests for the on-disk result cache."""
+
+import os
+import pickle
+import shutil
+from pathlib import Path
+
+import pandas as pd
+import pytest
+from typer.testing import CliRunner
+
+from hbnddp.__main__ import app
+from hbnddp.cache import ResultCache
+from hbnddp.hbn_ddp import HBNData
+
+
+@pytest.fixture
+def input_path(tmp_path: Path) -> Path:
+    """Fixture for a copy of the test data."""
+    path = tmp_path / "data.csv"
+    shutil.copy("tests/test_data.csv", path)
+    return path
+
+
+def test_process_cached(
+    input_path: Path, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that processing the same input and parameters again is a hit."""
+    cache = ResultCache(str(tmp_path / "cache"))
+    options = {"by": "all", "include_details": True, "sparse": True}
+    expected = HBNData.create(str(input_path)).process(**options, cache=cache)
+    assert len(cache.entries()) == 1
+
+    def fail(*args: object, **kwargs: object) -> None:
+        raise AssertionError("Pivoted on a cache hit")
+
+    monkeypatch.setattr(HBNData, "pivot", fail)
+    output_path = tmp_path / "output.csv"
+    output = HBNData.create(str(input_path)).process(
+        str(output_path), **options, cache=str(tmp_path / "cache")
+    )
+    pd.testing.assert_frame_equal(output, expected)
+    assert output_path.exists()
+
+    # Other parameters or input content are misses
+    monkeypatch.undo()
+    HBNData.create(str(input_path)).process(by="categories", cache=cache)
+    data = pd.read_csv(input_path)
+    data.iloc[:50].to_csv(input_path, index=False)
+    HBNData.create(str(input_path)).process(by="categories", cache=cache)
+    assert len(cache.entries()) == 3
+
+    # Data changed after loading is a miss, even though its file is unchanged
+    hbn_data = HBNData.create(str(input_path))
+    hbn_data.data = hbn_data.data.iloc[:10]
+    output = hbn_data.process(by="categories", cache=cache)
+    assert len(output) == 10
+    assert len(cache.entries()) == 4
+
+
+def test_long_details_cached(input_path: Path, tmp_path: Path) -> None:
+    """Test that the long details table is cached with the output."""
+    cache = ResultCache(str(tmp_path / "cache"))
+    options = {"by": "categories", "include_details": True, "details_format": "long"}
+    hbn_data = HBNData.create(str(input_path))
+    hbn_data.process(**options, cache=cache)
+    expected = hbn_data.details_data
+    hbn_data = HBNData.create(str(input_path))
+    hbn_data.process(**options, cache=cache)
+    assert expected is not None
+    pd.testing.assert_frame_equal(hbn_data.details_data, expected)
+
+
+def test_eviction(tmp_path: Path) -> None:
+    """Test that the least recently used entries are evicted first."""
+    frame = pd.DataFrame({"a": range(1000)})
+    cache = ResultCache(str(tmp_path / "cache"), max_bytes=1)
+    cache.put("first", frame)
+    cache.put("second", frame)
+    # The newest entry is kept even if it alone exceeds the bound
+    assert [path.stem for path in cache.entries()] == ["second"]
+
+    cache.max_bytes = 3 * cache.size()
+    cache.put("third", frame)
+    cache.put("fourth", frame)
+    for i, name in enumerate(["second", "third", "fourth"]):
+        os.utime(tmp_path / "cache" / f"{name}.pkl", ns=(i * 10**9, i * 10**9))
+    # Using an entry makes it the most recently used
+    assert cache.get("second") is not None
+    cache.put("fifth", frame)
+    assert {path.stem for path in cache.entries()} == {"second", "fourth", "fifth"}
+    assert cache.get("third") is None
+
+    (tmp_path / "cache" / "broken.pkl").write_bytes(b"not a pickle")
+    assert cache.get("broken") is None
+    assert cache.clear() == 3
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        # A class of a module that is not installed, as after an upgrade
+        b"cno_such_module\nFrame\n.",
+        # A pickle that is not an entry
+        pickle.dumps([1, 2]),
+    ],
+)
+def test_incompatible_entry(
+    tmp_path: Path, content: bytes, caplog: pytest.LogCaptureFixture
+) -> None:
+    """Test that entries that cannot be loaded are removed and are a miss."""
+    cache = ResultCache(str(tmp_path / "cache"))
+    path = tmp_path / "cache" / "entry.pkl"
+    path.write_bytes(content)
+    assert cache.get("entry") is None
+    assert not path.exists()
+    assert "Removing unreadable cache entry" in caplog.text
+
+
+def test_cli_cache(input_path: Path, tmp_path: Path) -> None:
+    """Test caching batch results and clearing the cache from the CLI."""
+    cache_dir = tmp_path / "cache"
+    runner = CliRunner()
+    args = [str(input_path), "--by", "diagnoses", "--cache-dir", str(cache_dir)]
+    for _ in range(2):
+        result = runner.invoke(app, args)
+        assert result.exit_code == 0, result.output
+    assert len(list(cache_dir.glob("*.pkl"))) == 1
+
+    result = runner.invoke(app, ["--clear-cache", "--cache-dir", str(cache_dir)])
+    assert result.exit_code == 0, result.output
+    assert "Removed 1" in result.output
+    assert not list(cache_dir.glob("*.pkl"))
+    result = runner.invoke(app, ["--clear-cache"])
+    assert result.exit_code == 2
@@ -0,0 +1,85 @@
+"""Tests for the inverted index of participants."""
+
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from hbnddp.cohort import CohortIndex
+from hbnddp.hbn_ddp import HBNData
+from hbnddp.pivot import Pivot
+
+
+@pytest.fixture
+def hbn_data() -> HBNData:
+    """Fixture for the test data."""
+    return HBNData.create("tests/test_data.csv")
+
+
+def test_select(hbn_data: HBNData) -> None:
+    """Test that selected cohorts are the participants of the pivot columns."""
+    index = hbn_data.cohort_index()
+    confirmed = hbn_data.pivot(by="categories", certainty_filter=["Confirmed"])
+    dense = hbn_data.pivot(by="all")
+    for category in index.values("categories"):
+        column = f"{Pivot._clean_dx_value(category)}_CategoryPresent"
+        cohort = index.select("categories", category, certainty="Confirmed")
+        np.testing.assert_array_equal(cohort.mask(), confirmed[column] == 1)
+
+    diagnoses = index.select("diagnoses")
+    present = dense.filter(like="_DiagnosisPresent").sum(axis=1) > 0
+    np.testing.assert_array_equal(diagnoses.mask(), present)
+    assert len(diagnoses) == present.sum()
+
+    site = hbn_data.data["Diagnosis_ClinicianConsensus,Site"] == 1
+    np.testing.assert_array_equal(index.where("Site", 1).mask(), site)
+    np.testing.assert_array_equal(index.where("Site", 1.0).mask(), site)
+
+    with pytest.raises(ValueError):
+        index.select("diagnoses", "Not a diagnosis")
+    with pytest.raises(ValueError):
+        index.select("diagnoses", certainty="Certain")
+    with pytest.raises(ValueError):
+        index.where("Region", 1)
+
+
+def test_combine(hbn_data: HBNData) -> None:
+    """Test combining cohorts with and, or and not."""
+    index = hbn_data.cohort_index()
+    first, second = index.values("categories")[:2]
+    a = index.select("categories", first)
+    b = index.select("categories", second, time="Present")
+    mask_a, mask_b = a.mask(), b.mask()
+    np.testing.assert_array_equal((a & b).mask(), mask_a & mask_b)
+    np.testing.assert_array_equal((a | b).mask(), mask_a | mask_b)
+    np.testing.assert_array_equal((a - b).mask(), mask_a & ~mask_b)
+    np.testing.assert_array_equal((~a).mask(), ~mask_a)
+    assert len(~a) == len(index.identifiers) - len(a)
+    assert len(index.everyone()) == len(index.identifiers)
+    assert len(index.nobody()) == 0
+
+    identifiers = a.identifiers
+    assert identifiers[0] in a
+    assert identifiers[0] not in ~a
+    np.testing.assert_array_equal(index.of(identifiers).mask(), mask_a)
+    assert ("categories", first) in index.keys(identifiers[0])
+
+    with pytest.raises(ValueError):
+        a & hbn_data.cohort_index().everyone()
+
+
+def test_save_load(hbn_data: HBNData, tmp_path: Path) -> None:
+    """Test that a saved index is loaded with the same cohorts."""
+    index = hbn_data.cohort_index()
+    path = tmp_path / "index.npz"
+    index.save(str(path))
+    loaded = CohortIndex.load(str(path))
+    assert loaded.identifiers.tolist() == index.identifiers.tolist()
+    assert loaded.bitsets.keys() == index.bitsets.keys()
+    for key, bits in index.bitsets.items():
+        np.testing.assert_array_equal(loaded.bitsets[key], bits)
+    category = index.values("categories")[0]
+    np.testing.assert_array_equal(
+        loaded.select("categories", category, certainty=["Confirmed", "ByHx"]).mask(),
+        index.select("categories", category, certainty=["Confirmed", "ByHx"]).mask(),
+    )
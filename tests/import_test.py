@@ -0,0 +1,57 @@
+"""Tests for the import time of the package and the CLI."""
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+# Modules that are only imported when plotting or prompting
+LAZY_MODULES = ["plotly", "PIL", "kaleido", "questionary", "prompt_toolkit"]
+
+# Budget of importing the CLI once pandas is loaded, in milliseconds
+IMPORT_BUDGET_MS = 250
+
+
+def _import_times(statement: str) -> dict[str, int]:
+    """Run an import statement in a new interpreter with -X importtime.
+
+    Returns:
+        The cumulative import time of every imported module in microseconds.
+    """
+    env = os.environ | {
+        "PYTHONPATH": os.pathsep.join(["src", os.environ.get("PYTHONPATH", "")])
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        capture_output=True,
+        text=True,
+        env=env,
+        check=True,
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize("module", ["hbnddp", "hbnddp.__main__"])
+def test_lazy_imports(module: str) -> None:
+    """Test that plotting and prompt modules are not imported up front."""
+    times = _import_times(f"import {module}")
+    assert module in times
+    loaded = {name.split(".")[0] for name in times}
+    assert loaded.isdisjoint(LAZY_MODULES)
+
+
+def test_import_budget() -> None:
+    """Test that the CLI imports within budget on top of pandas."""
+    # Take the best of a few runs to be robust to a busy machine
+    best = min(
+        _import_times("import pandas; import hbnddp.__main__")["hbnddp.__main__"]
+        for _ in range(3)
+    )
+    assert best / 1000 < IMPORT_BUDGET_MS
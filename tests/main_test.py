@@ -2,12 +2,16 @@
 
 import itertools
 from pathlib import Path
+from typing import Any, Literal
 
 import numpy as np
 import pandas as pd
 import pytest
 
 from hbnddp.hbn_ddp import HBNData
+from hbnddp.incremental import Manifest, row_hashes
+from hbnddp.pivot import DetailsFormat, DxSlots
+from hbnddp.utils import read
 
 
 def test_main_import() -> None:
@@ -57,6 +61,45 @@ def test_create() -> None:
     assert isinstance(data, HBNData)
 
 
+def test_create_projects_columns(tmp_path: Path) -> None:
+    """Test that only diagnosis columns and requested extra columns are read."""
+    data = pd.read_csv("tests/test_data.csv")
+    data["Basic_Demos,Age"] = range(len(data))
+    data["Basic_Demos,Sex"] = 1
+    input_path = tmp_path / "merged.csv"
+    data.to_csv(input_path, index=False)
+
+    hbn_data = HBNData.create(str(input_path))
+    assert "Basic_Demos,Age" not in hbn_data.data.columns
+    assert hbn_data.data["Diagnosis_ClinicianConsensus,DX_01_Confirmed"].dtype == float
+
+    hbn_data = HBNData.create(str(input_path), extra_columns=["Basic_Demos,Age"])
+    assert "Basic_Demos,Sex" not in hbn_data.data.columns
+    output = hbn_data.pivot(by="categories")
+    assert output["Basic_Demos,Age"].to_list() == list(range(len(data)))
+
+    with pytest.raises(ValueError):
+        HBNData.create(str(input_path), extra_columns=["Basic_Demos,Height"])
+
+
+def test_create_parquet(tmp_path: Path) -> None:
+    """Test loading Parquet data gives the same pivot as CSV data."""
+    pytest.importorskip("pyarrow")
+    input_path = tmp_path / "data.parquet"
+    HBNData.create("tests/test_data.csv").data.to_parquet(input_path)
+
+    hbn_data = HBNData.create(str(input_path))
+    expected = HBNData.create("tests/test_data.csv").pivot(by="all")
+    # Empty text cells are read back as None rather than NaN, so compare contents
+    assert hbn_data.pivot(by="all").to_csv() == expected.to_csv()
+
+    output_path = HBNData.stream(str(input_path), chunksize=9)
+    assert output_path.endswith("data_processed_all.csv")
+    streamed = pd.read_csv(output_path)
+    assert streamed.columns.to_list() == expected.columns.to_list()
+    assert len(streamed) == len(expected)
+
+
 def test_preprocess_categories(categories_df: pd.DataFrame) -> None:
     """Test that blank subcategories are filled with category values."""
     categories_df.iloc[1, 1] = None
@@ -74,6 +117,27 @@ def test_preprocess_categories(categories_df: pd.DataFrame) -> None:
     assert result.iloc[2, 3] == "Cat_02_03"
 
 
+def test_preprocess_cached(categories_df: pd.DataFrame) -> None:
+    """Test that preprocessing runs once and does not copy or modify the data."""
+    categories_df.iloc[1, 1] = None
+    categories_df["Identifiers"] = ["A", "B", "C"]
+    categories_df["Other"] = np.arange(len(categories_df))
+    original = categories_df.copy()
+    hbn_data = HBNData(
+        data=categories_df, column_prefix="Diagnosis_ClinicianConsensus,"
+    )
+    result = hbn_data._preprocessed_data
+    assert hbn_data._preprocessed_data is result
+    pd.testing.assert_frame_equal(categories_df, original)
+    # Only the filled subcategory columns are new
+    assert np.shares_memory(result["Other"].to_numpy(), categories_df["Other"])
+    assert hbn_data._static_columns() is hbn_data._static_columns()
+    # Replacing the data invalidates the cache
+    hbn_data.data = categories_df.head(2)
+    assert len(hbn_data._preprocessed_data) == 2
+    assert len(hbn_data._static_columns()) == 2
+
+
 def test_copy_static_columns() -> None:
     """Test the copy static columns function."""
     static_cols = [
@@ -133,6 +197,164 @@ def test_pivot() -> None:
         hbn_data.pivot(by="invalid_option")  # type: ignore
 
 
+def test_dx_slots_cached() -> None:
+    """Test that diagnosis slots are shared between pivots with the same filter."""
+    hbn_data = HBNData.create("tests/test_data.csv")
+    data = hbn_data._preprocessed_data
+    confirmed = hbn_data._dx_slots(data, ["Confirmed", "RC"])
+    assert hbn_data._dx_slots(data, ["RC", "Confirmed"]) is confirmed
+    assert hbn_data._dx_slots(data, None) is not confirmed
+    assert set(confirmed.certainty) <= {"Confirmed", "RC"}
+    # Arrays derived from filtered slots are computed once on all slots
+    sources = []
+
+    def compute(slots: DxSlots) -> np.ndarray:
+        sources.append(slots)
+        return slots.cat.astype(str)
+
+    derived = confirmed.derived("cat", compute)
+    hbn_data._dx_slots(data, ["RuleOut"]).derived("cat", compute)
+    assert len(sources) == 1
+    assert sources[0] is hbn_data._dx_slots(data, None)
+    np.testing.assert_array_equal(derived, confirmed.cat.astype(str))
+    # Replacing the data invalidates the cached slots
+    hbn_data.data = hbn_data.data.head(10)
+    assert hbn_data._dx_slots(hbn_data._preprocessed_data, None).n_rows == 10
+
+
+def test_pivot_sparse() -> None:
+    """Test that the sparse pivot holds the same data as the dense pivot."""
+    hbn_data = HBNData.create("tests/test_data.csv")
+    dense = hbn_data.pivot(by="all", include_details=True)
+    output = hbn_data.pivot(by="all", include_details=True, sparse=True)
+    assert isinstance(
+        output["Autism_Spectrum_Disorder_DiagnosisPresent"].dtype, pd.SparseDtype
+    )
+    assert isinstance(
+        output["Neurodevelopmental_Disorders_CategoryPresent"].dtype, pd.SparseDtype
+    )
+    assert output.to_csv() == dense.to_csv()
+
+
+@pytest.mark.parametrize("by", ["diagnoses", "all"])
+def test_pivot_parallel(by: Literal["diagnoses", "all"]) -> None:
+    """Test that pivoting row partitions in parallel matches the serial pivot."""
+    hbn_data = HBNData.create("tests/test_data.csv")
+    options_list: list[dict[str, Any]] = [
+        {},
+        {"certainty_filter": ["Confirmed"], "sparse": True},
+        {"details_format": "json"},
+    ]
+    for options in options_list:
+        expected = hbn_data.pivot(by=by, include_details=True, **options)
+        output = hbn_data.pivot(by=by, include_details=True, n_jobs=3, **options)
+        pd.testing.assert_frame_equal(output, expected)
+        assert output.to_csv() == expected.to_csv()
+
+    with pytest.raises(ValueError):
+        hbn_data.pivot(by=by, n_jobs=0)
+
+
+def test_incidence(tmp_path: Path) -> None:
+    """Test the sparse presence matrix and its .npz export."""
+    pytest.importorskip("scipy")
+    from hbnddp.pivot import Incidence
+
+    hbn_data = HBNData.create("tests/test_data.csv")
+    dense = hbn_data.pivot(by="subcategories", certainty_filter=["Confirmed"])
+    incidence = hbn_data.incidence("subcategories", certainty_filter=["Confirmed"])
+    present = [col for col in dense.columns if col.endswith("_SubcategoryPresent")]
+    assert incidence.matrix.shape == (len(dense), len(present))
+    np.testing.assert_array_equal(incidence.matrix.toarray(), dense[present])
+    assert incidence.rows.tolist() == dense["Identifiers"].to_list()
+
+    path = tmp_path / "incidence.npz"
+    incidence.save_npz(str(path))
+    loaded = Incidence.load_npz(str(path))
+    assert (loaded.matrix != incidence.matrix).nnz == 0
+    assert loaded.columns.tolist() == incidence.columns.tolist()
+
+
+def test_cooccurrence(tmp_path: Path) -> None:
+    """Test the pair counts, Jaccard indices and conditional rates."""
+    pytest.importorskip("scipy")
+    hbn_data = HBNData.create("tests/test_data.csv")
+    dense = hbn_data.pivot(by="categories", certainty_filter=["Confirmed"])
+    present = dense[[col for col in dense.columns if col.endswith("_CategoryPresent")]]
+    flags = present.to_numpy().astype(bool)
+    cooccurrence = hbn_data.cooccurrence("categories", certainty_filter=["Confirmed"])
+    both = flags.T.astype(int) @ flags.astype(int)
+    np.testing.assert_array_equal(cooccurrence.counts, both)
+    either = (flags[:, :, None] | flags[:, None, :]).sum(axis=0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        np.testing.assert_allclose(cooccurrence.jaccard(), both / either)
+        np.testing.assert_allclose(
+            cooccurrence.conditional(), both / flags.sum(axis=0)[:, None]
+        )
+    frame = cooccurrence.to_frame("jaccard")
+    assert frame.index.equals(frame.columns)
+    with pytest.raises(ValueError):
+        cooccurrence.to_frame("lift")  # type: ignore[arg-type]
+
+    path = tmp_path / "cooccurrence.csv"
+    cooccurrence.save(str(path))
+    pairs = pd.read_csv(path)
+    assert list(pairs.columns) == ["first", "second", "count", "jaccard", "conditional"]
+    assert (pairs["first"] != pairs["second"]).all()
+    assert pairs["count"].sum() == both.sum() - np.trace(both)
+
+
+@pytest.mark.parametrize("certainty_filter", [None, ["Confirmed", "ByHx"]])
+def test_counts(certainty_filter: list[str] | None) -> None:
+    """Test that the counts are the sums of the presence columns."""
+    hbn_data = HBNData.create("tests/test_data.csv")
+    for by, suffix in [
+        ("diagnoses", "_DiagnosisPresent"),
+        ("subcategories", "_SubcategoryPresent"),
+        ("categories", "_CategoryPresent"),
+    ]:
+        dense = hbn_data.pivot(by=by, certainty_filter=certainty_filter)
+        present = [col for col in dense.columns if col.endswith(suffix)]
+        counts = hbn_data.counts(by, certainty_filter)
+        assert counts.index.name == by
+        assert counts["count"].tolist() == dense[present].sum().tolist()
+
+    counts = hbn_data.counts(
+        "categories",
+        certainty_filter,
+        group_by=["Site", "Diagnosis_ClinicianConsensus,Year"],
+    )
+    dense = hbn_data.pivot(by="categories", certainty_filter=certainty_filter)
+    present = [col for col in dense.columns if col.endswith("_CategoryPresent")]
+    expected = (
+        dense[present]
+        .groupby(
+            [
+                hbn_data.data["Diagnosis_ClinicianConsensus,Site"],
+                hbn_data.data["Diagnosis_ClinicianConsensus,Year"],
+            ]
+        )
+        .sum()
+    )
+    assert counts.columns.names == ["Site", "Diagnosis_ClinicianConsensus,Year"]
+    np.testing.assert_array_equal(counts.to_numpy(), expected.to_numpy().T)
+
+    # Participants with a missing group value are not counted
+    site = "Diagnosis_ClinicianConsensus,Site"
+    data = hbn_data.data.copy()
+    data[site] = data[site].astype(float)
+    data.loc[data.index[::3], site] = np.nan
+    hbn_data = HBNData(data, hbn_data.column_prefix)
+    counts = hbn_data.counts("categories", certainty_filter, group_by=["Site"])
+    dense = hbn_data.pivot(by="categories", certainty_filter=certainty_filter)
+    expected = dense[present].groupby(data[site]).sum()
+    assert counts.columns.tolist() == expected.index.tolist()
+    np.testing.assert_array_equal(counts.to_numpy(), expected.to_numpy().T)
+
+    with pytest.raises(ValueError, match="not found"):
+        hbn_data.counts("categories", group_by=["Region"])
+
+
 def test_process() -> None:
     """Test the main processing function."""
     hbn_data = HBNData.create("tests/test_data.csv")
@@ -154,3 +376,275 @@ def test_process() -> None:
     print(output.columns)
     for col in expected_columns:
         assert col in output.columns
+
+
+def test_process_details_table(tmp_path: Path) -> None:
+    """Test that the long details table is written next to the output."""
+    hbn_data = HBNData.create("tests/test_data.csv")
+    output_path = tmp_path / "output.csv"
+    output = hbn_data.process(
+        output_path=str(output_path),
+        by="all",
+        include_details=True,
+        details_format="long",
+    )
+    assert not any(col.endswith("_Details") for col in output.columns)
+    details = hbn_data.details_data
+    assert details is not None
+    assert set(details["level"]) == {"subcategories", "categories"}
+    assert set(details["Identifiers"]) <= set(output["Identifiers"])
+    # Every present category has a row in the details table
+    present = output.filter(like="_CategoryPresent").to_numpy().sum()
+    counts = details[details["level"] == "categories"].groupby("Identifiers")
+    assert counts["value"].nunique().sum() == present
+    written = pd.read_csv(tmp_path / "output_details.csv")
+    assert len(written) == len(details)
+
+    with pytest.raises(ValueError):
+        hbn_data.details("diagnoses")  # type: ignore[arg-type]
+    with pytest.raises(ValueError):
+        hbn_data.pivot(details_format="xml")  # type: ignore[arg-type]
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".feather"])
+def test_process_arrow_details(tmp_path: Path, suffix: str) -> None:
+    """Test that the details of all levels are named after their level in Arrow."""
+    pytest.importorskip("pyarrow")
+    hbn_data = HBNData.create("tests/test_data.csv")
+    output_path = str(tmp_path / f"output{suffix}")
+    output = hbn_data.process(output_path=output_path, by="all", include_details=True)
+    assert output.columns.duplicated().any()
+
+    written = read(output_path)
+    assert written.columns.is_unique
+    assert "Anxiety_Disorders_SubcategoryDetails" in written.columns
+    assert "Anxiety_Disorders_CategoryDetails" in written.columns
+    assert not any(col.endswith("_Details") for col in written.columns)
+    # Missing details are read back as None rather than NaN, so compare contents
+    assert written.to_csv() == output.set_axis(written.columns, axis=1).to_csv()
+    # Details of a single level keep their names
+    hbn_data.process(output_path=output_path, by="categories", include_details=True)
+    assert "Anxiety_Disorders_Details" in read(output_path).columns
+
+
+@pytest.mark.parametrize("details_format", ["repr", "json", "long"])
+def test_process_variants(tmp_path: Path, details_format: DetailsFormat) -> None:
+    """Test that every variant matches processing it alone, and is written."""
+    input_path = tmp_path / "data.csv"
+    pd.read_csv("tests/test_data.csv").to_csv(input_path, index=False)
+    certainty_filters = [None, ["Presumptive", "Confirmed"], ["RuleOut"]]
+    variants = HBNData.create(str(input_path)).process_variants(
+        certainty_filters,
+        by=["diagnoses", "categories", "all"],
+        include_details=True,
+        sparse=True,
+        details_format=details_format,
+    )
+    assert len(variants) == 9
+    for by, certainty_filter in itertools.product(
+        ["diagnoses", "categories", "all"], certainty_filters
+    ):
+        expected = HBNData.create(str(input_path)).pivot(
+            by=by,  # type: ignore[arg-type]
+            certainty_filter=certainty_filter,
+            include_details=True,
+            sparse=True,
+            details_format=details_format,
+        )
+        key = (
+            by,
+            None if certainty_filter is None else tuple(sorted(certainty_filter)),
+        )
+        pd.testing.assert_frame_equal(variants[key], expected)
+    assert (tmp_path / "data_processed_all.csv").exists()
+    written = pd.read_csv(
+        tmp_path / "data_processed_categories_Presumptive_Confirmed.csv"
+    )
+    assert len(written) == len(variants["categories", ("Confirmed", "Presumptive")])
+    assert (tmp_path / "data_processed_all_RuleOut_details.csv").exists() == (
+        details_format == "long"
+    )
+
+
+def test_process_variants_output_dir(tmp_path: Path) -> None:
+    """Test that variants are written to an output directory, under their names."""
+    input_path = tmp_path / "data.csv"
+    pd.read_csv("tests/test_data.csv").to_csv(input_path, index=False)
+    output_dir = tmp_path / "variants"
+    variants = HBNData.create(str(input_path)).process_variants(
+        [None, ["Confirmed"]],
+        by="categories",
+        include_details=True,
+        details_format="long",
+        output_dir=str(output_dir),
+    )
+    assert sorted(path.name for path in output_dir.iterdir()) == [
+        "data_processed_categories.csv",
+        "data_processed_categories_Confirmed.csv",
+        "data_processed_categories_Confirmed_details.csv",
+        "data_processed_categories_details.csv",
+    ]
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["data.csv", "variants"]
+    written = pd.read_csv(output_dir / "data_processed_categories_Confirmed.csv")
+    assert len(written) == len(variants["categories", ("Confirmed",)])
+
+    hbn_data = HBNData.create("tests/test_data.csv")
+    data = HBNData(hbn_data.data, hbn_data.column_prefix)
+    with pytest.raises(ValueError):
+        data.process_variants([None], output_dir=str(output_dir))
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"by": "all", "include_details": True},
+        {"by": "categories", "include_details": True, "details_format": "json"},
+        {"by": "diagnoses", "certainty_filter": ["Confirmed"], "sparse": True},
+    ],
+)
+def test_process_incremental(tmp_path: Path, options: dict[str, Any]) -> None:
+    """Test that updating a previous output matches processing all of the data."""
+    data = pd.read_csv("tests/test_data.csv")
+    data.iloc[:70].to_csv(tmp_path / "release_1.csv", index=False)
+    # The next release adds participants, drops one and changes another
+    release = data.drop(index=10)
+    slot = [col for col in data.columns if "DX_01" in col]
+    release.loc[5, slot] = release.loc[80, slot].to_numpy()
+    release.to_csv(tmp_path / "release_2.csv", index=False)
+
+    previous = HBNData.create(str(tmp_path / "release_1.csv")).process(
+        str(tmp_path / "previous.csv"), **options, save_manifest=True
+    )
+    assert (tmp_path / "previous_manifest.json").exists()
+    manifest = Manifest.load(str(tmp_path / "previous_manifest.json"))
+    hbn_data = HBNData.create(str(tmp_path / "release_2.csv"))
+    changed = manifest.changed(
+        hbn_data._static_columns()["Identifiers"], row_hashes(hbn_data.data)
+    )
+    assert changed.sum() == 31
+
+    output = hbn_data.process(
+        str(tmp_path / "updated.csv"),
+        **options,
+        previous_output=str(tmp_path / "previous.csv"),
+    )
+    expected = HBNData.create(str(tmp_path / "release_2.csv")).process(
+        str(tmp_path / "expected.csv"), **options
+    )
+    assert output.shape[1] > previous.shape[1]
+    assert list(output.columns) == list(expected.columns)
+    assert (tmp_path / "updated.csv").read_text() == (
+        tmp_path / "expected.csv"
+    ).read_text()
+    present = [col for col in output.columns if col.endswith("Present")]
+    pd.testing.assert_frame_equal(output[present], expected[present])
+
+    # The updated output has a manifest to update it again
+    manifest = Manifest.load(str(tmp_path / "updated_manifest.json"))
+    assert not manifest.changed(
+        hbn_data._static_columns()["Identifiers"], row_hashes(hbn_data.data)
+    ).any()
+    with pytest.raises(ValueError):
+        hbn_data.process(
+            str(tmp_path / "other.csv"),
+            by="subcategories",
+            previous_output=str(tmp_path / "updated.csv"),
+        )
+
+
+@pytest.mark.parametrize("details_format", ["json", "long"])
+def test_stream_details(tmp_path: Path, details_format: DetailsFormat) -> None:
+    """Test that streaming writes the same details as processing."""
+    expected_path = tmp_path / "expected.csv"
+    HBNData.create("tests/test_data.csv").process(
+        output_path=str(expected_path),
+        by="categories",
+        include_details=True,
+        details_format=details_format,
+    )
+    output_path = HBNData.stream(
+        "tests/test_data.csv",
+        output_path=str(tmp_path / "streamed.csv"),
+        by="categories",
+        include_details=True,
+        chunksize=7,
+        details_format=details_format,
+    )
+    assert Path(output_path).read_text() == expected_path.read_text()
+    if details_format == "long":
+        assert (tmp_path / "streamed_details.csv").read_text() == (
+            tmp_path / "expected_details.csv"
+        ).read_text()
+
+
+@pytest.mark.parametrize(
+    "by, certainty_filter, include_details",
+    [
+        ("all", None, True),
+        ("diagnoses", ["Confirmed", "Presumptive"], False),
+    ],
+)
+def test_stream(
+    tmp_path: Path,
+    by: Literal["diagnoses", "all"],
+    certainty_filter: list[str] | None,
+    include_details: bool,
+) -> None:
+    """Test that streaming in chunks writes the same file as processing."""
+    expected_path = tmp_path / "expected.csv"
+    HBNData.create("tests/test_data.csv").process(
+        output_path=str(expected_path),
+        by=by,
+        certainty_filter=certainty_filter,
+        include_details=include_details,
+    )
+    output_path = HBNData.stream(
+        "tests/test_data.csv",
+        output_path=str(tmp_path / "streamed.csv"),
+        by=by,
+        certainty_filter=certainty_filter,
+        include_details=include_details,
+        chunksize=7,
+    )
+    assert Path(output_path).read_text() == expected_path.read_text()
+
+
+@pytest.mark.parametrize(
+    "by, details_format, suffix",
+    [
+        ("diagnoses", "repr", ".parquet"),
+        ("categories", "long", ".parquet"),
+        ("subcategories", "json", ".feather"),
+        ("all", "repr", ".parquet"),
+        ("all", "json", ".feather"),
+    ],
+)
+def test_stream_arrow(
+    tmp_path: Path,
+    by: Literal["diagnoses", "subcategories", "categories", "all"],
+    details_format: DetailsFormat,
+    suffix: str,
+) -> None:
+    """Test that streaming to Parquet or Arrow writes the same data as processing."""
+    pytest.importorskip("pyarrow")
+    expected_path = tmp_path / f"expected{suffix}"
+    options: dict[str, Any] = {
+        "by": by,
+        "include_details": True,
+        "details_format": details_format,
+    }
+    HBNData.create("tests/test_data.csv").process(str(expected_path), **options)
+    output_path = HBNData.stream(
+        "tests/test_data.csv",
+        output_path=str(tmp_path / f"streamed{suffix}"),
+        chunksize=7,
+        **options,
+    )
+    pd.testing.assert_frame_equal(read(output_path), read(str(expected_path)))
+    if details_format == "long":
+        pd.testing.assert_frame_equal(
+            read(str(tmp_path / f"streamed_details{suffix}")),
+            read(str(tmp_path / f"expected_details{suffix}")),
+        )
+    # Only the outputs are left, without the spilled chunks
+    assert not list(tmp_path.glob(".*"))
@@ -1,9 +1,16 @@
 """Tests for pivot functions."""
 
+import ast
+import itertools
+import json
+from typing import Any, Literal
+
+import numpy as np
 import pandas as pd
+import pytest
 
 from hbnddp.hbn_ddp import HBNData
-from hbnddp.pivot import Pivot
+from hbnddp.pivot import CertaintyLevel, DetailsFormat, Pivot
 
 hbn_data = HBNData.create(input_path="tests/test_data.csv")
 test_data = hbn_data.data
@@ -184,6 +191,38 @@ def test_set_time() -> None:
     )
 
 
+def test_resolve_certainties() -> None:
+    """Test resolving certainty levels for arrays of flags."""
+    flags = np.array(
+        [
+            [[0, 1, 0, 0, 0], [0, 0, 0, 0, 1]],
+            [[1, 1, 0, 0, 0], [0, 0, 0, 0, 0]],
+            [[np.nan, np.nan, 1, np.nan, np.nan], [0, 0, 0, 1, 0]],
+        ]
+    )
+    certainties = Pivot._resolve_certainties(flags)
+    assert certainties.shape == (3, 2)
+    assert certainties.tolist() == [
+        ["Confirmed", "RuleOut"],
+        ["Unknown", "Unknown"],
+        ["Presumptive", "RC"],
+    ]
+
+
+def test_resolve_times() -> None:
+    """Test resolving diagnosis times for arrays of diagnoses and time codes."""
+    diagnoses = np.array(
+        [["Enuresis", "Major Depressive Disorder"], ["Enuresis", np.nan]],
+        dtype=object,
+    )
+    time_codes = np.array([[1, 1], [2, np.nan]])
+    times = Pivot._resolve_times(diagnoses, time_codes)
+    assert times.tolist() == [
+        ["Present", "Specific Time Course"],
+        ["Past", "Unknown"],
+    ]
+
+
 def test_filter_certainty() -> None:
     """Test filtering by certainty."""
     # Test that filter passes with no filter set
@@ -256,3 +295,208 @@ def test_diagnoses() -> None:
     assert output.at[0, "ADHD_Hyperactive_Impulsive_Type_Time"] == "Present"
     assert output.at[0, "ADHD_Hyperactive_Impulsive_Type_Past_Doc"] is pd.NA
     assert output.at[0, "ADHD_Hyperactive_Impulsive_Type_Spec"] == "Specifier"
+
+
+def _two_slot_data(dx_02: str = "Major Depressive Disorder") -> pd.DataFrame:
+    """Build a single participant with the same diagnosis in two slots."""
+    prefix = "Diagnosis_ClinicianConsensus,"
+    data: dict[str, list] = {"Identifiers": ["Test1"]}
+    for n, dx, flag, code in [
+        ("01", "Major Depressive Disorder", "_RuleOut", "F32.0"),
+        ("02", dx_02, "_Confirmed", "F32.1"),
+    ]:
+        col = f"{prefix}DX_{n}"
+        data[col] = [dx]
+        data[f"{col}_Cat"] = ["Depressive Disorders"]
+        data[f"{col}_Sub"] = ["Depressive Disorders"]
+        data[f"{col}_Code"] = [code]
+        data[f"{col}_Spec"] = [None]
+        data[f"{col}_Past_Doc"] = [None]
+        data[f"{col}_Time"] = [1]
+        for suffix in ["_ByHx", "_Confirmed", "_Presum", "_RC", "_RuleOut"]:
+            data[f"{col}{suffix}"] = [1 if suffix == flag else 0]
+    return pd.DataFrame(data)
+
+
+def test_extract_slots() -> None:
+    """Test extracting the diagnosis slots into a columnar store."""
+    data = _two_slot_data(dx_02="Enuresis")
+    slots = Pivot.extract_slots(data, column_prefix="Diagnosis_ClinicianConsensus,")
+    # Only the slots present in the data are extracted
+    assert slots.n_rows == 1
+    assert slots.row.tolist() == [0, 0]
+    assert slots.slot.tolist() == [0, 1]
+    assert slots.diagnosis.tolist() == ["Major Depressive Disorder", "Enuresis"]
+    assert slots.certainty.tolist() == ["RuleOut", "Confirmed"]
+    assert slots.time.tolist() == ["Specific Time Course", "Present"]
+    assert slots.code.tolist() == ["F32.0", "F32.1"]
+    # Filtering keeps only the slots with matching certainty
+    confirmed = slots.filter(["Confirmed"])
+    assert confirmed.diagnosis.tolist() == ["Enuresis"]
+    assert slots.filter(None) is slots
+
+
+def test_diagnoses_first_matching_slot() -> None:
+    """Test that the first slot passing the filter provides the details."""
+    data = _two_slot_data()
+    output = pd.DataFrame({"Identifiers": data["Identifiers"]})
+    prefix = "Diagnosis_ClinicianConsensus,"
+
+    unfiltered = Pivot.diagnoses(data, output, column_prefix=prefix)
+    assert unfiltered.at[0, "Major_Depressive_Disorder_Certainty"] == "RuleOut"
+    assert unfiltered.at[0, "Major_Depressive_Disorder_ICD_Code"] == "F32.0"
+
+    confirmed = Pivot.diagnoses(
+        data, output, column_prefix=prefix, certainty_filter=["Confirmed"]
+    )
+    assert confirmed.at[0, "Major_Depressive_Disorder_DiagnosisPresent"] == 1
+    assert confirmed.at[0, "Major_Depressive_Disorder_Certainty"] == "Confirmed"
+    assert confirmed.at[0, "Major_Depressive_Disorder_ICD_Code"] == "F32.1"
+
+    presumptive = Pivot.diagnoses(
+        data, output, column_prefix=prefix, certainty_filter=["Presumptive"]
+    )
+    assert presumptive.at[0, "Major_Depressive_Disorder_DiagnosisPresent"] == 0
+    assert pd.isna(presumptive.at[0, "Major_Depressive_Disorder_Certainty"])
+
+
+def test_categories() -> None:
+    """Test categories pivot."""
+    output = Pivot.categories(
+        test_data,
+        test_output,
+        column_prefix="Diagnosis_ClinicianConsensus,",
+        include_details=True,
+    )
+    assert len(output) == len(test_data)
+    # Category columns are named after the category values
+    assert "Neurodevelopmental_Disorders_CategoryPresent" in output.columns
+    assert "Neurodevelopmental_Disorders_Details" in output.columns
+    assert "ADHD_Combined_Type_CategoryPresent" not in output.columns
+
+    data = _two_slot_data(dx_02="Persistent Depressive Disorder (Dysthymia)")
+    output = Pivot.categories(
+        data,
+        pd.DataFrame({"Identifiers": data["Identifiers"]}),
+        column_prefix="Diagnosis_ClinicianConsensus,",
+        certainty_filter=["Confirmed"],
+        include_details=True,
+    )
+    assert output.at[0, "Depressive_Disorders_CategoryPresent"] == 1
+    details = output.at[0, "Depressive_Disorders_Details"]
+    assert "Persistent Depressive Disorder (Dysthymia)" in details
+    assert "Major Depressive Disorder" not in details
+
+
+def test_details_formats() -> None:
+    """Test the repr, JSON and long table formats of the details."""
+    data = _two_slot_data(dx_02="Persistent Depressive Disorder (Dysthymia)")
+    output = pd.DataFrame({"Identifiers": data["Identifiers"]})
+    prefix = "Diagnosis_ClinicianConsensus,"
+    column = "Depressive_Disorders_Details"
+    expected = [
+        {
+            "diagnosis": "Major Depressive Disorder",
+            "subcategory": "Depressive Disorders",
+            "ICD_code": "F32.0",
+            "certainty": "RuleOut",
+            "time": "Specific Time Course",
+            "past_documentation": "",
+        },
+        {
+            "diagnosis": "Persistent Depressive Disorder (Dysthymia)",
+            "subcategory": "Depressive Disorders",
+            "ICD_code": "F32.1",
+            "certainty": "Confirmed",
+            "time": "Specific Time Course",
+            "past_documentation": "",
+        },
+    ]
+
+    repr_details = Pivot.categories(
+        data, output, column_prefix=prefix, include_details=True
+    ).at[0, column]
+    assert repr_details == str(expected).strip("[]")
+    assert list(ast.literal_eval(repr_details)) == expected
+
+    json_details = Pivot.categories(
+        data, output, column_prefix=prefix, include_details=True, details_format="json"
+    ).at[0, column]
+    assert json.loads(json_details) == [
+        detail | {"past_documentation": None} for detail in expected
+    ]
+
+    long = Pivot.categories(
+        data, output, column_prefix=prefix, include_details=True, details_format="long"
+    )
+    assert column not in long.columns
+    table = Pivot.details(
+        data, prefix, "categories", rows=data["Identifiers"].to_numpy()
+    )
+    assert table["Identifiers"].tolist() == ["Test1", "Test1"]
+    assert table["value"].tolist() == ["Depressive Disorders"] * 2
+    assert table["diagnosis"].tolist() == [detail["diagnosis"] for detail in expected]
+    assert table["certainty"].tolist() == ["RuleOut", "Confirmed"]
+    confirmed = Pivot.details(data, prefix, "categories", ["Confirmed"])
+    assert confirmed["Identifiers"].tolist() == [0]
+
+
+def test_compact_dtypes() -> None:
+    """Test compact and legacy dtypes of the diagnoses pivot."""
+    data = _two_slot_data()
+    output = pd.DataFrame({"Identifiers": data["Identifiers"]})
+    prefix = "Diagnosis_ClinicianConsensus,"
+    name = "Major_Depressive_Disorder"
+
+    compact = Pivot.diagnoses(data, output, column_prefix=prefix)
+    assert compact[f"{name}_DiagnosisPresent"].dtype == np.int8
+    certainty = compact[f"{name}_Certainty"]
+    assert isinstance(certainty.dtype, pd.CategoricalDtype)
+    assert list(certainty.cat.categories) == [level.value for level in CertaintyLevel]
+    assert isinstance(compact[f"{name}_Time"].dtype, pd.CategoricalDtype)
+    assert list(compact[f"{name}_Cat"].cat.categories) == ["Depressive Disorders"]
+    assert compact[f"{name}_ICD_Code"].dtype == object
+
+    legacy = Pivot.diagnoses(data, output, column_prefix=prefix, compact_dtypes=False)
+    assert legacy[f"{name}_DiagnosisPresent"].dtype == np.int64
+    for suffix in ["_Certainty", "_Time", "_Cat", "_Sub"]:
+        assert legacy[f"{name}{suffix}"].dtype == object
+    pd.testing.assert_frame_equal(
+        compact.astype(object), legacy.astype(object), check_dtype=False
+    )
+
+
+@pytest.mark.parametrize(
+    "by, details_format",
+    list(
+        itertools.product(
+            ["diagnoses", "subcategories", "categories", "all"], ["repr", "json"]
+        )
+    ),
+)
+def test_polars_backend(
+    by: Literal["diagnoses", "subcategories", "categories", "all"],
+    details_format: DetailsFormat,
+) -> None:
+    """Test that the polars backend gives the same output as the pandas backend."""
+    pytest.importorskip("polars")
+    options_list: list[dict[str, Any]] = [
+        {},
+        {"certainty_filter": ["Confirmed", "Presumptive"], "sparse": True},
+        {"certainty_filter": ["RuleOut"], "compact_dtypes": False},
+    ]
+    for options in options_list:
+        expected = HBNData.create("tests/test_data.csv").pivot(
+            by, include_details=True, details_format=details_format, **options
+        )
+        output = HBNData.create("tests/test_data.csv").pivot(
+            by,
+            include_details=True,
+            details_format=details_format,
+            backend="polars",
+            **options,
+        )
+        pd.testing.assert_frame_equal(output, expected)
+
+    with pytest.raises(ValueError):
+        hbn_data.pivot(by, backend="arrow")  # type: ignore[arg-type]
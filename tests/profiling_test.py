@@ -0,0 +1,81 @@
+"""Tests for profiling the processing stages."""
+
+import pstats
+from pathlib import Path
+
+from typer.testing import CliRunner
+
+from hbnddp.__main__ import app
+from hbnddp.hbn_ddp import HBNData
+from hbnddp.profiling import ProcessStats, Profiler, StageStats
+
+
+def test_process_stages(tmp_path: Path) -> None:
+    """Test that every stage of reading and processing is measured."""
+    finished: list[str] = []
+    profiler = Profiler(
+        hooks=[lambda stage: finished.append(stage.name)],
+        track_memory=True,
+        pivot_profile_path=str(tmp_path / "pivot.prof"),
+    )
+    hbn_data = HBNData.create("tests/test_data.csv", profiler=profiler)
+    hbn_data.process(output_path=str(tmp_path / "output.csv"), by="all")
+
+    assert hbn_data.stats is not None
+    names = [stage.name for stage in hbn_data.stats.stages]
+    assert names == [
+        "read",
+        "preprocess",
+        "copy_static_columns",
+        "extract_slots",
+        "diagnoses",
+        "subcategories",
+        "categories",
+        "write",
+    ]
+    assert finished == names
+    for stage in hbn_data.stats.stages:
+        assert stage.rows == len(hbn_data.data)
+        assert stage.seconds >= 0
+        assert stage.peak_memory is not None
+    profile = pstats.Stats(str(tmp_path / "pivot.prof"))
+    functions = {func for _, _, func in profile.stats}  # type: ignore[attr-defined]
+    assert {"diagnoses", "subcategories", "categories"} <= functions
+    assert HBNData.create("tests/test_data.csv").stats is None
+
+
+def test_stream_stages(tmp_path: Path) -> None:
+    """Test that the stages of every chunk are summed in the report."""
+    profiler = Profiler()
+    HBNData.stream(
+        "tests/test_data.csv",
+        output_path=str(tmp_path / "output.csv"),
+        by="diagnoses",
+        chunksize=30,
+        profiler=profiler,
+    )
+    totals = {stage.name: stage for stage in profiler.stats.totals()}
+    assert totals["read"].rows == 100
+    assert totals["diagnoses"].rows == 100
+    assert len([s for s in profiler.stats.stages if s.name == "diagnoses"]) == 4
+    report = profiler.stats.report()
+    assert report.count("diagnoses") == 1
+    assert report.splitlines()[-1].startswith("Total")
+
+
+def test_stage_stats() -> None:
+    """Test the rows per second and totals of stage stats."""
+    stats = ProcessStats(
+        [StageStats("read", 2.0, 100), StageStats("read", 2.0, 100, 10)]
+    )
+    assert stats.total_seconds == 4.0
+    assert stats.totals() == [StageStats("read", 4.0, 200, 10)]
+    assert stats.totals()[0].rows_per_second == 50
+
+
+def test_cli_profile_options() -> None:
+    """Test that the CLI has the profiling options."""
+    result = CliRunner().invoke(app, ["--help"])
+    assert result.exit_code == 0
+    assert "--profile" in result.output
+    assert "--pivot-profile" in result.output
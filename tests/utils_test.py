@@ -1,9 +1,21 @@
 """Test util functions."""
 
+import io
+from pathlib import Path
+
 import pandas as pd
 import plotly.graph_objects as go
+import pytest
 
-from hbnddp.utils import show, write
+from hbnddp.utils import (
+    ChunkWriter,
+    get_file_format,
+    read,
+    read_chunks,
+    read_columns,
+    show,
+    write,
+)
 
 test_data = pd.DataFrame({"x": [1, 2, 3], "y": [4, 5, 6]})
 
@@ -27,3 +39,87 @@ def test_write() -> None:
     assert os.path.exists("tests/test_data_processed_diagnoses.csv")
     # Delete created file
     os.remove("tests/test_data_processed_diagnoses.csv")
+
+
+def test_get_file_format() -> None:
+    """Test choosing file formats by extension or explicit format."""
+    assert get_file_format("data.csv") == "csv"
+    assert get_file_format("data.PARQUET") == "parquet"
+    assert get_file_format("data.arrow") == "feather"
+    assert get_file_format("data.csv", "parquet") == "parquet"
+    assert get_file_format(None) == "csv"
+    with pytest.raises(ValueError):
+        get_file_format("data.xlsx")
+    with pytest.raises(ValueError):
+        get_file_format("data.csv", "xlsx")
+
+
+@pytest.mark.parametrize("suffix", [".parquet", ".feather"])
+def test_write_read_arrow(tmp_path: Path, suffix: str) -> None:
+    """Test writing and reading Parquet and Arrow files."""
+    pytest.importorskip("pyarrow")
+    data = test_data.assign(z=pd.Categorical(["a", "b", "a"]), w=[0, 1, 0])
+    data["w"] = data["w"].astype("int8")
+    output_path = str(tmp_path / f"output{suffix}")
+    write(data, input_path="tests/test_data.csv", by="all", output_path=output_path)
+
+    assert read_columns(output_path).to_list() == ["x", "y", "z", "w"]
+    result = read(output_path, columns=["x", "z", "w"])
+    pd.testing.assert_frame_equal(result, data[["x", "z", "w"]])
+    chunks = list(read_chunks(output_path, chunksize=2, columns=["y"]))
+    assert [len(chunk) for chunk in chunks] == [2, 1]
+    assert chunks[1].index.to_list() == [2]
+    pd.testing.assert_frame_equal(pd.concat(chunks), data[["y"]])
+
+    with pytest.raises(ValueError, match="duplicate column names"):
+        write(data.set_axis(["x", "x", "z", "w"], axis=1), "", "all", output_path)
+
+
+@pytest.mark.parametrize("suffix", [".csv", ".parquet", ".feather"])
+def test_chunk_writer(tmp_path: Path, suffix: str) -> None:
+    """Test that chunks are written with the types and categories of all chunks."""
+    if suffix != ".csv":
+        pytest.importorskip("pyarrow")
+    chunks = [
+        pd.DataFrame(
+            {
+                "x": [1, 2],
+                "detail": [None, None],
+                "missing": [float("nan")] * 2,
+                "category": pd.Categorical(["b", "b"]),
+            }
+        ),
+        pd.DataFrame(
+            {
+                "x": [3.5],
+                "detail": ["text"],
+                "missing": [float("nan")],
+                "category": pd.Categorical(["a"]),
+            }
+        ),
+    ]
+    output_path = tmp_path / f"output{suffix}"
+    with ChunkWriter(str(output_path)) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    assert writer.rows == 3
+    assert [path.name for path in tmp_path.iterdir()] == [output_path.name]
+
+    result = read(str(output_path))
+    expected = pd.concat(chunks, ignore_index=True)
+    if suffix == ".csv":
+        # Appended rows read back like the whole table written at once
+        expected = pd.read_csv(io.StringIO(expected.to_csv(index=False)))
+    else:
+        expected["category"] = expected["category"].astype(
+            pd.CategoricalDtype(["a", "b"])
+        )
+    pd.testing.assert_frame_equal(result, expected)
+
+    with pytest.raises(RuntimeError):
+        with ChunkWriter(str(tmp_path / f"failed{suffix}")) as writer:
+            writer.write(chunks[0])
+            raise RuntimeError
+    # Spilled chunks are removed, and nothing but CSV rows are written
+    assert not list(tmp_path.glob(".*"))
+    assert (tmp_path / f"failed{suffix}").exists() == (suffix == ".csv")
@@ -1,7 +1,17 @@
 """Unit tests for Visualization functions in hbnpreprocess.viz module."""
 
+import os
+from contextlib import nullcontext
+from pathlib import Path
+
+import pandas as pd
+import plotly.graph_objects as go
+import plotly.io as pio
+import pytest
+
+from hbnddp import viz
 from hbnddp.hbn_ddp import HBNData
-from hbnddp.viz import _bar, _clean_label
+from hbnddp.viz import _bar, _clean_label, heatmap, visualize, visualize_counts
 
 
 def test_bar() -> None:
@@ -49,3 +59,101 @@ def test_clean_label() -> None:
         _clean_label("Anxiety_Disorders_SubcategoryPresent", "SubcategoryPresent")
         == "Anxiety"
     )
+
+
+def test_visualize_html(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that HTML plots are saved without rendering, and only once."""
+    output = HBNData.create(input_path="tests/test_data.csv").pivot(by="all")
+    monkeypatch.chdir(tmp_path)
+
+    def fail(*args: object, **kwargs: object) -> None:
+        raise AssertionError("Rendered an HTML plot")
+
+    monkeypatch.setattr(pio, "write_images", fail)
+    visualize(output, "all", image_format="html")
+    paths = sorted(path.name for path in (tmp_path / "figures").glob("*.html"))
+    assert paths == [
+        "category_bar_plot.html",
+        "diagnosis_bar_plot.html",
+        "subcategory_bar_plot.html",
+    ]
+    modified = (tmp_path / "figures" / "category_bar_plot.html").stat().st_mtime_ns
+    visualize(output, "categories", image_format="html")
+    path = tmp_path / "figures" / "category_bar_plot.html"
+    assert path.stat().st_mtime_ns == modified
+
+    with pytest.raises(ValueError):
+        visualize(output, "all", image_format="gif")  # type: ignore[arg-type]
+
+
+def test_visualize_unchanged(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that images are rendered together, and not again when unchanged."""
+    output = HBNData.create(input_path="tests/test_data.csv").pivot(by="all")
+    monkeypatch.chdir(tmp_path)
+    rendered: list[list[str]] = []
+
+    def write_images(figs: list[go.Figure], files: list[str], **kwargs: object) -> None:
+        rendered.append([os.path.basename(file) for file in files])
+        for file in files:
+            Path(file).write_bytes(b"")
+
+    monkeypatch.setattr(pio, "write_images", write_images)
+    monkeypatch.setattr(viz, "render_session", lambda n: nullcontext())
+    visualize(output, "all")
+    visualize(output, "all")
+    assert rendered == [
+        ["diagnosis_bar_plot.png", "subcategory_bar_plot.png", "category_bar_plot.png"]
+    ]
+    # Changed counts are rendered again
+    visualize(output.iloc[:10], "categories")
+    assert rendered[1:] == [["category_bar_plot.png"]]
+
+
+def test_visualize_counts(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that plots of the counts are the plots of the processed data."""
+    hbn_data = HBNData.create(input_path="tests/test_data.csv")
+    monkeypatch.chdir(tmp_path)
+    visualize(hbn_data.pivot(by="all"), "all", image_format="html")
+    expected = {path.name: path.read_text() for path in tmp_path.glob("figures/*")}
+    for path in (tmp_path / "figures").iterdir():
+        path.unlink()
+
+    hbn_data.process(
+        str(tmp_path / "output.csv"), by="all", viz=True, viz_format="html"
+    )
+    saved = {path.name: path.read_text() for path in tmp_path.glob("figures/*")}
+    assert saved.keys() == expected.keys()
+    # The digests of the figures match, not the HTML that embeds random div ids
+    assert {name: text for name, text in saved.items() if ".sha256" in name} == {
+        name: text for name, text in expected.items() if ".sha256" in name
+    }
+
+    with pytest.raises(ValueError):
+        visualize_counts({"all": pd.Series(dtype=int)}, image_format="html")
+
+
+def test_heatmap(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test saving heatmaps of the co-occurrence of values."""
+    pytest.importorskip("scipy")
+    hbn_data = HBNData.create(input_path="tests/test_data.csv")
+    cooccurrence = hbn_data.cooccurrence("categories")
+    monkeypatch.chdir(tmp_path)
+    for measure in ["count", "jaccard", "conditional"]:
+        heatmap(cooccurrence, measure, name="category", image_format="html")  # type: ignore[arg-type]
+        assert (tmp_path / "figures" / f"category_{measure}_heatmap.html").exists()
+    with pytest.raises(ValueError):
+        heatmap(cooccurrence, "lift", image_format="html")  # type: ignore[arg-type]
+
+
+def test_missing_browser(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """Test that rendering without a browser fails instead of waiting forever."""
+    from choreographer.browsers import Chromium
+    from kaleido.errors import ChromeNotFoundError
+
+    output = HBNData.create(input_path="tests/test_data.csv").pivot(by="all")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(Chromium, "find_browser", lambda **kwargs: None)
+    with pytest.raises(ChromeNotFoundError):
+        visualize(output, "categories")
+    assert viz._session_depth == 0
+    assert not (tmp_path / "figures" / "category_bar_plot.png").exists()
@@ -0,0 +1,165 @@
+"""Tests for the vocabulary registry."""
+
+import json
+import logging
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from hbnddp.batch import process_files
+from hbnddp.hbn_ddp import HBNData
+from hbnddp.pivot import Pivot
+from hbnddp.vocabulary import LEVELS, Vocabulary
+
+
+@pytest.fixture
+def hbn_data() -> HBNData:
+    """Fixture for the test data."""
+    return HBNData.create("tests/test_data.csv")
+
+
+def test_update(hbn_data: HBNData) -> None:
+    """Test registering the values, column names and hierarchy of the data."""
+    data = hbn_data._preprocessed_data
+    vocabulary = Vocabulary()
+    added = vocabulary.update(data, hbn_data.column_prefix)
+    for level in LEVELS:
+        values = Pivot._get_values(data, level, hbn_data.column_prefix)
+        assert added[level] == values
+        assert vocabulary.values[level] == values
+    assert vocabulary.columns["diagnoses"]["ADHD-Combined Type"] == "ADHD_Combined_Type"
+    assert vocabulary.parents["diagnoses"]["ADHD-Combined Type"] == (
+        "Attention-Deficit/Hyperactivity Disorder"
+    )
+    assert (
+        vocabulary.parents["subcategories"]["Attention-Deficit/Hyperactivity Disorder"]
+        == "Neurodevelopmental Disorders"
+    )
+    assert vocabulary.version == 1
+    assert vocabulary.update(data, hbn_data.column_prefix) == {}
+    assert vocabulary.version == 1
+
+
+def test_save_load(hbn_data: HBNData, tmp_path: Path) -> None:
+    """Test that a saved registry loads with the same contents."""
+    vocabulary = Vocabulary()
+    vocabulary.update(hbn_data._preprocessed_data, hbn_data.column_prefix)
+    path = tmp_path / "vocabulary.json"
+    vocabulary.save(str(path))
+    assert Vocabulary.load(str(path)) == vocabulary
+    assert Vocabulary.load_or_create(str(tmp_path / "missing.json")) == Vocabulary()
+
+    path.write_text(json.dumps({"format": 99}))
+    with pytest.raises(ValueError):
+        Vocabulary.load(str(path))
+
+
+def test_pivot_registry(hbn_data: HBNData, caplog: pytest.LogCaptureFixture) -> None:
+    """Test that pivots with a registry keep its columns and column names."""
+    vocabulary = Vocabulary()
+    vocabulary.update(hbn_data._preprocessed_data, hbn_data.column_prefix)
+    vocabulary.columns["categories"]["Depressive Disorders"] = "Depression"
+    # A subset of the participants has fewer categories
+    subset = HBNData(hbn_data.data.iloc[:5], hbn_data.column_prefix)
+    output = subset.pivot("categories", vocabulary=vocabulary)
+    present = [col for col in output.columns if col.endswith("_CategoryPresent")]
+    assert len(present) == len(vocabulary.values["categories"])
+    assert output["Depression_CategoryPresent"].sum() == 0
+
+    # A fixed registry leaves out values it does not hold
+    fixed = Vocabulary()
+    fixed.update(subset._preprocessed_data, subset.column_prefix)
+    version = fixed.version
+    with caplog.at_level(logging.WARNING):
+        output = hbn_data.pivot("categories", vocabulary=fixed, fixed_schema=True)
+    assert "left out" in caplog.text
+    assert fixed.version == version
+    present = [col for col in output.columns if col.endswith("_CategoryPresent")]
+    assert len(present) == len(fixed.values["categories"])
+
+    # An extended registry gains the values of the data
+    hbn_data.pivot("categories", vocabulary=fixed)
+    assert fixed.values["categories"] == vocabulary.values["categories"]
+    assert fixed.version == version + 1
+
+    with pytest.raises(ValueError):
+        hbn_data.pivot("categories", fixed_schema=True)
+
+
+def test_fixed_schema_unknown(
+    hbn_data: HBNData, caplog: pytest.LogCaptureFixture, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Test that a fixed schema finds unknown values without scanning the data."""
+    vocabulary = Vocabulary()
+    vocabulary.update(hbn_data._preprocessed_data, hbn_data.column_prefix)
+    missing = vocabulary.values["categories"][0]
+    fixed = Vocabulary()
+    fixed._add(
+        {
+            level: [value for value in values if value != missing]
+            for level, values in vocabulary.values.items()
+        }
+    )
+
+    def scan(*args: object) -> list[str]:
+        raise AssertionError("The data was scanned for its values")
+
+    monkeypatch.setattr(Pivot, "_get_values", scan)
+    with caplog.at_level(logging.WARNING):
+        output = hbn_data.pivot("all", vocabulary=fixed, fixed_schema=True)
+    assert f"'categories': ['{missing}']" in caplog.text
+    assert fixed.values["categories"] == vocabulary.values["categories"][1:]
+    present = [col for col in output.columns if col.endswith("_CategoryPresent")]
+    assert len(present) == len(fixed.values["categories"])
+
+
+def test_stream_fixed_schema(hbn_data: HBNData, tmp_path: Path) -> None:
+    """Test that a fixed schema streams the columns of the registry."""
+    vocabulary = Vocabulary()
+    vocabulary.update(hbn_data._preprocessed_data, hbn_data.column_prefix)
+    expected = hbn_data.pivot("all", vocabulary=vocabulary)
+    output_path = HBNData.stream(
+        "tests/test_data.csv",
+        output_path=str(tmp_path / "streamed.csv"),
+        by="all",
+        chunksize=30,
+        vocabulary=vocabulary,
+        fixed_schema=True,
+    )
+    streamed = pd.read_csv(output_path)
+    assert list(streamed.columns) == list(expected.columns)
+    present = [col for col in expected.columns if col.endswith("Present")]
+    pd.testing.assert_frame_equal(
+        streamed[present], expected[present].astype("int64"), check_dtype=False
+    )
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_process_files_vocabulary(tmp_path: Path, workers: int) -> None:
+    """Test that every file of a batch is pivoted to the registry columns."""
+    data = pd.read_csv("tests/test_data.csv")
+    inputs = [tmp_path / "few.csv", tmp_path / "all.csv"]
+    data.iloc[:5].to_csv(inputs[0], index=False)
+    data.to_csv(inputs[1], index=False)
+    path = tmp_path / "vocabulary.json"
+
+    results = process_files(
+        [str(input_path) for input_path in inputs],
+        output=str(tmp_path / "outputs"),
+        by="diagnoses",
+        vocabulary=str(path),
+        workers=workers,
+    )
+    outputs = [pd.read_csv(result.output_path) for result in results]
+    assert list(outputs[0].columns) == list(outputs[1].columns)
+    # The registry is the same as registering the whole data of every input
+    expected = Vocabulary()
+    for input_path in inputs:
+        hbn_data = HBNData.create(str(input_path))
+        expected.update(hbn_data._preprocessed_data, hbn_data.column_prefix)
+    assert Vocabulary.load(str(path)).to_dict() == expected.to_dict()
+    assert expected.version == 2
+
+    with pytest.raises(ValueError):
+        process_files([str(inputs[0])], fixed_schema=True)